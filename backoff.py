@@ -0,0 +1,26 @@
+import random
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter for reconnect loops.
+
+    Each delay is drawn uniformly from the upper half of the current
+    exponential step, so a fleet of clients that lost the same peer does not
+    reconnect in lockstep.
+    """
+
+    def __init__(self, base: float = 0.5, cap: float = 30.0, factor: float = 2.0):
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.attempt = 0
+
+    def next_delay(self) -> float:
+        delay = min(self.cap, self.base * self.factor**self.attempt)
+        if delay < self.cap:
+            self.attempt += 1
+        return random.uniform(delay / 2, delay)
+
+    def reset(self) -> None:
+        self.attempt = 0
@@ -0,0 +1,94 @@
+"""
+Microbenchmarks for the pass-through and fully validated message paths.
+
+Measures, per message, the cost of turning a device frame into the
+envelope sent to the server and of turning a server frame into the bytes
+published to a device, once with pydantic models and once with the raw
+pass-through used by default.
+
+    python -m benchmarks.fast_path -n 20000
+"""
+
+import argparse
+import json
+import timeit
+from uuid import uuid4
+
+from device_message.frame import DeviceFrame
+from pydantic_core import from_json
+
+from router.message import (
+    DEVICE_ENVELOPE,
+    DeviceRouterMessage,
+    RouterMessagePacket,
+    raw_payload,
+)
+
+DEVICE_FRAME = json.dumps(
+    {
+        "direction": 1,
+        "command": "on_measure_temperature",
+        "type": 2,
+        "scope": 2,
+        "device_id": "aa:bb:cc:dd:ee:ff",
+        "peripheral_id": 3,
+        "message_id": "0b6f4b1c",
+        "payload": {"value": 21.5, "unit": "C"},
+    }
+).encode()
+
+SERVER_FRAME = json.dumps(
+    {
+        "target": 0,
+        "message_id": str(uuid4()),
+        "payload": {
+            "direction": 1,
+            "command": "toggle",
+            "type": 1,
+            "scope": 2,
+            "device_id": "aa:bb:cc:dd:ee:ff",
+            "peripheral_id": 1,
+            "message_id": "4c1d9a02",
+            "payload": {},
+        },
+    }
+)
+
+
+def upstream_validated():
+    frame = DeviceFrame.parse(DEVICE_FRAME)
+    return DeviceRouterMessage(payload=frame.validate()).model_dump_json()
+
+
+def upstream_pass_through():
+    frame = DeviceFrame.parse(DEVICE_FRAME)
+    return DEVICE_ENVELOPE % (uuid4(), frame.raw)
+
+
+def downstream_validated():
+    message = RouterMessagePacket.model_validate_json(SERVER_FRAME).root
+    return message.payload.device_id, message.payload.model_dump_json()
+
+
+def downstream_pass_through():
+    envelope = from_json(SERVER_FRAME)
+    frame = DeviceFrame(raw_payload(SERVER_FRAME, envelope), envelope["payload"])
+    return frame.device_id, frame.raw
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--count", type=int, default=20000)
+    args = parser.parse_args()
+    for name, func in [
+        ("upstream_validated", upstream_validated),
+        ("upstream_pass_through", upstream_pass_through),
+        ("downstream_validated", downstream_validated),
+        ("downstream_pass_through", downstream_pass_through),
+    ]:
+        best = min(timeit.repeat(func, number=args.count, repeat=5))
+        print(json.dumps({"path": name, "us_per_message": best / args.count * 1e6}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+End-to-end load test of the hub against local stand-ins.
+
+Starts the in-process MQTT broker, a fake server that acks with a delay and
+loss, and simulated devices, then runs main.main() against them and
+measures:
+
+- device -> server throughput and latency
+- server -> device throughput and latency
+- recovery time after the server restarts with a backlog queued
+- memory per message queued in the outbox
+
+Everything shares one process and event loop with the hub, so absolute
+numbers include the stand-ins; compare runs made on the same machine.
+Results are printed as JSON and written to --output.
+
+    python -m benchmarks.loadtest --devices 50 -n 20000 --output run.json
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Optional
+from uuid import uuid4
+
+from benchmarks.mqtt_standin import Broker, DeviceClient
+from benchmarks.ws_standin import FakeServer
+
+ROUTER_MAC = "aa:bb:cc:dd:ee:ff"
+
+
+def device_id(index: int) -> str:
+    return "02:00:00:%02x:%02x:%02x" % (index >> 16, (index >> 8) & 255, index & 255)
+
+
+def make_frame(device: str, sent: float) -> bytes:
+    return json.dumps(
+        {
+            "direction": 1,
+            "command": "on_click",
+            "type": 2,
+            "scope": 2,
+            "device_id": device,
+            "peripheral_id": 1,
+            "message_id": uuid4().hex,
+            "payload": {"sent": sent},
+        }
+    ).encode()
+
+
+def summarize(latencies: list[float], count: int, elapsed: float) -> dict:
+    ordered = sorted(latencies) or [float("nan")]
+    return {
+        "messages": count,
+        "received": len(latencies),
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "latency_p50_ms": round(statistics.median(ordered) * 1e3, 3),
+        "latency_p99_ms": round(ordered[max(int(len(ordered) * 0.99) - 1, 0)] * 1e3, 3),
+    }
+
+
+class Devices:
+    def __init__(self, count: int):
+        self.clients = [
+            DeviceClient(device_id(i), self._on_message) for i in range(count)
+        ]
+        self.latencies: list[float] = []
+
+    def _on_message(self, payload: bytes) -> None:
+        sent = json.loads(payload).get("payload", {}).get("sent")
+        if sent is not None:
+            self.latencies.append(time.perf_counter() - sent)
+
+    async def connect(self, host: str, port: int) -> None:
+        await asyncio.gather(*(c.connect(host, port) for c in self.clients))
+
+    async def publish(self, count: int, rate: float) -> None:
+        """
+        Publish count frames round robin over the devices at rate per second.
+        """
+        start = time.perf_counter()
+        for i in range(count):
+            client = self.clients[i % len(self.clients)]
+            client.publish(make_frame(client.device_id, time.perf_counter()))
+            if i % 100 == 99:
+                delay = start + (i + 1) / rate - time.perf_counter()
+                await asyncio.sleep(max(delay, 0))
+
+    async def close(self) -> None:
+        await asyncio.gather(*(c.close() for c in self.clients))
+
+
+async def wait_for(predicate, timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+async def upstream(devices: Devices, server: FakeServer, args) -> dict:
+    before = len(server.received)
+    start = time.perf_counter()
+    await devices.publish(args.count, args.rate)
+    await wait_for(
+        lambda: len(server.received) - before >= args.count,
+        args.count / args.rate + args.timeout,
+    )
+    elapsed = server.last_received - start
+    return summarize(server.latencies[before:], args.count, elapsed)
+
+
+async def downstream(devices: Devices, server: FakeServer, args) -> dict:
+    count = args.commands
+    start = time.perf_counter()
+    for i in range(count):
+        client = devices.clients[i % len(devices.clients)]
+        await server.send_command(client.device_id, time.perf_counter())
+        if i % 100 == 99:
+            await asyncio.sleep(
+                max(start + (i + 1) / args.rate - time.perf_counter(), 0)
+            )
+    await wait_for(
+        lambda: len(devices.latencies) >= count, count / args.rate + args.timeout
+    )
+    return summarize(devices.latencies, count, time.perf_counter() - start)
+
+
+async def reconnect(devices: Devices, server: FakeServer, args) -> dict:
+    """
+    Restart the server with a backlog queued and time how long the hub takes
+    to reconnect and deliver it.
+    """
+    await server.stop()
+    before = len(server.received)
+    await devices.publish(args.backlog, args.rate)
+    await asyncio.sleep(args.downtime)
+    restarted = time.perf_counter()
+    await server.start()
+    connected = await wait_for(server.connected.is_set, args.timeout)
+    reconnected = time.perf_counter()
+    drained = await wait_for(
+        lambda: len(server.received) - before >= args.backlog, args.timeout
+    )
+    done = time.perf_counter()
+    return {
+        "backlog": args.backlog,
+        "delivered": len(server.received) - before,
+        "reconnect_seconds": round(reconnected - restarted, 3) if connected else None,
+        "recovery_seconds": round(done - restarted, 3) if drained else None,
+    }
+
+
+def queued_memory(count: int) -> dict:
+    """
+    Bytes per message held by a Router outbox that is never drained.
+    """
+    from device_message.frame import DeviceFrame
+    from router.router import Router
+
+    async def fill() -> int:
+        router = Router("ws://127.0.0.1:1/", None, None)
+        router.send_to_device = lambda frame: None
+        frames = [
+            DeviceFrame.parse(make_frame(device_id(i % 256), 0.0)) for i in range(count)
+        ]
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        for frame in frames:
+            router.send_to_server(frame)
+        used = tracemalloc.get_traced_memory()[0] - base
+        tracemalloc.stop()
+        return used
+
+    used = asyncio.run(fill())
+    return {"messages": count, "bytes_per_message": round(used / count, 1)}
+
+
+def load_main(broker: Broker, server: FakeServer, args):
+    """
+    Import main with its environment pointed at the stand-ins.
+    """
+    os.environ.update(
+        {
+            "MQTT_URL": broker.host,
+            "MQTT_PORT": str(broker.port),
+            "SERVER_URL": server.url,
+            "ROUTER_MAC": ROUTER_MAC,
+            "MQTT_ASYNCIO": "1" if args.mqtt_asyncio else "",
+            "OUTBOX_PATH": "" if args.no_store else "data/outbox.db",
+            "INTAKE_WORKERS": str(args.workers),
+            # Simulated devices publish far above the per-device limits.
+            "FLOOD_PROTECTION": "0",
+        }
+    )
+    main = importlib.import_module("main")
+    main.MQTT_PORT = broker.port
+    return main
+
+
+async def run(args) -> dict:
+    broker = Broker()
+    server = FakeServer(
+        ack_delay=args.ack_delay, loss=args.loss, resume=not args.no_resume
+    )
+    await broker.start()
+    await server.start()
+    main = load_main(broker, server, args)
+    hub = asyncio.create_task(main.main())
+    devices = Devices(args.devices)
+    results: dict = {}
+    try:
+        ready = await wait_for(
+            lambda: server.connected.is_set()
+            and broker.subscribers("hub") >= max(args.workers, 1)
+            or hub.done(),
+            args.timeout,
+        )
+        if not ready or hub.done():
+            raise RuntimeError("Hub did not connect to the stand-ins")
+        await devices.connect(broker.host, broker.port)
+        results["device_to_server"] = await upstream(devices, server, args)
+        results["server_to_device"] = await downstream(devices, server, args)
+        if args.backlog:
+            results["reconnect"] = await reconnect(devices, server, args)
+    finally:
+        hub.cancel()
+        await asyncio.gather(hub, return_exceptions=True)
+        await devices.close()
+        await server.stop()
+        await broker.stop()
+    return results
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("-n", "--count", type=int, default=10000)
+    parser.add_argument("--commands", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=2000, help="messages per second")
+    parser.add_argument("--ack-delay", type=float, default=0.005)
+    parser.add_argument("--loss", type=float, default=0.0, help="share of acks lost")
+    parser.add_argument("--backlog", type=int, default=1000)
+    parser.add_argument("--downtime", type=float, default=1.0)
+    parser.add_argument("--memory", type=int, default=20000)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--mqtt-asyncio", action="store_true")
+    parser.add_argument("--workers", type=int, default=0, help="intake processes")
+    parser.add_argument("--no-store", action="store_true")
+    parser.add_argument(
+        "--no-resume", action="store_true", help="server without session resume"
+    )
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output else None
+    sys.path.insert(0, os.getcwd())
+    os.chdir(tempfile.mkdtemp(prefix="hub-loadtest-"))
+    started = time.time()
+    results = {
+        "config": vars(args),
+        "python": platform.python_version(),
+        "started": started,
+        **asyncio.run(run(args)),
+        "memory": queued_memory(args.memory),
+    }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
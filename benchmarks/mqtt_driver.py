@@ -0,0 +1,129 @@
+"""
+Compare the threaded and asyncio MQTT drivers.
+
+Publishes device frames to the hub topic of a running broker and measures
+the time from publish until each frame reaches send_to_server, together
+with the CPU time used by the process. Do not point it at a broker that
+serves a live hub, both would consume the frames.
+
+    python -m benchmarks.mqtt_driver --host localhost --port 1883 -n 5000
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import paho.mqtt.client as mqtt
+
+from mqtt import Mqtt
+
+
+def make_frame(sent: float) -> bytes:
+    return json.dumps(
+        {
+            "direction": 1,
+            "command": "on_click",
+            "type": 2,
+            "scope": 2,
+            "device_id": "aa:bb:cc:dd:ee:ff",
+            "peripheral_id": 1,
+            "message_id": "bench",
+            "payload": {"sent": sent},
+        }
+    ).encode()
+
+
+class Sink:
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.latencies: list[float] = []
+        self.done = asyncio.Event()
+
+    def send_to_server(self, message):
+        self.latencies.append(time.perf_counter() - message.payload["sent"])
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+
+    def is_congested(self) -> bool:
+        return False
+
+
+def publish(host: str, port: int, count: int, rate: float):
+    client = mqtt.Client(
+        client_id="Hub-bench-publisher",
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+        protocol=mqtt.MQTTv5,
+    )
+    client.connect(host, port)
+    client.loop_start()
+    interval = 1 / rate
+    start = time.perf_counter()
+    for i in range(count):
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        client.publish("hub", make_frame(time.perf_counter()), qos=1)
+    time.sleep(1)
+    client.loop_stop()
+    client.disconnect()
+
+
+async def run(mode: str, args) -> dict:
+    sink = Sink(args.count)
+    hub = Mqtt(
+        args.host,
+        args.port,
+        use_asyncio=mode == "asyncio",
+        client_id=f"Hub-bench-{mode}",
+    )
+    hub.bind_router(sink)
+    hub.start()
+    while not hub.client.is_connected():
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)
+
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    publisher = loop.run_in_executor(
+        None, publish, args.host, args.port, args.count, args.rate
+    )
+    try:
+        await asyncio.wait_for(sink.done.wait(), args.count / args.rate + 30)
+    except asyncio.TimeoutError:
+        pass
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    await publisher
+    if mode == "threaded":
+        hub.client.loop_stop()
+    hub.client.disconnect()
+
+    latencies = sorted(sink.latencies) or [float("nan")]
+    return {
+        "mode": mode,
+        "received": len(sink.latencies),
+        "cpu_seconds": round(cpu, 3),
+        "cpu_per_message_us": round(cpu / max(len(sink.latencies), 1) * 1e6, 1),
+        "latency_p50_ms": round(statistics.median(latencies) * 1e3, 3),
+        "latency_p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1e3, 3),
+        "wall_seconds": round(wall, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("-n", "--count", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=1000, help="messages per second")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], action="append")
+    args = parser.parse_args()
+    for mode in args.mode or ["threaded", "asyncio"]:
+        print(json.dumps(asyncio.run(run(mode, args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Minimal in-process MQTT v5 broker and device client for benchmarks.
+
+Only what the hub and the simulated devices use is implemented: CONNECT,
+SUBSCRIBE (exact filters, trailing "#" and "$share/<group>/" shared
+subscriptions, served round robin), PUBLISH with QoS 0 and 1, PUBACK and
+PINGREQ. There is no session state, retained messages or redelivery, so it
+is only meant to measure the hub, not to stand in for a real broker.
+"""
+
+import asyncio
+import itertools
+import logging
+import struct
+from collections import defaultdict
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, value = value % 128, value // 128
+        out.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(out)
+
+
+def decode_varint(data: bytes, idx: int) -> tuple[int, int]:
+    value, shift = 0, 0
+    while True:
+        byte = data[idx]
+        idx += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, idx
+        shift += 7
+
+
+def encode_string(value: str) -> bytes:
+    raw = value.encode()
+    return struct.pack("!H", len(raw)) + raw
+
+
+def decode_string(data: bytes, idx: int) -> tuple[str, int]:
+    (length,) = struct.unpack_from("!H", data, idx)
+    idx += 2
+    return data[idx : idx + length].decode(), idx + length
+
+
+def packet(kind: int, flags: int, body: bytes) -> bytes:
+    return bytes([kind << 4 | flags]) + encode_varint(len(body)) + body
+
+
+def publish_packet(topic: str, payload: bytes, qos: int, packet_id: int) -> bytes:
+    body = encode_string(topic)
+    if qos:
+        body += struct.pack("!H", packet_id)
+    return packet(PUBLISH, qos << 1, body + b"\x00" + payload)
+
+
+async def read_packet(reader: asyncio.StreamReader) -> tuple[int, int, bytes]:
+    header = await reader.readexactly(1)
+    length, shift = 0, 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    body = await reader.readexactly(length) if length else b""
+    return header[0] >> 4, header[0] & 0x0F, body
+
+
+def parse_publish(flags: int, body: bytes) -> tuple[str, int, int, bytes]:
+    qos = (flags >> 1) & 3
+    topic, idx = decode_string(body, 0)
+    packet_id = 0
+    if qos:
+        (packet_id,) = struct.unpack_from("!H", body, idx)
+        idx += 2
+    props, idx = decode_varint(body, idx)
+    return topic, qos, packet_id, body[idx + props :]
+
+
+class _Session:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.client_id = ""
+        self.packet_ids = itertools.cycle(range(1, 65536))
+
+    def send(self, data: bytes) -> None:
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+
+class Broker:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.published = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._subscriptions: dict[str, list[tuple[_Session, int]]] = defaultdict(list)
+        self._wildcards: dict[str, list[tuple[_Session, int]]] = defaultdict(list)
+        self._shared: dict[tuple[str, str], list[tuple[_Session, int]]] = defaultdict(
+            list
+        )
+        self._turns: dict[tuple[str, str], int] = defaultdict(int)
+        self._connections: dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # Closing the clients ends their handlers with a read error
+            # instead of leaving them to be cancelled with the loop.
+            for writer in self._connections.values():
+                writer.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+
+    async def _serve(self, reader, writer) -> None:
+        session = _Session(writer)
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                kind, flags, body = await read_packet(reader)
+                if kind == CONNECT:
+                    self._on_connect(session, body)
+                elif kind == PUBLISH:
+                    self._on_publish(session, flags, body)
+                elif kind == SUBSCRIBE:
+                    self._on_subscribe(session, body)
+                elif kind == UNSUBSCRIBE:
+                    session.send(packet(UNSUBACK, 0, body[:2] + b"\x00\x00"))
+                elif kind == PINGREQ:
+                    session.send(packet(PINGRESP, 0, b""))
+                elif kind == DISCONNECT:
+                    break
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self._connections[task]
+            self._forget(session)
+            writer.close()
+
+    def _on_connect(self, session: _Session, body: bytes) -> None:
+        _, idx = decode_string(body, 0)
+        idx += 4  # level, flags, keepalive
+        props, idx = decode_varint(body, idx)
+        session.client_id, _ = decode_string(body, idx + props)
+        session.send(packet(CONNACK, 0, b"\x00\x00\x00"))
+
+    def _on_subscribe(self, session: _Session, body: bytes) -> None:
+        idx = 2
+        props, idx = decode_varint(body, idx)
+        idx += props
+        codes = bytearray()
+        while idx < len(body):
+            topic, idx = decode_string(body, idx)
+            qos = min(body[idx] & 3, 1)
+            idx += 1
+            codes.append(qos)
+            if topic.startswith("$share/"):
+                _, group, topic = topic.split("/", 2)
+                self._shared[(group, topic)].append((session, qos))
+            elif topic.endswith("#"):
+                self._wildcards[topic].append((session, qos))
+            else:
+                self._subscriptions[topic].append((session, qos))
+        session.send(packet(SUBACK, 0, body[:2] + b"\x00" + bytes(codes)))
+
+    def _on_publish(self, session: _Session, flags: int, body: bytes) -> None:
+        topic, qos, packet_id, payload = parse_publish(flags, body)
+        if qos:
+            session.send(packet(PUBACK, 0, struct.pack("!H", packet_id)))
+        self.published += 1
+        for subscriber, sub_qos in self._match(topic):
+            out_qos = min(qos, sub_qos)
+            subscriber.send(
+                publish_packet(topic, payload, out_qos, next(subscriber.packet_ids))
+            )
+
+    def subscribers(self, topic: str) -> int:
+        """
+        Number of sessions subscribed to topic, counting shared group members.
+        """
+        return len(self._subscriptions.get(topic, ())) + sum(
+            len(members)
+            for (_, topic_filter), members in self._shared.items()
+            if self._matches(topic_filter, topic)
+        )
+
+    def _match(self, topic: str):
+        yield from self._subscriptions.get(topic, ())
+        for topic_filter, subscribers in self._wildcards.items():
+            if self._matches(topic_filter, topic):
+                yield from subscribers
+        for (group, topic_filter), members in self._shared.items():
+            if members and self._matches(topic_filter, topic):
+                turn = self._turns[(group, topic_filter)]
+                self._turns[(group, topic_filter)] = turn + 1
+                yield members[turn % len(members)]
+
+    @staticmethod
+    def _matches(topic_filter: str, topic: str) -> bool:
+        if topic_filter.endswith("#"):
+            return topic.startswith(topic_filter[:-1])
+        return topic_filter == topic
+
+    def _forget(self, session: _Session) -> None:
+        for subscribers in itertools.chain(
+            self._subscriptions.values(),
+            self._wildcards.values(),
+            self._shared.values(),
+        ):
+            subscribers[:] = [entry for entry in subscribers if entry[0] is not session]
+
+
+class DeviceClient:
+    """
+    Asyncio MQTT client simulating one device: publishes to the hub topic
+    and passes every frame published to device/<device_id>/ to on_message.
+    """
+
+    def __init__(
+        self,
+        device_id: str,
+        on_message: Callable[[bytes], None],
+        hub_topic: str = "hub",
+    ):
+        self.device_id = device_id
+        self.on_message = on_message
+        self.hub_topic = hub_topic
+        self.packet_ids = itertools.cycle(range(1, 65536))
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self, host: str, port: int) -> None:
+        reader, self._writer = await asyncio.open_connection(host, port)
+        connect = (
+            encode_string("MQTT")
+            + bytes([5, 0x02])
+            + struct.pack("!H", 60)
+            + b"\x00"
+            + encode_string(f"device-{self.device_id}")
+        )
+        self._writer.write(packet(CONNECT, 0, connect))
+        await read_packet(reader)
+        subscribe = struct.pack("!H", 1) + b"\x00"
+        subscribe += encode_string(f"device/{self.device_id}/") + b"\x01"
+        self._writer.write(packet(SUBSCRIBE, 2, subscribe))
+        await read_packet(reader)
+        self._task = asyncio.create_task(self._read(reader))
+
+    def publish(self, payload: bytes, qos: int = 1, topic: str = "") -> None:
+        self._writer.write(
+            publish_packet(topic or self.hub_topic, payload, qos, next(self.packet_ids))
+        )
+
+    async def drain(self) -> None:
+        await self._writer.drain()
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                kind, flags, body = await read_packet(reader)
+                if kind != PUBLISH:
+                    continue
+                _, qos, packet_id, payload = parse_publish(flags, body)
+                if qos:
+                    self._writer.write(packet(PUBACK, 0, struct.pack("!H", packet_id)))
+                self.on_message(payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
@@ -0,0 +1,118 @@
+"""
+Replay a traffic capture against the hub.
+
+Runs main.main() against the local MQTT broker and fake server stand-ins
+and feeds them the frames the hub received in the capture (CAPTURE_PATH):
+device frames are published on their original topics, server frames are
+sent over the hub's WebSocket. Frames keep their original spacing divided
+by --speed; --speed 0 sends them back to back. The frames the hub sent
+are compared with the ones it sent while the capture was recorded.
+
+    python -m benchmarks.replay data/capture.bin --speed 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Optional
+
+from benchmarks.loadtest import load_main, wait_for
+from benchmarks.mqtt_standin import Broker, DeviceClient
+from benchmarks.ws_standin import FakeServer
+from capture import Channel, read_capture
+
+
+async def replay(path: str, broker: Broker, server: FakeServer, args) -> dict:
+    publisher = DeviceClient("replay", lambda payload: None)
+    await publisher.connect(broker.host, broker.port)
+    captured: Counter = Counter()
+    lag = 0.0
+    first: Optional[float] = None
+    start = time.perf_counter()
+    for record in read_capture(path):
+        captured[record.channel.name] += 1
+        if record.channel not in (Channel.MQTT_IN, Channel.WS_IN):
+            continue
+        if first is None:
+            first = record.at
+        if args.speed > 0:
+            due = start + (record.at - first) / args.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                lag = max(lag, -delay)
+        if record.channel == Channel.MQTT_IN:
+            publisher.publish(record.payload, topic=record.topic)
+            await publisher.drain()
+        else:
+            await server.send_raw(record.payload)
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(args.settle)
+    await publisher.close()
+    injected = captured["MQTT_IN"] + captured["WS_IN"]
+    return {
+        "captured": dict(captured),
+        "injected": injected,
+        "seconds": round(elapsed, 3),
+        "injected_per_s": round(injected / elapsed, 1) if elapsed else None,
+        "max_lag_ms": round(lag * 1e3, 3),
+        "observed": {
+            "MQTT_OUT": broker.published - captured["MQTT_IN"],
+            "WS_OUT": server.frames,
+        },
+    }
+
+
+async def run(args) -> dict:
+    broker = Broker()
+    server = FakeServer(ack_delay=args.ack_delay)
+    await broker.start()
+    await server.start()
+    main = load_main(
+        broker,
+        server,
+        SimpleNamespace(mqtt_asyncio=args.mqtt_asyncio, no_store=True, workers=0),
+    )
+    hub = asyncio.create_task(main.main())
+    try:
+        ready = await wait_for(
+            lambda: server.connected.is_set()
+            and broker.subscribers("hub")
+            or hub.done(),
+            args.timeout,
+        )
+        if not ready or hub.done():
+            raise RuntimeError("Hub did not connect to the stand-ins")
+        return await replay(args.capture, broker, server, args)
+    finally:
+        hub.cancel()
+        await asyncio.gather(hub, return_exceptions=True)
+        await server.stop()
+        await broker.stop()
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("capture")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--ack-delay", type=float, default=0.005)
+    parser.add_argument("--settle", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--mqtt-asyncio", action="store_true")
+    args = parser.parse_args(argv)
+
+    args.capture = os.path.abspath(args.capture)
+    sys.path.insert(0, os.getcwd())
+    os.chdir(tempfile.mkdtemp(prefix="hub-replay-"))
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
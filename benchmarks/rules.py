@@ -0,0 +1,108 @@
+"""
+Rule match latency with a large rule set loaded.
+
+Loads rules for a number of simulated devices, then measures the time
+from an incoming event to the action frames being ready to publish, for
+events that match a rule and for events that do not.
+
+    python -m benchmarks.rules --rules 10000
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+from device_message.frame import DeviceFrame
+from router.rules import RuleEngine
+
+
+def mac(index: int) -> str:
+    return ":".join(f"{b:02x}" for b in index.to_bytes(6, "big"))
+
+
+def frame(device_id: str, peripheral_id: int, command: str, payload) -> DeviceFrame:
+    return DeviceFrame.parse(
+        json.dumps(
+            {
+                "direction": 1,
+                "command": command,
+                "type": 2,
+                "scope": 2,
+                "device_id": device_id,
+                "peripheral_id": peripheral_id,
+                "message_id": "bench",
+                "payload": payload,
+            }
+        )
+    )
+
+
+def load(engine: RuleEngine, count: int, per_device: int):
+    for device in range(count // per_device):
+        rules = [
+            {
+                "id": f"{device}-{peripheral}",
+                "trigger": {
+                    "device_id": mac(device),
+                    "peripheral_id": peripheral,
+                    "command": "on_click",
+                },
+                "actions": [
+                    {
+                        "device_id": mac(device + 1),
+                        "peripheral_id": peripheral,
+                        "command": "toggle",
+                    }
+                ],
+            }
+            for peripheral in range(per_device)
+        ]
+        engine.update(frame(mac(device), 0, "update_rule", {"rules": rules}))
+
+
+def measure(engine: RuleEngine, events: list[DeviceFrame]) -> dict:
+    samples = []
+    for event in events:
+        start = time.perf_counter()
+        engine.match(event)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "p50_us": round(statistics.median(samples) * 1e6, 2),
+        "p99_us": round(samples[int(len(samples) * 0.99) - 1] * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rules", type=int, default=10000)
+    parser.add_argument("--per-device", type=int, default=4)
+    parser.add_argument("-n", "--events", type=int, default=20000)
+    args = parser.parse_args()
+
+    engine = RuleEngine()
+    start = time.perf_counter()
+    load(engine, args.rules, args.per_device)
+    load_seconds = time.perf_counter() - start
+
+    devices = args.rules // args.per_device
+    hits = [
+        frame(mac(i % devices), i % args.per_device, "on_click", {})
+        for i in range(args.events)
+    ]
+    misses = [
+        frame(mac(i % devices), i % args.per_device, "on_hold", {})
+        for i in range(args.events)
+    ]
+    result = {
+        "rules": len(engine),
+        "load_seconds": round(load_seconds, 3),
+        "match": measure(engine, hits),
+        "miss": measure(engine, misses),
+    }
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Fake smart home server for benchmarks.
+
+Accepts the hub's WebSocket, acks every upstream message after ack_delay
+seconds, or never with probability loss, and can push device commands
+down to the hub. Upstream device frames whose payload carries a "sent"
+perf_counter timestamp are turned into latency samples.
+
+With resume the server negotiates sequence numbers: it answers the hub's
+resume frame with the last contiguous sequence number it received and acks
+cumulatively. Its state survives stop() and start(), as a server that
+keeps its sessions across restarts would.
+"""
+
+import asyncio
+import json
+import random
+import time
+from typing import Optional
+from uuid import uuid4
+
+import websockets
+
+from router.codec import JSON, parse_subprotocol, subprotocol
+
+
+class FakeServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        ack_delay: float = 0.0,
+        loss: float = 0.0,
+        resume: bool = True,
+    ):
+        self.host = host
+        self.port = port
+        self.ack_delay = ack_delay
+        self.loss = loss
+        self.resume = resume
+        self.session = uuid4().hex
+        self.hub_session: Optional[str] = None
+        self.hub_seq = 0
+        self._seqs: set[int] = set()
+        self.seq = 0
+        self.latencies: list[float] = []
+        self.received: set[str] = set()
+        self.frames = 0
+        self.last_received = 0.0
+        self.connected = asyncio.Event()
+        self.connections = 0
+        self._websocket: Optional[websockets.ServerConnection] = None
+        self._server = None
+
+    async def start(self) -> None:
+        subprotocols = [subprotocol(JSON, True)]
+        if self.resume:
+            subprotocols.insert(0, subprotocol(JSON, True, resume=True))
+        self._server = await websockets.serve(
+            self._serve, self.host, self.port, subprotocols=subprotocols
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """
+        Close the listener and every open connection, as a server restart.
+        """
+        self.connected.clear()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}/"
+
+    async def send_command(self, device_id: str, sent: float) -> None:
+        self.seq += 1
+        frame = {
+            "target": 0,
+            "message_id": str(uuid4()),
+            "seq": self.seq,
+            "payload": {
+                "direction": 1,
+                "command": "toggle",
+                "type": 1,
+                "scope": 2,
+                "device_id": device_id,
+                "peripheral_id": 1,
+                "message_id": uuid4().hex,
+                "payload": {"sent": sent},
+            },
+        }
+        await self._websocket.send(json.dumps(frame))
+
+    async def send_raw(self, data: str | bytes) -> None:
+        await self._websocket.send(data)
+
+    async def _serve(self, websocket: websockets.ServerConnection) -> None:
+        self._websocket = websocket
+        sequenced = parse_subprotocol(websocket.subprotocol)[2]
+        self.connections += 1
+        self.connected.set()
+        try:
+            async for raw in websocket:
+                envelope = json.loads(raw)
+                self.frames += 1
+                if envelope.get("target") == 4:
+                    await websocket.send(json.dumps(self._resume(envelope)))
+                    continue
+                messages = envelope.get("messages", [envelope])
+                ids = [self._record(message) for message in messages]
+                if sequenced:
+                    # A lost cumulative ack is covered by the next one.
+                    ids = [i for i in ids if i] if random.random() >= self.loss else []
+                else:
+                    ids = [i for i in ids if i and random.random() >= self.loss]
+                if ids:
+                    asyncio.get_running_loop().call_later(
+                        self.ack_delay, self._ack, websocket, ids, sequenced
+                    )
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if self._websocket is websocket:
+                self.connected.clear()
+
+    def _record(self, message: dict) -> Optional[tuple[str, int]]:
+        if message.get("target") == 2:
+            return None
+        message_id = message["message_id"]
+        seq = message.get("seq", 0)
+        if seq:
+            self._seqs.add(seq)
+            while self.hub_seq + 1 in self._seqs:
+                self.hub_seq += 1
+                self._seqs.discard(self.hub_seq)
+        if message_id not in self.received:
+            self.received.add(message_id)
+            self.last_received = time.perf_counter()
+            payload = message.get("payload", {}).get("payload")
+            if isinstance(payload, dict) and "sent" in payload:
+                self.latencies.append(time.perf_counter() - payload["sent"])
+        return message_id, seq
+
+    def _resume(self, hello: dict) -> dict:
+        if hello["session"] != self.hub_session:
+            self.hub_session = hello["session"]
+            self.hub_seq = 0
+            self._seqs.clear()
+        return {
+            "target": 4,
+            "message_id": str(uuid4()),
+            "session": self.session,
+            "peer": self.hub_session,
+            "seq": self.hub_seq,
+        }
+
+    def _ack(
+        self,
+        websocket: websockets.ServerConnection,
+        ids: list[tuple[str, int]],
+        sequenced: bool,
+    ) -> None:
+        if sequenced:
+            # Only messages past a gap need their id acked.
+            ack = {
+                "target": 2,
+                "seq": self.hub_seq,
+                "message_ids": [i for i, seq in ids if seq > self.hub_seq],
+            }
+        else:
+            ids = [i for i, _ in ids]
+            ack = {"target": 2, "message_id": ids[0], "message_ids": ids[1:]}
+        asyncio.create_task(self._send(websocket, json.dumps(ack)))
+
+    @staticmethod
+    async def _send(websocket: websockets.ServerConnection, data: str) -> None:
+        try:
+            await websocket.send(data)
+        except websockets.ConnectionClosed:
+            pass
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FrameBridge:
+    """
+    Bounded handoff of raw frames from a foreign thread into the event loop.
+
+    The producer thread only appends to a deque, which is atomic in CPython,
+    and schedules a drain on the loop when none is pending. The loop then
+    passes the frames to the handler in batches, so parsing and validation
+    never run on the producer thread. Frames arriving while the buffer is
+    full are dropped and counted.
+
+    While is_paused returns True the loop stops draining, so a slow consumer
+    pushes back on the producer until the buffer fills.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], None],
+        maxsize: int = 10000,
+        batch_size: int = 256,
+        pause_interval: float = 0.05,
+    ):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.pause_interval = pause_interval
+        self.is_paused: Optional[Callable[[], bool]] = None
+        self.received = 0
+        self.dropped = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._frames: Deque[Any] = deque()
+        self._scheduled = False
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames)
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+
+    def put(self, frame: Any) -> bool:
+        """
+        Queue a frame from any thread. Returns False if it was dropped.
+        """
+        if len(self._frames) >= self.maxsize:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(
+                    f"Bridge full ({self.maxsize} frames), dropped {self.dropped} so far"
+                )
+            return False
+        self.received += 1
+        self._frames.append(frame)
+        if not self._scheduled:
+            self._scheduled = True
+            self.loop.call_soon_threadsafe(self._drain)
+        return True
+
+    def _drain(self) -> None:
+        if self.is_paused is not None and self.is_paused():
+            self.loop.call_later(self.pause_interval, self._drain)
+            return
+        self._scheduled = False
+        frames = self._frames
+        for _ in range(min(len(frames), self.batch_size)):
+            try:
+                self.handler(frames.popleft())
+            except Exception as e:
+                logger.error(f"Error handling bridged frame: {e}", exc_info=True)
+        if frames and not self._scheduled:
+            self._scheduled = True
+            self.loop.call_soon(self._drain)
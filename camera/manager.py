@@ -1,10 +1,12 @@
+import asyncio
 import logging
-from typing import Dict
+import time
+from typing import Callable, Dict, Optional
 
 from camera.message_payload import CameraRouterMessagePayload
+from camera.stream import CameraStream
 from device_message.enums import CameraCommand
-from subprocess import Popen, DEVNULL, TimeoutExpired
-import asyncio
+from metrics import REGISTRY
 
 from router.message import CameraRouterMessage
 
@@ -16,72 +18,173 @@ class CameraManager:
     Central manager for camera connections and WebRTC sessions.
 
     This class orchestrates the entire camera streaming system by managing:
-    - RTSP camera connections (one per camera URL)
-    - WebRTC sessions (one per client viewing a camera)
-    - Message routing between clients and camera streams
+    - RTSP camera connections (one ffmpeg relay per camera)
+    - Viewer reference counts across CAMERA_START and CAMERA_STOP
+    - Restarting relays that die and reaping the ones nobody watches
     - Resource cleanup and lifecycle management
 
-    Uses a shared connection model where multiple sessions can view the same
-    camera through a single RTSP connection via MediaRelay.
+    Every camera has its own lock, so starting one stream never waits for
+    another. A relay without viewers keeps running for idle_timeout seconds
+    so a viewer reconnecting right away does not pay for a new RTSP session,
+    and at most max_streams relays run at once.
+
+    Every stats_interval seconds the progress stats of each running relay
+    are sent upstream as a CAMERA_STATS message.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        max_streams: int = 16,
+        idle_timeout: float = 60.0,
+        output_url: str = "rtsp://172.155.0.10:8554/stream/{camera_id}",
+        stall_timeout: float = 20.0,
+        stats_interval: float = 30.0,
+    ):
         """
-        Initialize the camera manager with empty connection and session pools.
+        Initialize the camera manager with empty stream and lock pools.
         """
-        self.opened_stream: Dict[str, Popen] = {}
-        self.lock = asyncio.Lock()
+        self.max_streams = max_streams
+        self.idle_timeout = idle_timeout
+        self.output_url = output_url
+        self.stall_timeout = stall_timeout
+        self.stats_interval = stats_interval
+        self.send_to_server: Optional[Callable[[CameraRouterMessage], None]] = None
+        self.opened_stream: Dict[int, CameraStream] = {}
+        self.locks: Dict[int, asyncio.Lock] = {}
+        REGISTRY.gauge(
+            "hub_camera_processes",
+            "Running ffmpeg relays",
+            lambda: sum(
+                stream.process is not None and stream.process.returncode is None
+                for stream in self.opened_stream.values()
+            ),
+        )
+        REGISTRY.gauge(
+            "hub_camera_restarts",
+            "Restarts of the current camera relays",
+            lambda: sum(stream.restarts for stream in self.opened_stream.values()),
+        )
 
     async def on_message(self, message: CameraRouterMessage):
-        async with self.lock:
+        lock = self.locks.setdefault(message.payload.id, asyncio.Lock())
+        async with lock:
             if message.command == CameraCommand.CAMERA_START:
                 await self.start_stream(message.payload)
+            elif message.command == CameraCommand.CAMERA_STOP:
+                await self.stop_stream(message.payload)
 
     async def start_stream(self, message: CameraRouterMessagePayload):
-        if not message.rtsp:
-            return
         camera_id = message.id
-        rtsp = message.rtsp
-        if rtsp in self.opened_stream:
-            logger.info(f"pool for {rtsp} is {self.opened_stream[rtsp].poll()}")
-            if self.opened_stream[rtsp].poll() is None:
+        stream = self.opened_stream.get(camera_id)
+        if stream is not None and message.rtsp and stream.rtsp != message.rtsp:
+            logger.info(f"RTSP url of camera {camera_id} changed")
+            await stream.stop()
+            del self.opened_stream[camera_id]
+            stream = None
+        if stream is None:
+            if not message.rtsp:
+                return
+            if len(self.opened_stream) >= self.max_streams:
+                await self.reap(force=True)
+            if len(self.opened_stream) >= self.max_streams:
+                logger.warning(
+                    f"Not starting camera {camera_id}, "
+                    f"{self.max_streams} streams already running"
+                )
                 return
-        logger.info(f"Starting stream for camera {rtsp}")
-        cmd = [
-            "ffmpeg",
-            "-rtsp_transport",
-            "tcp",
-            "-i",
-            rtsp,
-            "-c:v",
-            "copy",
-            "-c:a",
-            "aac",
-            "-b:a",
-            "64k",
-            "-ar",
-            "44100",
-            "-map",
-            "0:v",
-            "-map",
-            "0:a?",
-            "-f",
-            "rtsp",
-            f"rtsp://172.155.0.10:8554/stream/{camera_id}",
-        ]
-        proc = Popen(cmd, stdout=DEVNULL, stderr=DEVNULL)
-        self.opened_stream[rtsp] = proc
-
-    async def stop_stream(self, message: CameraRouterMessage):
-        camera_id = int(message.payload.id)
-        if camera_id not in self.opened_stream:
+            stream = CameraStream(
+                camera_id,
+                message.rtsp,
+                self.output_url.format(camera_id=camera_id),
+                stall_timeout=self.stall_timeout,
+            )
+            self.opened_stream[camera_id] = stream
+        stream.viewers += 1
+        stream.idle_since = None
+        stream.start()
+
+    async def stop_stream(self, message: CameraRouterMessagePayload):
+        stream = self.opened_stream.get(message.id)
+        if stream is None or stream.viewers == 0:
             return
-        self.opened_stream[camera_id][1] -= 1
-        if self.opened_stream[camera_id][1] > 0:
+        stream.viewers -= 1
+        if stream.viewers > 0:
             return
-        self.opened_stream[camera_id][0].terminate()
+        if self.idle_timeout <= 0:
+            await self._close(stream)
+        else:
+            stream.idle_since = time.monotonic()
+
+    async def reap(self, force: bool = False) -> None:
+        """
+        Stop streams without viewers that have been idle for idle_timeout,
+        or all streams without viewers when force is set. Cameras with a
+        start or stop in progress hold their lock and are skipped.
+        """
+        now = time.monotonic()
+        for stream in list(self.opened_stream.values()):
+            if stream.idle_since is None:
+                continue
+            if not force and now - stream.idle_since < self.idle_timeout:
+                continue
+            lock = self.locks.setdefault(stream.camera_id, asyncio.Lock())
+            if lock.locked():
+                continue
+            async with lock:
+                if (
+                    stream.idle_since is None
+                    or self.opened_stream.get(stream.camera_id) is not stream
+                ):
+                    continue
+                logger.info(f"Reaping idle stream of camera {stream.camera_id}")
+                await self._close(stream)
+
+    def report_stats(self) -> None:
+        if self.send_to_server is None:
+            return
+        for stream in self.opened_stream.values():
+            stats = stream.stats.summary(stream.restarts)
+            if stats is None:
+                continue
+            if stats.below_realtime:
+                logger.warning(
+                    f"Stream of camera {stream.camera_id} runs at {stats.speed}x"
+                )
+            self.send_to_server(
+                CameraRouterMessage(
+                    command=CameraCommand.CAMERA_STATS,
+                    payload=CameraRouterMessagePayload(
+                        id=stream.camera_id, stats=stats
+                    ),
+                )
+            )
+
+    async def run(self) -> None:
         try:
-            self.opened_stream[camera_id][0].wait(timeout=5)
-        except TimeoutExpired:
-            self.opened_stream[camera_id][0].kill()
-        del self.opened_stream[camera_id]
+            await asyncio.gather(self._reap_loop(), self._stats_loop())
+        finally:
+            await asyncio.gather(
+                *(stream.stop() for stream in self.opened_stream.values())
+            )
+            self.opened_stream.clear()
+
+    async def _reap_loop(self) -> None:
+        interval = max(self.idle_timeout / 2, 1.0)
+        while True:
+            await asyncio.sleep(interval)
+            await self.reap()
+
+    async def _stats_loop(self) -> None:
+        if self.stats_interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            self.report_stats()
+
+    def bind_router(self, router):
+        self.send_to_server = router.send_camera_message
+
+    async def _close(self, stream: CameraStream) -> None:
+        if self.opened_stream.get(stream.camera_id) is stream:
+            del self.opened_stream[stream.camera_id]
+        await stream.stop()
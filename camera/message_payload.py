@@ -2,6 +2,19 @@ from typing import Optional
 from pydantic import BaseModel, Field
 
 
+class CameraStreamStats(BaseModel):
+    # None while ffmpeg reports N/A.
+    fps: Optional[float] = None
+    bitrate: Optional[float] = None
+    speed: Optional[float] = None
+    frames: int
+    drop_frames: int
+    dropped_recently: int
+    below_realtime: bool
+    restarts: int
+
+
 class CameraRouterMessagePayload(BaseModel):
     id: int
     rtsp: Optional[str] = Field(default=None)
+    stats: Optional[CameraStreamStats] = Field(default=None)
@@ -0,0 +1,94 @@
+import time
+from collections import deque
+from typing import NamedTuple, Optional
+
+from camera.message_payload import CameraStreamStats
+
+
+class ProgressSample(NamedTuple):
+    at: float
+    frame: int
+    fps: Optional[float]
+    bitrate: Optional[float]
+    drop_frames: int
+    speed: Optional[float]
+
+
+def _number(value: Optional[str], suffix: str = "") -> Optional[float]:
+    """
+    Value of a progress field, or None when it is missing or N/A.
+    """
+    if not value:
+        return None
+    try:
+        return float(value.strip().removesuffix(suffix))
+    except ValueError:
+        return None
+
+
+def parse_progress(block: dict[str, str]) -> ProgressSample:
+    """
+    Sample from one block of key=value lines written by ffmpeg -progress.
+    """
+    return ProgressSample(
+        at=time.monotonic(),
+        frame=int(_number(block.get("frame")) or 0),
+        fps=_number(block.get("fps")),
+        bitrate=_number(block.get("bitrate"), "kbits/s"),
+        drop_frames=int(_number(block.get("drop_frames")) or 0),
+        speed=_number(block.get("speed"), "x"),
+    )
+
+
+class StreamStats:
+    """
+    Ring buffer of the latest progress samples of one stream.
+
+    ffmpeg writes a block about every 0.5 s, so the default size keeps the
+    last half minute. The stream counts as below real time when the average
+    of the speeds ffmpeg reported over the buffer is under min_speed.
+    """
+
+    def __init__(self, size: int = 60, min_speed: float = 0.95):
+        self.samples: deque[ProgressSample] = deque(maxlen=size)
+        self.min_speed = min_speed
+        self.last_advance = time.monotonic()
+
+    def add(self, sample: ProgressSample) -> None:
+        latest = self.latest
+        if latest is None or sample.frame > latest.frame:
+            self.last_advance = sample.at
+        self.samples.append(sample)
+
+    @property
+    def latest(self) -> Optional[ProgressSample]:
+        return self.samples[-1] if self.samples else None
+
+    def reset(self) -> None:
+        self.samples.clear()
+        self.last_advance = time.monotonic()
+
+    def is_below_realtime(self) -> bool:
+        speeds = [s.speed for s in self.samples if s.speed is not None]
+        if not speeds or len(speeds) < self.samples.maxlen // 4:
+            return False
+        return sum(speeds) / len(speeds) < self.min_speed
+
+    def stalled_for(self) -> float:
+        return time.monotonic() - self.last_advance
+
+    def summary(self, restarts: int = 0) -> Optional[CameraStreamStats]:
+        latest = self.latest
+        if latest is None:
+            return None
+        first = self.samples[0]
+        return CameraStreamStats(
+            fps=latest.fps,
+            bitrate=latest.bitrate,
+            speed=latest.speed,
+            frames=latest.frame,
+            drop_frames=latest.drop_frames,
+            dropped_recently=max(latest.drop_frames - first.drop_frames, 0),
+            below_realtime=self.is_below_realtime(),
+            restarts=restarts,
+        )
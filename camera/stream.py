@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from asyncio.subprocess import DEVNULL, PIPE, Process
+from typing import Optional
+
+from backoff import Backoff
+from camera.stats import StreamStats, parse_progress
+
+logger = logging.getLogger(__name__)
+
+
+class CameraStream:
+    """
+    One ffmpeg process relaying a camera, restarted with backoff when it dies.
+
+    The backoff is reset once the process has stayed up for stable_after
+    seconds, so a stream that crashes once a day restarts immediately while
+    one that fails to connect does not spin.
+
+    ffmpeg reports its progress on stdout, which is parsed into stats. A
+    process whose frame count has not advanced for stall_timeout seconds is
+    killed and restarted like a crashed one; 0 disables the check.
+    """
+
+    def __init__(
+        self,
+        camera_id: int,
+        rtsp: str,
+        output: str,
+        backoff: Optional[Backoff] = None,
+        stable_after: float = 30.0,
+        stall_timeout: float = 20.0,
+        stats: Optional[StreamStats] = None,
+    ):
+        self.camera_id = camera_id
+        self.rtsp = rtsp
+        self.output = output
+        self.backoff = backoff or Backoff(base=1, cap=60)
+        self.stable_after = stable_after
+        self.stall_timeout = stall_timeout
+        self.stats = stats or StreamStats()
+        self.viewers = 0
+        self.idle_since: Optional[float] = None
+        self.restarts = 0
+        self.process: Optional[Process] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def command(self) -> list[str]:
+        return [
+            "ffmpeg",
+            "-rtsp_transport",
+            "tcp",
+            "-i",
+            self.rtsp,
+            "-progress",
+            "pipe:1",
+            "-nostats",
+            "-c:v",
+            "copy",
+            "-c:a",
+            "aac",
+            "-b:a",
+            "64k",
+            "-ar",
+            "44100",
+            "-map",
+            "0:v",
+            "-map",
+            "0:a?",
+            "-f",
+            "rtsp",
+            self.output,
+        ]
+
+    def start(self) -> None:
+        if not self.is_running:
+            self._task = asyncio.create_task(self._supervise())
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        process, self.process = self.process, None
+        if process is None or process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+    async def _supervise(self) -> None:
+        while True:
+            logger.info(f"Starting stream for camera {self.camera_id}")
+            started = time.monotonic()
+            try:
+                self.process = await self._spawn()
+                self.stats.reset()
+                await self._read_progress(self.process)
+                returncode = await self.process.wait()
+            except OSError as e:
+                returncode = None
+                logger.error(f"Failed to start ffmpeg for camera {self.camera_id}: {e}")
+            if time.monotonic() - started >= self.stable_after:
+                self.backoff.reset()
+            delay = self.backoff.next_delay()
+            self.restarts += 1
+            logger.warning(
+                f"Stream for camera {self.camera_id} exited with {returncode}, "
+                f"restarting in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
+
+    async def _read_progress(self, process: Process) -> None:
+        """
+        Collect progress blocks until ffmpeg exits or stalls.
+        """
+        block: dict[str, str] = {}
+        timeout = self.stall_timeout or None
+        while True:
+            try:
+                line = await asyncio.wait_for(process.stdout.readline(), timeout)
+            except asyncio.TimeoutError:
+                line = None
+            if line == b"":
+                return
+            if line is not None:
+                key, _, value = line.decode(errors="replace").partition("=")
+                key = key.strip()
+                block[key] = value.strip()
+                if key != "progress":
+                    continue
+                self.stats.add(parse_progress(block))
+                block = {}
+            if timeout and self.stats.stalled_for() >= timeout:
+                logger.warning(
+                    f"Stream for camera {self.camera_id} stalled, restarting it"
+                )
+                process.kill()
+                return
+
+    async def _spawn(self) -> Process:
+        spawn = asyncio.ensure_future(
+            asyncio.create_subprocess_exec(*self.command(), stdout=PIPE, stderr=DEVNULL)
+        )
+        try:
+            return await asyncio.shield(spawn)
+        except asyncio.CancelledError:
+            # Stopped while ffmpeg was starting: it is not in self.process
+            # yet, so stop() cannot reach it.
+            await asyncio.wait([spawn])
+            if not spawn.cancelled() and spawn.exception() is None:
+                process = spawn.result()
+                process.kill()
+                await process.wait()
+            raise
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import mmap
+import struct
+import threading
+import time
+from enum import IntEnum
+from typing import Iterator, NamedTuple, Union
+
+from threads import run_in_thread_to_completion
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"HUBCAP\x00\x01"
+# Wall clock time, channel, topic length, payload length.
+RECORD = struct.Struct("<dBHI")
+
+
+class Channel(IntEnum):
+    MQTT_IN = 0
+    MQTT_OUT = 1
+    WS_IN = 2
+    WS_OUT = 3
+
+
+class Record(NamedTuple):
+    at: float
+    channel: Channel
+    topic: str
+    payload: bytes
+
+
+class Capture:
+    """
+    Append-only binary log of every frame crossing the hub's edges.
+
+    Each record is a fixed header followed by the topic (MQTT only) and the
+    payload bytes exactly as sent or received. record() may be called from
+    any thread and only packs the record into a buffer under a lock; run()
+    writes the buffer to disk from a worker thread every flush_interval
+    seconds.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.records = 0
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def record(
+        self, channel: Channel, payload: Union[str, bytes], topic: str = ""
+    ) -> None:
+        if isinstance(payload, str):
+            payload = payload.encode()
+        topic_bytes = topic.encode()
+        header = RECORD.pack(time.time(), channel, len(topic_bytes), len(payload))
+        with self._lock:
+            self._buffer += header
+            self._buffer += topic_bytes
+            self._buffer += payload
+            self.records += 1
+
+    async def run(self) -> None:
+        logger.info(f"Capturing traffic to {self.path}")
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await run_in_thread_to_completion(self.flush)
+        finally:
+            self.flush()
+            self._file.close()
+
+    def flush(self) -> None:
+        with self._lock:
+            data, self._buffer = self._buffer, bytearray()
+        if data:
+            self._file.write(data)
+            self._file.flush()
+
+
+def read_capture(path: str) -> Iterator[Record]:
+    """
+    Iterate over the records of a capture through a memory map, so only
+    the records being replayed are held in memory.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        if m[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a hub capture")
+        idx = len(MAGIC)
+        while idx + RECORD.size <= len(m):
+            at, channel, topic_len, payload_len = RECORD.unpack_from(m, idx)
+            idx += RECORD.size
+            end = idx + topic_len + payload_len
+            if end > len(m):
+                logger.warning(f"Truncated record at the end of {path}")
+                return
+            topic = m[idx : idx + topic_len].decode()
+            yield Record(at, Channel(channel), topic, m[idx + topic_len : end])
+            idx = end
@@ -36,6 +36,7 @@ class CameraCommand(StrEnum):
     CAMERA_ERROR = "camera_error"
     CAMERA_START = "camera_start"
     CAMERA_STOP = "camera_stop"
+    CAMERA_STATS = "camera_stats"
 
 
 class MessageEvent(StrEnum):
@@ -113,3 +114,11 @@ class MessageCommand(StrEnum):
     ACCESS_GRANTED = "access_granted"
     ACCESS_DENIED = "access_denied"
     PLAY_SEQUENCE = "play_sequence"
+
+    # Hub diagnostics
+    DEVICE_FLOOD = "device_flood"
+
+    # Peripheral state and settings
+    GET_STATE = "get_state"
+    GET_SETTINGS = "get_settings"
+    SET_SETTINGS = "set_settings"
@@ -0,0 +1,69 @@
+from typing import Any, Optional, Union
+
+from pydantic_core import from_json
+
+from device_message.device_message import DeviceMessage
+
+
+class DeviceFrame:
+    """
+    Device message kept as the JSON text it arrived in.
+
+    Only the fields needed for routing are read from the decoded object and
+    the original text is forwarded untouched. Full validation into a
+    DeviceMessage is done on demand by validate().
+    """
+
+    __slots__ = ("raw", "data", "_message")
+
+    def __init__(self, raw: str, data: dict):
+        self.raw = raw
+        self.data = data
+        self._message: Optional[DeviceMessage] = None
+
+    @classmethod
+    def parse(cls, raw: Union[str, bytes]) -> "DeviceFrame":
+        if isinstance(raw, bytes):
+            raw = raw.decode()
+        return cls.from_data(from_json(raw), raw)
+
+    @classmethod
+    def from_data(cls, data: Any, raw: str) -> "DeviceFrame":
+        if not isinstance(data, dict):
+            raise ValueError("Device message must be a JSON object")
+        if not isinstance(data.get("device_id"), str):
+            raise ValueError("Missing device_id")
+        if not isinstance(data.get("command"), str):
+            raise ValueError("Missing command")
+        return cls(raw, data)
+
+    @classmethod
+    def from_message(cls, message: DeviceMessage) -> "DeviceFrame":
+        frame = cls(message.model_dump_json(), message.model_dump(mode="json"))
+        frame._message = message
+        return frame
+
+    @property
+    def device_id(self) -> str:
+        return self.data["device_id"]
+
+    @property
+    def command(self) -> str:
+        return self.data["command"]
+
+    @property
+    def peripheral_id(self) -> Optional[int]:
+        return self.data.get("peripheral_id")
+
+    @property
+    def message_id(self) -> Optional[str]:
+        return self.data.get("message_id")
+
+    @property
+    def payload(self) -> Any:
+        return self.data.get("payload")
+
+    def validate(self) -> DeviceMessage:
+        if self._message is None:
+            self._message = DeviceMessage.model_validate_json(self.raw)
+        return self._message
@@ -0,0 +1,345 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from multiprocessing.process import BaseProcess
+from typing import Callable, Dict, Optional
+
+import msgpack
+from pydantic import BaseModel
+
+from backoff import Backoff
+from capture import Capture, Channel
+from device_message.frame import DeviceFrame
+from logconfig import RateLimitedLogger
+from metrics import MESSAGES_RECEIVED, MQTT_TO_OUTBOX, REGISTRY, VALIDATION_FAILURES
+from router.codec import CODECS, Codec
+from router.coalescer import TELEMETRY_COMMANDS
+from router.flood import FloodGuard
+from router.state_cache import CACHED_COMMANDS
+
+logger = logging.getLogger(__name__)
+
+_error_log = RateLimitedLogger(logger)
+
+_received = MESSAGES_RECEIVED.labels("mqtt")
+_invalid = VALIDATION_FAILURES.labels("mqtt")
+
+# Fields of a device frame the uplink process routes on. The rest of the
+# message only travels as the raw text.
+ROUTING_FIELDS = (
+    "device_id",
+    "command",
+    "peripheral_id",
+    "message_id",
+    "direction",
+    "type",
+)
+
+
+class IntakeConfig(BaseModel):
+    socket_path: str
+    mqtt_url: str
+    mqtt_port: int
+    group: str = "hub-intake"
+    topics: Dict[str, str] = {"hub": "json"}
+    strict: bool = False
+    # The uplink coalescer adds stats to telemetry, which then travels whole.
+    coalesce_stats: bool = False
+    log_level: str = "INFO"
+    # Bytes buffered towards the uplink process before MQTT reads pause.
+    high_water: int = 1 << 20
+    # Seconds between the drop counts a worker reports to the uplink process.
+    stats_interval: float = 1.0
+    # Forward the MQTT frames a worker reads to the capture of the uplink
+    # process.
+    capture: bool = False
+
+
+class IntakeUplink:
+    """
+    Worker end of the intake channel, bound to the worker's Mqtt in place of
+    the Router.
+
+    Frames are written to the Unix socket as MessagePack arrays of the
+    routing fields, the whole decoded object of frames whose content the
+    uplink process reads (state cache, coalescer stats), the codec of
+    devices on binary topics and the raw JSON text. While the socket buffer
+    is above high water the worker stops reading from the broker. Frames
+    the worker could not decode or validate and its MQTT to outbox latency
+    histogram are reported as MessagePack maps of running counts. As the
+    capture of the worker's Mqtt it forwards the frames read from the
+    broker as {"capture": [channel, topic, payload]} maps.
+    """
+
+    def __init__(
+        self,
+        writer: asyncio.StreamWriter,
+        device_codecs: Dict[str, Codec],
+        config: IntakeConfig,
+    ):
+        self.writer = writer
+        self.device_codecs = device_codecs
+        self.high_water = config.high_water
+        self.whole_commands = CACHED_COMMANDS
+        if config.coalesce_stats:
+            self.whole_commands |= TELEMETRY_COMMANDS
+        self.forwarded = 0
+        self._packer = msgpack.Packer(use_bin_type=True)
+
+    def send_to_server(self, frame: DeviceFrame):
+        data = frame.data
+        codec = self.device_codecs.get(frame.device_id)
+        record = [data.get(field) for field in ROUTING_FIELDS]
+        record.append(data if frame.command in self.whole_commands else None)
+        record.append(codec.name if codec else None)
+        record.append(frame.raw)
+        self.writer.write(self._packer.pack(record))
+        self.forwarded += 1
+
+    def record(self, channel: Channel, payload, topic: str = ""):
+        self.writer.write(self._packer.pack({"capture": [channel, topic, payload]}))
+
+    def is_congested(self) -> bool:
+        return self.writer.transport.get_write_buffer_size() > self.high_water
+
+    async def report(self, interval: float):
+        sent = None
+        while True:
+            await asyncio.sleep(interval)
+            invalid = _invalid.value
+            stats = (
+                invalid,
+                _received.value - self.forwarded - invalid,
+                MQTT_TO_OUTBOX.count,
+            )
+            if stats != sent:
+                sent = stats
+                latency = [MQTT_TO_OUTBOX.counts, MQTT_TO_OUTBOX.sum, stats[2]]
+                self.writer.write(
+                    self._packer.pack(
+                        {"invalid": stats[0], "failed": stats[1], "latency": latency}
+                    )
+                )
+
+
+def run_worker(index: int, config: IntakeConfig) -> None:
+    """
+    Entry point of an intake worker process.
+    """
+    logging.basicConfig(
+        level=config.log_level,
+        format=f"%(asctime)s - intake-{index} - %(name)s - %(levelname)s - %(message)s",
+    )
+    try:
+        asyncio.run(_work(index, config))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _work(index: int, config: IntakeConfig) -> None:
+    from mqtt import Mqtt
+
+    reader, writer = await asyncio.open_unix_connection(config.socket_path)
+    mqtt = Mqtt(
+        config.mqtt_url,
+        config.mqtt_port,
+        use_asyncio=True,
+        client_id=f"Hub-intake-{index}",
+        strict=config.strict,
+        topics={topic: CODECS[codec] for topic, codec in config.topics.items()},
+        share_group=config.group,
+    )
+    uplink = IntakeUplink(writer, mqtt.device_codecs, config)
+    mqtt.bind_router(uplink)
+    if config.capture:
+        mqtt.capture = uplink
+    mqtt.start()
+    reporter = asyncio.create_task(uplink.report(config.stats_interval))
+    logger.info(f"Intake worker {index} started")
+    try:
+        await reader.read()
+        logger.warning("Intake channel closed, stopping worker")
+    finally:
+        reporter.cancel()
+        mqtt.client.disconnect()
+        writer.close()
+
+
+class IntakeWorkers:
+    """
+    Pool of MQTT intake worker processes and the uplink end of their channel.
+
+    Each worker consumes the device topics through an MQTT v5 shared
+    subscription, so the broker spreads device messages over the pool, and
+    does the decoding and validation. Only the routing fields and the raw
+    text reach this process, which applies the flood guard and hands the
+    frames to the Router, whose coalescer keeps the last value per device
+    over all workers. Frames the workers capture and their latency
+    observations are added to the capture and metrics of this process.
+    Reading the channel stops while the outbox is congested. Workers that
+    exit are restarted with backoff.
+
+    Brokers that dispatch shared subscriptions by publisher (EMQX's
+    hash_clientid strategy) keep each device on one worker and its frames
+    in order. With round robin dispatch two frames of a device that arrive
+    less than a decode apart can reach the Router swapped.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        config: IntakeConfig,
+        pause_interval: float = 0.05,
+        stable_after: float = 60.0,
+    ):
+        self.count = count
+        self.config = config
+        self.pause_interval = pause_interval
+        self.stable_after = stable_after
+        self.send_to_server: Optional[Callable[[DeviceFrame], None]] = None
+        self.is_congested: Callable[[], bool] = lambda: False
+        self.device_codecs: Dict[str, Codec] = {}
+        self.flood_guard: Optional[FloodGuard] = None
+        self.capture: Optional[Capture] = None
+        self.received = 0
+        self.failed = 0
+        self.connected = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: list[Optional[BaseProcess]] = [None] * count
+        self._started = [0.0] * count
+        self._restart_at = [0.0] * count
+        self._backoffs = [Backoff(base=1, cap=60) for _ in range(count)]
+        REGISTRY.gauge(
+            "hub_intake_workers",
+            "Intake worker processes connected",
+            lambda: self.connected,
+        )
+        REGISTRY.counter_func(
+            "hub_intake_failed_total",
+            "Frames intake workers could not decode",
+            lambda: self.failed,
+        )
+
+    def bind(self, router, mqtt):
+        self.send_to_server = router.send_to_server
+        self.is_congested = router.is_congested
+        self.device_codecs = mqtt.device_codecs
+        self.flood_guard = mqtt.flood_guard
+        self.capture = mqtt.capture
+
+    async def run(self):
+        path = self.config.socket_path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self._serve, path)
+        logger.info(f"Starting {self.count} intake workers on {path}")
+        try:
+            while True:
+                self._supervise()
+                await asyncio.sleep(1)
+        finally:
+            server.close()
+            await self._stop()
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def _supervise(self):
+        now = time.monotonic()
+        for index, process in enumerate(self._processes):
+            if process is not None and process.is_alive():
+                continue
+            if process is not None:
+                backoff = self._backoffs[index]
+                if now - self._started[index] > self.stable_after:
+                    backoff.reset()
+                delay = backoff.next_delay()
+                logger.warning(
+                    f"Intake worker {index} exited with {process.exitcode}, "
+                    f"restarting in {delay:.1f} seconds"
+                )
+                self._processes[index] = None
+                self._restart_at[index] = now + delay
+            if now < self._restart_at[index]:
+                continue
+            process = self._context.Process(
+                target=run_worker,
+                args=(index, self.config),
+                name=f"intake-{index}",
+                daemon=True,
+            )
+            process.start()
+            self._processes[index] = process
+            self._started[index] = now
+
+    async def _stop(self):
+        processes = [p for p in self._processes if p is not None]
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            await asyncio.to_thread(process.join, 5)
+            if process.is_alive():
+                process.kill()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        unpacker = msgpack.Unpacker(raw=False)
+        reported = {"invalid": 0, "failed": 0, "latency": None}
+        self.connected += 1
+        try:
+            while data := await reader.read(1 << 16):
+                unpacker.feed(data)
+                for record in unpacker:
+                    if isinstance(record, list):
+                        self._receive(record)
+                    elif "capture" in record:
+                        self._record(*record["capture"])
+                    else:
+                        self._add_stats(record, reported)
+                # Unread frames back up into the workers, which then stop
+                # reading from the broker.
+                while self.is_congested():
+                    await asyncio.sleep(self.pause_interval)
+        finally:
+            self.connected -= 1
+            writer.close()
+
+    def _receive(self, record: list):
+        _received.inc()
+        self.received += 1
+        try:
+            *fields, data, codec, raw = record
+            if data is None:
+                data = dict(zip(ROUTING_FIELDS, fields))
+            if codec:
+                self.device_codecs[data["device_id"]] = CODECS[codec]
+            frame = DeviceFrame(raw, data)
+            if self.flood_guard is not None and not self.flood_guard.admit(frame):
+                return
+            self.send_to_server(frame)
+        except Exception as e:
+            _error_log.error("Error processing intake frame: %s", e, exc_info=True)
+
+    def _record(self, channel: int, topic: str, payload: bytes):
+        if self.capture is not None:
+            self.capture.record(Channel(channel), payload, topic)
+
+    def _add_stats(self, stats: dict, reported: dict):
+        """
+        Add the frames a worker dropped and the latencies it observed since
+        its last report to the metrics of this process.
+        """
+        invalid = stats["invalid"] - reported["invalid"]
+        failed = stats["failed"] - reported["failed"]
+        counts, total, count = stats["latency"]
+        if reported["latency"] is not None:
+            last_counts, last_total, last_count = reported["latency"]
+            counts = [now - last for now, last in zip(counts, last_counts)]
+            total -= last_total
+            count -= last_count
+        reported.update(stats)
+        _received.inc(invalid + failed)
+        _invalid.inc(invalid)
+        self.failed += failed
+        MQTT_TO_OUTBOX.add(counts, total, count)
@@ -0,0 +1,111 @@
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Iterable
+
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler that hands the record over as is, so formatting the message
+    happens in the listener thread instead of the caller.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def start_queue_logging(
+    logger: logging.Logger, handlers: Iterable[logging.Handler]
+) -> QueueListener:
+    """
+    Route the records of logger through a queue to handlers, which are then
+    only run by a background thread.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    logger.addHandler(_LazyQueueHandler(log_queue))
+    listener.start()
+    return listener
+
+
+def parse_levels(spec: str) -> dict[str, str]:
+    """
+    Parse "router=DEBUG,mqtt=WARNING" into a mapping of logger to level.
+    """
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def set_levels(levels: dict[str, str]) -> None:
+    """
+    Set the level of each logger. Every level is checked first, so an
+    unknown one raises ValueError before any logger changes.
+    """
+    for name, level in levels.items():
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level {level!r} for {name!r}")
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+
+def get_levels() -> dict[str, str]:
+    levels = {"root": logging.getLevelName(logging.getLogger().level)}
+    for name, logger in sorted(logging.root.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            levels[name] = logging.getLevelName(logger.level)
+    return levels
+
+
+class RateLimitedLogger:
+    """
+    Logger wrapper for per-message events.
+
+    Records pass through a token bucket of rate per second with room for
+    burst, the rest are counted and the count is appended to the next record
+    that gets through. Arguments are only formatted for records that are
+    emitted.
+    """
+
+    def __init__(self, logger: logging.Logger, rate: float = 5.0, burst: int = 20):
+        self.logger = logger
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.suppressed = 0
+
+    def log(self, level: int, msg: str, *args, **kwargs) -> None:
+        self._log(level, msg, args, kwargs)
+
+    def debug(self, msg: str, *args, **kwargs) -> None:
+        self._log(logging.DEBUG, msg, args, kwargs)
+
+    def info(self, msg: str, *args, **kwargs) -> None:
+        self._log(logging.INFO, msg, args, kwargs)
+
+    def warning(self, msg: str, *args, **kwargs) -> None:
+        self._log(logging.WARNING, msg, args, kwargs)
+
+    def error(self, msg: str, *args, **kwargs) -> None:
+        self._log(logging.ERROR, msg, args, kwargs)
+
+    def _log(self, level: int, msg: str, args: tuple, kwargs: dict) -> None:
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            self.suppressed += 1
+            return
+        self.tokens -= 1
+        if self.suppressed:
+            msg = f"{msg} (%d similar messages suppressed)"
+            args = (*args, self.suppressed)
+            self.suppressed = 0
+        self.logger.log(level, msg, *args, stacklevel=3, **kwargs)
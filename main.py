@@ -3,8 +3,17 @@ import asyncio
 from pathlib import Path
 
 from camera.manager import CameraManager
+from capture import Capture
+from intake import IntakeConfig, IntakeWorkers
+from logconfig import parse_levels, set_levels, start_queue_logging
 from mqtt import Mqtt
+from router.codec import CODECS, JSON, MSGPACK
+from router.flood import FloodGuard
+from router.outbox import RetryPolicy
+from router.presence import PresenceRegistry
 from router.router import Router
+from router.state_cache import StateCache
+from router.store import OutboxStore
 from webapp.webapp import Webapp
 import logging
 from logging.handlers import RotatingFileHandler
@@ -14,6 +23,49 @@ MQTT_URL = os.getenv("MQTT_URL", None)
 SERVER_URL = os.getenv("SERVER_URL", None)
 ROUTER_MAC = os.getenv("ROUTER_MAC", None)
 LOGGER_LEVEL = os.getenv("LOGGER_LEVEL", None)
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_QUEUE = os.getenv("LOG_QUEUE", "1").lower() in ("1", "true", "yes")
+RETRY_INTERVAL = float(os.getenv("RETRY_INTERVAL", 5))
+RETRY_MAX_TRIES = int(os.getenv("RETRY_MAX_TRIES", 50))
+RETRY_BACKOFF = float(os.getenv("RETRY_BACKOFF", 1.0))
+RETRY_MAX_INTERVAL = float(os.getenv("RETRY_MAX_INTERVAL", 60))
+MQTT_BRIDGE_SIZE = int(os.getenv("MQTT_BRIDGE_SIZE", 10000))
+MQTT_MSGPACK_TOPIC = os.getenv("MQTT_MSGPACK_TOPIC", None)
+MQTT_ASYNCIO = os.getenv("MQTT_ASYNCIO", "").lower() in ("1", "true", "yes")
+STRICT_VALIDATION = os.getenv("STRICT_VALIDATION", "").lower() in ("1", "true", "yes")
+WS_BATCH_SIZE = int(os.getenv("WS_BATCH_SIZE", 100))
+WS_BATCH_LINGER = float(os.getenv("WS_BATCH_LINGER", 0.005))
+WS_CODEC = os.getenv("WS_CODEC", "json")
+WS_COMPRESSION = os.getenv("WS_COMPRESSION", "deflate") or None
+WS_RESUME = os.getenv("WS_RESUME", "1").lower() in ("1", "true", "yes")
+WS_RESUME_TIMEOUT = float(os.getenv("WS_RESUME_TIMEOUT", 10))
+PRESENCE_STALE_AFTER = float(os.getenv("PRESENCE_STALE_AFTER", 300))
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", 0))
+COALESCE_STATS = os.getenv("COALESCE_STATS", "").lower() in ("1", "true", "yes")
+OTA_MAX_ACTIVE = int(os.getenv("OTA_MAX_ACTIVE", 4))
+FIRMWARE_BUDGET_MB = float(os.getenv("FIRMWARE_BUDGET_MB", 64))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", None)
+FLOOD_PROTECTION = os.getenv("FLOOD_PROTECTION", "1").lower() in ("1", "true", "yes")
+FLOOD_QUIET = float(os.getenv("FLOOD_QUIET", 10))
+DEDUP_SIZE = int(os.getenv("DEDUP_SIZE", 10000))
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", 600))
+CAMERA_MAX_STREAMS = int(os.getenv("CAMERA_MAX_STREAMS", 16))
+CAMERA_IDLE_TIMEOUT = float(os.getenv("CAMERA_IDLE_TIMEOUT", 60))
+CAMERA_STALL_TIMEOUT = float(os.getenv("CAMERA_STALL_TIMEOUT", 20))
+CAMERA_STATS_INTERVAL = float(os.getenv("CAMERA_STATS_INTERVAL", 30))
+CAPTURE_PATH = os.getenv("CAPTURE_PATH", None)
+# With the cache on, unchanged device reports only reach the server every
+# STATE_REPORT_REFRESH seconds, which must stay below its liveness timeout.
+STATE_CACHE = os.getenv("STATE_CACHE", "0").lower() in ("1", "true", "yes")
+STATE_CACHE_PATH = os.getenv("STATE_CACHE_PATH", "data/state_cache.json")
+STATE_CACHE_MAX_AGE = float(os.getenv("STATE_CACHE_MAX_AGE", 300))
+STATE_REPORT_REFRESH = float(os.getenv("STATE_REPORT_REFRESH", 900))
+INTAKE_WORKERS = int(os.getenv("INTAKE_WORKERS", 0))
+INTAKE_SOCKET = os.getenv("INTAKE_SOCKET", "data/intake.sock")
+INTAKE_GROUP = os.getenv("INTAKE_GROUP", "hub-intake")
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "data/outbox.db")
+OUTBOX_COMMIT_INTERVAL = float(os.getenv("OUTBOX_COMMIT_INTERVAL", 0.05))
+OUTBOX_SYNCHRONOUS = os.getenv("OUTBOX_SYNCHRONOUS", "NORMAL")
 
 LOG_DIR = Path("logs")
 LOG_DIR.mkdir(exist_ok=True)
@@ -29,7 +81,6 @@ def format_loggers():
 
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
-    console_handler.setLevel(logger_level)
 
     file_handler = RotatingFileHandler(
         filename=LOG_DIR / "router.log",
@@ -39,24 +90,122 @@ def format_loggers():
     )
 
     file_handler.setFormatter(formatter)
-    file_handler.setLevel(logger_level)
 
+    # Levels are set on the loggers only, so a subsystem switched to DEBUG at
+    # runtime is not filtered out again by the handlers.
+    set_levels(parse_levels(LOG_LEVELS))
+    if LOG_QUEUE:
+        return start_queue_logging(logger, [console_handler, file_handler])
     logger.addHandler(console_handler)
     logger.addHandler(file_handler)
 
 
 async def main():
     server_url = SERVER_URL + ROUTER_MAC + "/"
-    camera_manager = CameraManager()
-    mqtt = Mqtt(MQTT_URL, MQTT_PORT)
-    webapp = Webapp(mqtt)
-    router = Router(server_url, camera_manager, webapp)
+    camera_manager = CameraManager(
+        max_streams=CAMERA_MAX_STREAMS,
+        idle_timeout=CAMERA_IDLE_TIMEOUT,
+        stall_timeout=CAMERA_STALL_TIMEOUT,
+        stats_interval=CAMERA_STATS_INTERVAL,
+    )
+    capture = Capture(CAPTURE_PATH) if CAPTURE_PATH else None
+    topics = {"hub": JSON}
+    if MQTT_MSGPACK_TOPIC:
+        topics[MQTT_MSGPACK_TOPIC] = MSGPACK
+    intake = None
+    if INTAKE_WORKERS > 0:
+        intake = IntakeWorkers(
+            INTAKE_WORKERS,
+            IntakeConfig(
+                socket_path=INTAKE_SOCKET,
+                mqtt_url=MQTT_URL,
+                mqtt_port=MQTT_PORT,
+                group=INTAKE_GROUP,
+                topics={topic: codec.name for topic, codec in topics.items()},
+                strict=STRICT_VALIDATION,
+                coalesce_stats=COALESCE_STATS,
+                log_level=LOGGER_LEVEL.upper() if LOGGER_LEVEL else "INFO",
+                capture=capture is not None,
+            ),
+        )
+    mqtt = Mqtt(
+        MQTT_URL,
+        MQTT_PORT,
+        bridge_size=MQTT_BRIDGE_SIZE,
+        use_asyncio=MQTT_ASYNCIO,
+        strict=STRICT_VALIDATION,
+        topics=topics,
+        flood_guard=FloodGuard(quiet=FLOOD_QUIET) if FLOOD_PROTECTION else None,
+        capture=capture,
+        consume=intake is None,
+    )
+    webapp = Webapp(
+        mqtt,
+        max_active_downloads=OTA_MAX_ACTIVE,
+        firmware_budget=int(FIRMWARE_BUDGET_MB * 1024 * 1024),
+        admin_token=ADMIN_TOKEN,
+    )
+    retry_policy = RetryPolicy(
+        interval=RETRY_INTERVAL,
+        max_tries=RETRY_MAX_TRIES,
+        backoff=RETRY_BACKOFF,
+        max_interval=RETRY_MAX_INTERVAL,
+    )
+    store = None
+    if OUTBOX_PATH:
+        store = OutboxStore(
+            OUTBOX_PATH,
+            commit_interval=OUTBOX_COMMIT_INTERVAL,
+            synchronous=OUTBOX_SYNCHRONOUS,
+        )
+    state_cache = None
+    if STATE_CACHE:
+        state_cache = StateCache(
+            STATE_CACHE_PATH or None,
+            max_age=STATE_CACHE_MAX_AGE,
+            refresh_interval=STATE_REPORT_REFRESH,
+        )
+    router = Router(
+        server_url,
+        camera_manager,
+        webapp,
+        retry_policy,
+        store,
+        strict=STRICT_VALIDATION,
+        batch_size=WS_BATCH_SIZE,
+        batch_linger=WS_BATCH_LINGER,
+        codec=CODECS[WS_CODEC],
+        compression=WS_COMPRESSION,
+        presence=PresenceRegistry(PRESENCE_STALE_AFTER),
+        coalesce_window=COALESCE_WINDOW,
+        coalesce_stats=COALESCE_STATS,
+        dedup_size=DEDUP_SIZE,
+        dedup_ttl=DEDUP_TTL,
+        capture=capture,
+        state_cache=state_cache,
+        resume=WS_RESUME,
+        resume_timeout=WS_RESUME_TIMEOUT,
+    )
     mqtt.bind_router(router)
     router.bind_broker(mqtt)
+    camera_manager.bind_router(router)
+    if intake:
+        intake.bind(router, mqtt)
     mqtt.start()
-    t1 = asyncio.create_task(webapp.start())
-    t2 = asyncio.create_task(router.start())
-    await asyncio.gather(t1, t2)
+    tasks = [
+        asyncio.create_task(webapp.start()),
+        asyncio.create_task(router.start()),
+        asyncio.create_task(camera_manager.run()),
+    ]
+    if store:
+        tasks.append(asyncio.create_task(store.run()))
+    if capture:
+        tasks.append(asyncio.create_task(capture.run()))
+    if intake:
+        tasks.append(asyncio.create_task(intake.run()))
+    if state_cache:
+        tasks.append(asyncio.create_task(state_cache.run()))
+    await asyncio.gather(*tasks)
 
 
 if __name__ == "__main__":
@@ -68,9 +217,15 @@ if __name__ == "__main__":
         raise ValueError("SERVER_URL is not set")
     if not ROUTER_MAC:
         raise ValueError("ROUTER_MAC is not set")
+    if WS_CODEC not in CODECS:
+        raise ValueError(f"WS_CODEC must be one of {', '.join(CODECS)}")
     try:
         MQTT_PORT = int(MQTT_PORT)
     except ValueError:
         raise ValueError("MQTT_PORT must be an integer")
-    format_loggers()
-    asyncio.run(main())
+    listener = format_loggers()
+    try:
+        asyncio.run(main())
+    finally:
+        if listener:
+            listener.stop()
@@ -0,0 +1,215 @@
+import math
+from bisect import bisect_left
+from typing import Callable, Iterable, Iterator, Sequence, Union
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.value = 0
+        self._children: dict[tuple[str, ...], Counter] = {}
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def labels(self, *values: str) -> "Counter":
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = Counter(self.name, self.help)
+        return child
+
+    def samples(self) -> Iterator[str]:
+        if not self.labelnames:
+            yield f"{self.name} {_number(self.value)}"
+        for values, child in self._children.items():
+            yield f"{self.name}{_labels(self.labelnames, values)} {_number(child.value)}"
+
+
+LabeledValues = Iterable[tuple[Sequence[str], float]]
+
+
+class Gauge:
+    """
+    Gauge read from a callback when the metrics are collected, so the hot
+    path never has to update it. With labelnames the callback returns
+    (label values, value) pairs.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        read: Callable[[], Union[float, LabeledValues]],
+        labelnames: Sequence[str] = (),
+    ):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> Iterator[str]:
+        if not self.labelnames:
+            yield f"{self.name} {_number(self.read())}"
+            return
+        for values, value in self.read():
+            yield f"{self.name}{_labels(self.labelnames, values)} {_number(value)}"
+
+
+class CounterFunc(Gauge):
+    """
+    Counter read from a callback, for monotonic counts a component already
+    keeps.
+    """
+
+    kind = "counter"
+
+
+class Histogram:
+    """
+    Histogram with fixed buckets. An observation only bumps one slot of a
+    preallocated list; the cumulative counts are built when collected.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def add(self, counts: Sequence[int], sum: float, count: int) -> None:
+        """
+        Add observations made elsewhere, given as per-bucket counts.
+        """
+        for index, value in enumerate(counts):
+            self.counts[index] += value
+        self.sum += sum
+        self.count += count
+
+    def samples(self) -> Iterator[str]:
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            total += count
+            yield f'{self.name}_bucket{{le="{_number(bound)}"}} {total}'
+        yield f"{self.name}_sum {_number(self.sum)}"
+        yield f"{self.name}_count {self.count}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Counter | Gauge | CounterFunc | Histogram] = {}
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(
+        self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._add(Histogram(name, help, buckets))
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        read: Callable[[], Union[float, LabeledValues]],
+        labelnames: Sequence[str] = (),
+    ) -> Gauge:
+        """
+        Register a gauge, replacing an earlier one of the same name so a
+        component created again reports its own state.
+        """
+        gauge = Gauge(name, help, read, labelnames)
+        self.metrics[name] = gauge
+        return gauge
+
+    def counter_func(
+        self,
+        name: str,
+        help: str,
+        read: Callable[[], Union[float, LabeledValues]],
+        labelnames: Sequence[str] = (),
+    ) -> CounterFunc:
+        """
+        Register a callback counter, replacing an earlier one like gauge().
+        """
+        counter = CounterFunc(name, help, read, labelnames)
+        self.metrics[name] = counter
+        return counter
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        lines.append("")
+        return "\n".join(lines)
+
+    def _add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+
+REGISTRY = Registry()
+
+MQTT_TO_OUTBOX = REGISTRY.histogram(
+    "hub_mqtt_to_outbox_seconds", "Time from MQTT receive to outbox enqueue"
+)
+OUTBOX_TO_SEND = REGISTRY.histogram(
+    "hub_outbox_to_send_seconds", "Time from outbox enqueue to first WebSocket send"
+)
+ACK_ROUND_TRIP = REGISTRY.histogram(
+    "hub_ack_round_trip_seconds", "Time from the last WebSocket send to its ack"
+)
+MESSAGES_RECEIVED = REGISTRY.counter(
+    "hub_messages_received_total", "Frames received", ["source"]
+)
+MESSAGES_SENT = REGISTRY.counter(
+    "hub_messages_sent_total", "Frames sent", ["destination"]
+)
+OUTBOX_RETRIES = REGISTRY.counter(
+    "hub_outbox_retries_total", "Messages sent again for lack of an ack"
+)
+OUTBOX_DROPS = REGISTRY.counter(
+    "hub_outbox_dropped_total", "Messages dropped from the outbox", ["reason"]
+)
+VALIDATION_FAILURES = REGISTRY.counter(
+    "hub_validation_failures_total", "Frames that failed to validate", ["source"]
+)
+FIRMWARE_BYTES = REGISTRY.counter(
+    "hub_firmware_bytes_total", "Firmware bytes transferred", ["direction"]
+)
@@ -1,28 +1,114 @@
+import asyncio
 import logging
+import threading
 import time
 from collections import deque
-from typing import Deque
+from typing import Deque, Dict, Optional
 
 import paho.mqtt.client as mqtt
 from paho.mqtt.properties import PacketTypes, Properties
 from pydantic import ValidationError
 
-from device_message.device_message import DeviceMessage
+from backoff import Backoff
+from bridge import FrameBridge
+from capture import Capture, Channel
 from device_message.enums import MessageCommand
+from device_message.frame import DeviceFrame
+from logconfig import RateLimitedLogger
+from metrics import (
+    MESSAGES_RECEIVED,
+    MESSAGES_SENT,
+    MQTT_TO_OUTBOX,
+    REGISTRY,
+    VALIDATION_FAILURES,
+)
+from router.codec import JSON, Codec, to_text
+from router.flood import FloodGuard
 
 logger = logging.getLogger(__name__)
 
+_error_log = RateLimitedLogger(logger)
+
+_received = MESSAGES_RECEIVED.labels("mqtt")
+_sent = MESSAGES_SENT.labels("mqtt")
+_invalid = VALIDATION_FAILURES.labels("mqtt")
+
 
 class Mqtt:
-    def __init__(self, ip: str, port: int, keepalive: int = 60):
+    """
+    MQTT side of the hub.
+
+    By default paho runs its own network thread and frames are handed to the
+    event loop through a FrameBridge. With use_asyncio the client is driven
+    from the event loop itself: the socket is watched with add_reader and
+    add_writer, loop_misc runs as a task and reconnects use jittered
+    exponential backoff instead of sleeping in the network thread. Connects
+    run in an executor, so paho's socket callbacks reach the loop through
+    call_soon_threadsafe. paho closes the socket as soon as the close
+    callbacks return, so those wait until the loop has dropped its watchers.
+
+    Every subscribed topic has its own codec. A device that publishes on a
+    binary topic gets its commands back in the same encoding.
+
+    With share_group the topics are consumed through an MQTT v5 shared
+    subscription, so the broker spreads them over every client of the group.
+    With consume off the client only publishes to devices.
+    """
+
+    def __init__(
+        self,
+        ip: str,
+        port: int,
+        keepalive: int = 60,
+        bridge_size: int = 10000,
+        use_asyncio: bool = False,
+        client_id: str = "Hub",
+        strict: bool = False,
+        topics: Optional[Dict[str, Codec]] = None,
+        flood_guard: Optional[FloodGuard] = None,
+        capture: Optional[Capture] = None,
+        share_group: Optional[str] = None,
+        consume: bool = True,
+    ):
         self.ip = ip
         self.port = port
         self.keepalive = keepalive
+        self.use_asyncio = use_asyncio
+        self.strict = strict
+        self.topics = topics or {"hub": JSON}
+        self.device_codecs: Dict[str, Codec] = {}
+        self.flood_guard = flood_guard
+        self.capture = capture
+        self.share_group = share_group
+        self.consume = consume
         self.send_to_server = None
-        self.message_queue: Deque[DeviceMessage] = deque()
+        self.message_queue: Deque[DeviceFrame] = deque()
+        self.bridge = FrameBridge(self._handle_frame, maxsize=bridge_size)
+        REGISTRY.gauge(
+            "hub_bridge_depth",
+            "Frames waiting in the MQTT bridge",
+            lambda: self.bridge.depth,
+        )
+        REGISTRY.counter_func(
+            "hub_bridge_dropped_total",
+            "Frames dropped because the MQTT bridge was full",
+            lambda: self.bridge.dropped,
+        )
+        if flood_guard is not None:
+            REGISTRY.counter_func(
+                "hub_flood_dropped_total",
+                "Frames dropped by per-device rate limits",
+                lambda: flood_guard.dropped,
+            )
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.backoff = Backoff(base=1, cap=60)
+        self._misc_task: Optional[asyncio.Task] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._reading_paused = False
+        self.is_congested = lambda: False
 
         self.client = mqtt.Client(
-            client_id="Hub",
+            client_id=client_id,
             callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
             protocol=mqtt.MQTTv5,
             reconnect_on_failure=True,
@@ -32,59 +118,207 @@ class Mqtt:
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
         self.client.on_connect_fail = self.on_connect_fail
+        if use_asyncio:
+            self.client.on_socket_open = self._on_socket_open
+            self.client.on_socket_close = self._on_socket_close
+            self.client.on_socket_register_write = self._on_socket_register_write
+            self.client.on_socket_unregister_write = self._on_socket_unregister_write
 
     def on_connect(self, client, userdata, flags, reasonCode, properties):
-        self.client.subscribe("hub", qos=1)
+        for topic in self.topics if self.consume else ():
+            if self.share_group:
+                topic = f"$share/{self.share_group}/{topic}"
+            self.client.subscribe(topic, qos=1)
         logger.info("Connected to MQTT broker")
+        self.backoff.reset()
         while len(self.message_queue) > 0:
-            self.send_to_server(self.message_queue.popleft())
+            self.send_to_device(self.message_queue.popleft())
 
-    def on_disconnect(self, client, userdata, reasonCode, properties, *args):
+    def on_disconnect(self, client, userdata, flags, reasonCode, properties):
+        if reasonCode == 0 and not flags.is_disconnect_packet_from_server:
+            # Our own disconnect(), nothing to reconnect.
+            return
+        if self.use_asyncio:
+            self._schedule_reconnect(self.backoff.next_delay())
+            return
         self._connect()
 
     def on_connect_fail(self, client, userdata):
-        time.sleep(5)
+        delay = self.backoff.next_delay()
+        if self.use_asyncio:
+            self.loop.call_soon_threadsafe(self._schedule_reconnect, delay)
+            return
+        logger.warning(f"MQTT connection failed. Retrying in {delay:.1f} seconds...")
+        time.sleep(delay)
         self._connect()
 
     def on_message(self, client, userdata, message):
         if not message.payload:
             return
+        if self.capture is not None:
+            self.capture.record(Channel.MQTT_IN, message.payload, message.topic)
+        if self.use_asyncio:
+            self._handle_frame(message)
+            if self.is_congested():
+                self._pause_reading()
+            return
+        self.bridge.put(message)
+
+    def _handle_frame(self, message: mqtt.MQTTMessage):
+        _received.inc()
         try:
-            self.send_to_server(
-                DeviceMessage.model_validate_json(message.payload.decode())
-            )
+            codec = self.topics.get(message.topic, JSON)
+            data, text = codec.decode(message.payload)
+            frame = DeviceFrame.from_data(data, to_text(data, text))
+            if codec.binary:
+                self.device_codecs[frame.device_id] = codec
+            if self.flood_guard is not None and not self.flood_guard.admit(frame):
+                return
+            if self.strict:
+                frame.validate()
+            self.send_to_server(frame)
+            if message.timestamp:
+                MQTT_TO_OUTBOX.observe(time.monotonic() - message.timestamp)
         except ValidationError as e:
-            logger.error(f"Invalid message format: {e}", exc_info=True)
+            _invalid.inc()
+            _error_log.error("Invalid message format: %s", e, exc_info=True)
         except Exception as e:
-            logger.error(f"Error processing incoming message: {e}", exc_info=True)
-        except KeyError as e:
-            logger.error(f"Missing required field in message: {e}", exc_info=True)
+            _error_log.error("Error processing incoming message: %s", e, exc_info=True)
 
-    def send_to_device(self, message: DeviceMessage):
+    def send_to_device(self, frame: DeviceFrame):
 
         if not self.client.is_connected():
-            self.message_queue.append(message)
-            return
-        if message.command == MessageCommand.GET_CONNECTED_DEVICES.value:
-            self.client.publish(f"device/broadcast/", message.model_dump_json(), qos=1)
+            self.message_queue.append(frame)
             return
-        self.client.publish(
-            f"device/{message.device_id}/", message.model_dump_json(), qos=1
-        )
+        _sent.inc()
+        if frame.command == MessageCommand.GET_CONNECTED_DEVICES.value:
+            topic, payload = f"device/broadcast/", frame.raw
+        else:
+            codec = self.device_codecs.get(frame.device_id, JSON)
+            topic, payload = f"device/{frame.device_id}/", codec.encode(frame.raw)
+        if self.capture is not None:
+            self.capture.record(Channel.MQTT_OUT, payload, topic)
+        self.client.publish(topic, payload, qos=1)
 
     def bind_router(self, router):
         self.send_to_server = router.send_to_server
+        if self.flood_guard is not None:
+            # Generated by the hub, so not a device frame for dedup, presence,
+            # rules or the state cache.
+            self.flood_guard.report = router._enqueue
+        self.is_congested = router.is_congested
+        self.bridge.is_paused = router.is_congested
 
     def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.bridge.bind_loop(self.loop)
+        if self.use_asyncio:
+            self._schedule_reconnect()
+            return
         self._connect()
         self.client.loop_start()
 
     def _connect(self):
         try:
-            props = Properties(PacketTypes.CONNECT)
-            props.SessionExpiryInterval = 3600
-            self.client.connect(
-                self.ip, self.port, self.keepalive, clean_start=False, properties=props
-            )
+            self._connect_once()
         except ConnectionRefusedError:
             logger.warning("Connection refused. Retrying in 5 seconds...")
+
+    def _schedule_reconnect(self, delay: float = 0):
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = self.loop.create_task(self._reconnect(delay))
+
+    async def _reconnect(self, delay: float):
+        await asyncio.sleep(delay)
+        while not self.client.is_connected():
+            try:
+                # connect() resolves and opens the socket, keep it off the loop.
+                await self.loop.run_in_executor(None, self._connect_once)
+                return
+            except OSError as e:
+                delay = self.backoff.next_delay()
+                logger.warning(
+                    f"MQTT connection failed: {e}. Retrying in {delay:.1f} seconds..."
+                )
+                await asyncio.sleep(delay)
+
+    def _connect_once(self):
+        props = Properties(PacketTypes.CONNECT)
+        props.SessionExpiryInterval = 3600
+        self.client.connect(
+            self.ip, self.port, self.keepalive, clean_start=False, properties=props
+        )
+
+    def _on_socket_open(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self._watch_socket, sock)
+
+    def _watch_socket(self, sock):
+        if self.client.socket() is not sock:
+            return
+        self.loop.add_reader(sock, self.client.loop_read)
+        if self._misc_task is None or self._misc_task.done():
+            self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._run_on_loop(self._unwatch_socket, sock)
+
+    def _unwatch_socket(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self._watch_writes, sock)
+
+    def _watch_writes(self, sock):
+        if self.client.socket() is sock:
+            self.loop.add_writer(sock, self.client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._run_on_loop(self.loop.remove_writer, sock)
+
+    def _run_on_loop(self, fn, *args):
+        """
+        Run fn on the loop and return once it has run.
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            fn(*args)
+            return
+        if self.loop.is_closed():
+            return
+        done = threading.Event()
+
+        def run():
+            try:
+                fn(*args)
+            finally:
+                done.set()
+
+        self.loop.call_soon_threadsafe(run)
+        # A loop that is shutting down may never get to it.
+        done.wait(1.0)
+
+    def _pause_reading(self):
+        sock = self.client.socket()
+        if sock is None or self._reading_paused:
+            return
+        logger.warning("Outbox congested, pausing MQTT intake")
+        self._reading_paused = True
+        self.loop.remove_reader(sock)
+        self.loop.call_later(self.bridge.pause_interval, self._resume_reading)
+
+    def _resume_reading(self):
+        if self.is_congested():
+            self.loop.call_later(self.bridge.pause_interval, self._resume_reading)
+            return
+        self._reading_paused = False
+        sock = self.client.socket()
+        if sock is not None:
+            self.loop.add_reader(sock, self.client.loop_read)
+
+    async def _misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
@@ -0,0 +1,116 @@
+import asyncio
+from typing import Callable, Iterable, Optional
+
+from device_message.enums import MessageCommand, MessageDirection
+from device_message.frame import DeviceFrame
+from router.codec import to_text
+
+TELEMETRY_COMMANDS = frozenset(
+    {
+        MessageCommand.ON_MEASURE_TEMPERATURE,
+        MessageCommand.ON_MEASURE_HUMIDITY,
+        MessageCommand.ON_MOTION,
+    }
+)
+
+CoalesceKey = tuple[str, Optional[int], str]
+
+
+class _Window:
+    __slots__ = ("latest", "count", "low", "high", "total")
+
+    def __init__(self):
+        self.latest: Optional[DeviceFrame] = None
+        self.count = 0
+        self.low = float("inf")
+        self.high = float("-inf")
+        self.total = 0.0
+
+
+class Coalescer:
+    """
+    Rate limits telemetry events per (device_id, peripheral_id, command).
+
+    The first event of a key is forwarded at once and opens a window; events
+    arriving inside the window only replace the latest one, which is
+    forwarded when the window closes and opens the next window. With stats
+    enabled the forwarded event gets the min, max and average of the numeric
+    value_field over the events it replaced. Results and commands outside
+    the telemetry set are always forwarded untouched.
+    """
+
+    def __init__(
+        self,
+        forward: Callable[[DeviceFrame], None],
+        window: float = 1.0,
+        commands: Iterable[str] = TELEMETRY_COMMANDS,
+        stats: bool = False,
+        value_field: str = "value",
+    ):
+        self.forward = forward
+        self.window = window
+        self.commands = frozenset(commands)
+        self.stats = stats
+        self.value_field = value_field
+        self.coalesced = 0
+        self._windows: dict[CoalesceKey, _Window] = {}
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    def submit(self, frame: DeviceFrame) -> None:
+        if (
+            self.window <= 0
+            or frame.command not in self.commands
+            or frame.data.get("direction") == MessageDirection.RESULT.value
+        ):
+            self.forward(frame)
+            return
+        key = (frame.device_id, frame.peripheral_id, frame.command)
+        window = self._windows.get(key)
+        if window is None:
+            self._open(key)
+            self.forward(frame)
+            return
+        if window.latest is not None:
+            self.coalesced += 1
+        window.latest = frame
+        if self.stats:
+            self._record(window, frame)
+
+    def _open(self, key: CoalesceKey) -> None:
+        self._windows[key] = _Window()
+        asyncio.get_running_loop().call_later(self.window, self._close, key)
+
+    def _close(self, key: CoalesceKey) -> None:
+        window = self._windows.pop(key)
+        if window.latest is None:
+            return
+        frame = window.latest
+        if self.stats and window.count > 1:
+            frame = self._with_stats(frame, window)
+        self._open(key)
+        self.forward(frame)
+
+    def _record(self, window: _Window, frame: DeviceFrame) -> None:
+        payload = frame.payload
+        if not isinstance(payload, dict):
+            return
+        value = payload.get(self.value_field)
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return
+        window.count += 1
+        window.low = min(window.low, value)
+        window.high = max(window.high, value)
+        window.total += value
+
+    def _with_stats(self, frame: DeviceFrame, window: _Window) -> DeviceFrame:
+        data = dict(frame.data)
+        data["payload"] = dict(frame.payload)
+        data["payload"]["stats"] = {
+            "min": window.low,
+            "max": window.high,
+            "avg": window.total / window.count,
+            "count": window.count,
+        }
+        return DeviceFrame(to_text(data, None), data)
@@ -0,0 +1,159 @@
+from abc import ABC, abstractmethod
+from typing import Optional, Union
+from uuid import UUID
+
+import msgpack
+from pydantic_core import from_json, to_json
+
+from device_message.enums import CameraCommand, MessageCommand
+from router.message import RouterMessageType
+
+# Wire indices of the string enums. Only ever append to the enums, reordering
+# them changes the meaning of frames encoded by peers.
+_COMMANDS = [command.value for command in MessageCommand]
+_COMMAND_INDEX = {command: index for index, command in enumerate(_COMMANDS)}
+_CAMERA_COMMANDS = [command.value for command in CameraCommand]
+_CAMERA_COMMAND_INDEX = {
+    command: index for index, command in enumerate(_CAMERA_COMMANDS)
+}
+
+
+class Codec(ABC):
+    """
+    Wire encoding of router and device frames.
+
+    Inside the hub every frame is JSON text. A codec turns that text into
+    what goes on the wire and decodes wire data back into the parsed object
+    plus, when the wire format is JSON, the original text.
+    """
+
+    name = ""
+    binary = False
+
+    @abstractmethod
+    def encode(self, text: str) -> Union[str, bytes]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def decode(self, data: Union[str, bytes]) -> tuple[dict, Optional[str]]:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = "json"
+
+    def encode(self, text: str) -> str:
+        return text
+
+    def decode(self, data: Union[str, bytes]) -> tuple[dict, Optional[str]]:
+        if isinstance(data, bytes):
+            data = data.decode()
+        return from_json(data), data
+
+
+class MsgpackCodec(Codec):
+    """
+    MessagePack with string enums sent as their index and UUIDs as 16 bytes.
+    """
+
+    name = "msgpack"
+    binary = True
+
+    def encode(self, text: str) -> bytes:
+        return msgpack.packb(_compact(from_json(text)), use_bin_type=True)
+
+    def decode(self, data: Union[str, bytes]) -> tuple[dict, Optional[str]]:
+        if isinstance(data, str):
+            return JSON.decode(data)
+        return _expand(msgpack.unpackb(data, raw=False)), None
+
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec()
+CODECS = {codec.name: codec for codec in (JSON, MSGPACK)}
+
+
+def to_text(data: dict, text: Optional[str]) -> str:
+    return text if text is not None else to_json(data).decode()
+
+
+def subprotocol(codec: Codec, batch: bool, resume: bool = False) -> Optional[str]:
+    """
+    Name of the WebSocket subprotocol offering the codec, batch frames and
+    sequence-numbered session resume.
+    """
+    features = [] if codec is JSON else [codec.name]
+    if batch:
+        features.append("batch")
+    if resume:
+        features.append("resume")
+    if not features:
+        return None
+    return f"smart-home.{'.'.join(features)}.v1"
+
+
+def parse_subprotocol(name: Optional[str]) -> tuple[Codec, bool, bool]:
+    if not name:
+        return JSON, False, False
+    features = name.split(".")[1:-1]
+    codec = next((CODECS[f] for f in features if f in CODECS), JSON)
+    return codec, "batch" in features, "resume" in features
+
+
+def _compact(message: dict) -> dict:
+    if "target" not in message:
+        return _map_field(message, "command", _COMMAND_INDEX.get)
+    message = dict(message)
+    target = message["target"]
+    if "message_id" in message:
+        message["message_id"] = UUID(message["message_id"]).bytes
+    if target == RouterMessageType.DEVICE:
+        message["payload"] = _compact(message["payload"])
+    elif target == RouterMessageType.CAMERA:
+        message = _map_field(message, "command", _CAMERA_COMMAND_INDEX.get)
+    elif target == RouterMessageType.ACK:
+        ids = message.get("message_ids") or []
+        message["message_ids"] = [UUID(message_id).bytes for message_id in ids]
+    elif target == RouterMessageType.BATCH:
+        message["messages"] = [_compact(entry) for entry in message["messages"]]
+    return message
+
+
+def _expand(message: dict) -> dict:
+    if "target" not in message:
+        return _map_field(message, "command", _lookup(_COMMANDS))
+    target = message["target"]
+    if isinstance(message.get("message_id"), bytes):
+        message["message_id"] = str(UUID(bytes=message["message_id"]))
+    if target == RouterMessageType.DEVICE:
+        message["payload"] = _expand(message["payload"])
+    elif target == RouterMessageType.CAMERA:
+        message = _map_field(message, "command", _lookup(_CAMERA_COMMANDS))
+    elif target == RouterMessageType.ACK:
+        message["message_ids"] = [
+            str(UUID(bytes=message_id)) if isinstance(message_id, bytes) else message_id
+            for message_id in message.get("message_ids") or []
+        ]
+    elif target == RouterMessageType.BATCH:
+        message["messages"] = [_expand(entry) for entry in message["messages"]]
+    return message
+
+
+def _lookup(values: list[str]):
+    def get(index):
+        if isinstance(index, int) and 0 <= index < len(values):
+            return values[index]
+        return None
+
+    return get
+
+
+def _map_field(message: dict, field: str, mapping) -> dict:
+    if not isinstance(message, dict) or field not in message:
+        return message
+    value = mapping(message[field])
+    if value is None:
+        return message
+    message = dict(message)
+    message[field] = value
+    return message
@@ -0,0 +1,56 @@
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class DedupCache:
+    """
+    Remembers recently seen message ids for at most ttl seconds.
+
+    Keys are kept in the order they were first seen, so expired keys are
+    always at the front and are dropped from there; when the cache is full
+    the oldest key is evicted as well. Lookups and inserts are O(1) and the
+    memory is bounded by maxsize.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.duplicates = 0
+        self._seen: OrderedDict[Hashable, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def seen(self, key: Hashable) -> bool:
+        """
+        True if key was already seen within ttl, otherwise record it.
+        """
+        if self.contains(key):
+            return True
+        self.add(key)
+        return False
+
+    def contains(self, key: Hashable) -> bool:
+        """
+        True if key was recorded within ttl, counted as a duplicate.
+        """
+        self._expire(time.monotonic())
+        if key in self._seen:
+            self.duplicates += 1
+            return True
+        return False
+
+    def add(self, key: Hashable) -> None:
+        self._seen[key] = time.monotonic()
+        if len(self._seen) > self.maxsize:
+            self._seen.popitem(last=False)
+
+    def _expire(self, now: float) -> None:
+        deadline = now - self.ttl
+        seen = self._seen
+        while seen:
+            key, at = next(iter(seen.items()))
+            if at > deadline:
+                return
+            del seen[key]
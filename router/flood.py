@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Optional
+from uuid import uuid4
+
+from device_message.enums import MessageCommand, MessageDirection, MessageType, Scope
+from device_message.frame import DeviceFrame
+from router.codec import to_text
+from router.lanes import LaneKind, classify
+
+logger = logging.getLogger(__name__)
+
+# Sustained rate per second and burst per command class.
+DEFAULT_LIMITS: dict[LaneKind, tuple[float, float]] = {
+    LaneKind.CONTROL: (20.0, 100.0),
+    LaneKind.STATE: (20.0, 100.0),
+    LaneKind.TELEMETRY: (10.0, 50.0),
+}
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "dropped", "last_drop")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.dropped = 0
+        self.last_drop = 0.0
+
+
+class FloodGuard:
+    """
+    Token bucket per (device_id, command class) in front of the uplink.
+
+    Frames over the limit are dropped. The first drop of a flood reports a
+    DEVICE_FLOOD event upstream, and once quiet seconds pass without drops a
+    timer reports the end of the flood with the number of frames dropped,
+    so a looping device costs two messages instead of thousands, and a
+    device that went silent still ends its flood. Buckets of other devices
+    are never touched.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[dict[LaneKind, tuple[float, float]]] = None,
+        quiet: float = 10.0,
+    ):
+        self.limits = limits or DEFAULT_LIMITS
+        self.quiet = quiet
+        self.report: Optional[Callable[[DeviceFrame], None]] = None
+        self.dropped = 0
+        self._buckets: dict[tuple[str, LaneKind], _Bucket] = {}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def admit(self, frame: DeviceFrame) -> bool:
+        kind = classify(frame.data)
+        limit = self.limits.get(kind)
+        if limit is None:
+            return True
+        rate, burst = limit
+        now = time.monotonic()
+        key = (frame.device_id, kind)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(burst, now)
+        else:
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return True
+        if not bucket.dropped:
+            logger.warning(
+                f"Device {frame.device_id} exceeds {rate:g} {kind.name.lower()} "
+                f"messages per second, dropping the excess"
+            )
+            self._notify(frame.device_id, kind, "start", 0)
+            asyncio.get_running_loop().call_later(self.quiet, self._check_quiet, key)
+        bucket.dropped += 1
+        bucket.last_drop = now
+        self.dropped += 1
+        return False
+
+    def _check_quiet(self, key: tuple[str, LaneKind]) -> None:
+        bucket = self._buckets[key]
+        remaining = bucket.last_drop + self.quiet - time.monotonic()
+        if remaining > 0:
+            asyncio.get_running_loop().call_later(remaining, self._check_quiet, key)
+            return
+        device_id, kind = key
+        logger.warning(
+            f"Device {device_id} flood ended, {bucket.dropped} messages dropped"
+        )
+        self._notify(device_id, kind, "end", bucket.dropped)
+        bucket.dropped = 0
+
+    def _notify(self, device_id: str, kind: LaneKind, state: str, dropped: int):
+        if self.report is None:
+            return
+        data = {
+            "direction": MessageDirection.INTENT.value,
+            "command": MessageCommand.DEVICE_FLOOD.value,
+            "type": MessageType.EVENT.value,
+            "scope": Scope.CPU.value,
+            "device_id": device_id,
+            "peripheral_id": 0,
+            "message_id": uuid4().hex,
+            "payload": {
+                "state": state,
+                "command_class": kind.name.lower(),
+                "limit": self.limits[kind][0],
+                "dropped": dropped,
+            },
+        }
+        self.report(DeviceFrame(to_text(data, None), data))
@@ -0,0 +1,43 @@
+from enum import IntEnum
+
+from pydantic import BaseModel
+
+from device_message.enums import MessageCommand, MessageDirection, MessageType
+from router.coalescer import TELEMETRY_COMMANDS
+
+
+class LaneKind(IntEnum):
+    CONTROL = 0
+    STATE = 1
+    TELEMETRY = 2
+
+
+class Lane(BaseModel):
+    name: str
+    weight: int
+    maxsize: int
+    shed_oldest: bool = True
+
+
+DEFAULT_LANES = [
+    Lane(name="control", weight=8, maxsize=10000),
+    Lane(name="state", weight=4, maxsize=20000),
+    Lane(name="telemetry", weight=1, maxsize=20000),
+]
+
+
+def classify(data: dict) -> LaneKind:
+    """
+    Lane of a device message: action results and firmware errors first,
+    then state changes, then measurements.
+    """
+    command = data.get("command")
+    if (
+        data.get("direction") == MessageDirection.RESULT.value
+        or data.get("type") == MessageType.ACTION.value
+        or command == MessageCommand.UPDATE_FIRMWARE_ERROR
+    ):
+        return LaneKind.CONTROL
+    if command in TELEMETRY_COMMANDS:
+        return LaneKind.TELEMETRY
+    return LaneKind.STATE
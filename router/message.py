@@ -1,13 +1,15 @@
+import json
+import re
+import time
 from enum import IntEnum
-from typing import Annotated, Type, Union, Literal
+from json.decoder import scanstring
+from typing import Annotated, Any, Optional, Type, Union, Literal
 from uuid import uuid4, UUID
 
 from camera.message_payload import CameraRouterMessagePayload
 from device_message.enums import CameraCommand
 from device_message.device_message import DeviceMessage
 
-from datetime import datetime, timedelta
-
 from pydantic import BaseModel, Field, RootModel
 
 
@@ -15,20 +17,87 @@ def get_message_id() -> str:
     return uuid4().hex
 
 
-def get_start_time() -> datetime:
-    return datetime.now() - timedelta(minutes=10)
-
-
 class RouterMessageType(IntEnum):
     DEVICE = 0
     CAMERA = 1
     ACK = 2
+    BATCH = 3
+    RESUME = 4
 
 
 def generate_random_id():
     return uuid4()
 
 
+# Same layout as DeviceRouterMessage.model_dump_json(), filled with the raw
+# device frame so it is never parsed or serialized again on the way up.
+DEVICE_ENVELOPE = '{"target":0,"message_id":"%s","payload":%s}'
+BATCH_ENVELOPE = '{"target":3,"messages":[%s]}'
+# Prepended to an envelope when the connection carries sequence numbers.
+SEQUENCED_ENVELOPE = '{"seq":%d,%s'
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+
+
+def raw_payload(raw: str, envelope: dict) -> str:
+    """
+    Return the payload of a decoded envelope as the exact text it was sent in.
+
+    Envelopes serialized by the models end with the payload and have only
+    scalar fields before it, so the text between the first "payload" key and
+    the closing brace is the payload. Anything else falls back to
+    scan_object.
+    """
+    *head, last = envelope
+    idx = raw.find('"payload"')
+    if (
+        last == "payload"
+        and idx >= 0
+        and not any(
+            isinstance(envelope[key], (dict, list))
+            or (isinstance(envelope[key], str) and "payload" in envelope[key])
+            for key in head
+        )
+    ):
+        start = raw.index(":", idx + 9) + 1
+        return raw[start : raw.rindex("}")].strip()
+    _, start, end = scan_object(raw)["payload"]
+    return raw[start:end]
+
+
+def scan_object(raw: str) -> dict[str, tuple[Any, int, int]]:
+    """
+    Decode the top level of a JSON object and remember where each value is.
+
+    Returns a mapping of key to (value, start, end) so a nested value can be
+    forwarded as raw[start:end] without serializing it again.
+    """
+    fields = {}
+    idx = _whitespace.match(raw, 0).end()
+    if raw[idx : idx + 1] != "{":
+        raise ValueError("Expected a JSON object")
+    idx = _whitespace.match(raw, idx + 1).end()
+    if raw[idx : idx + 1] == "}":
+        return fields
+    while True:
+        if raw[idx : idx + 1] != '"':
+            raise ValueError(f"Expected a key at position {idx}")
+        key, idx = scanstring(raw, idx + 1)
+        idx = _whitespace.match(raw, idx).end()
+        if raw[idx : idx + 1] != ":":
+            raise ValueError(f"Expected ':' at position {idx}")
+        start = _whitespace.match(raw, idx + 1).end()
+        value, end = _decoder.raw_decode(raw, start)
+        fields[key] = (value, start, end)
+        idx = _whitespace.match(raw, end).end()
+        if raw[idx : idx + 1] == "}":
+            return fields
+        if raw[idx : idx + 1] != ",":
+            raise ValueError(f"Expected ',' or '}}' at position {idx}")
+        idx = _whitespace.match(raw, idx + 1).end()
+
+
 class RouterMessage(BaseModel):
     target: RouterMessageType
     message_id: UUID = Field(default_factory=generate_random_id)
@@ -47,16 +116,58 @@ class CameraRouterMessage(RouterMessage):
 
 class AckRouterMessage(RouterMessage):
     target: Literal[RouterMessageType.ACK] = RouterMessageType.ACK
+    message_ids: list[UUID] = Field(default_factory=list)
+    # Cumulative ack: every message sequenced up to and including seq was
+    # received, with no gap. Retries keep their number, so it trails the
+    # highest number seen.
+    seq: Optional[int] = None
+
+
+class ResumeRouterMessage(RouterMessage):
+    """
+    First frame both ways on a connection that negotiated session resume.
+
+    session identifies the sender's sequence space and seq is the highest
+    sequence number up to which every message from the peer's session named
+    in peer was received, so the peer only resends what came after it.
+    Retries keep their number and can arrive after higher ones, so seq
+    must not skip a gap.
+    """
+
+    target: Literal[RouterMessageType.RESUME] = RouterMessageType.RESUME
+    session: str
+    peer: Optional[str] = None
+    seq: int = 0
+
+
+class BatchRouterMessage(RouterMessage):
+    target: Literal[RouterMessageType.BATCH] = RouterMessageType.BATCH
+    messages: list[
+        Annotated[
+            Union[DeviceRouterMessage, CameraRouterMessage, AckRouterMessage],
+            Field(discriminator="target"),
+        ]
+    ]
 
 
 class RouterMessagePacket(RootModel):
     root: Annotated[
-        Union[DeviceRouterMessage, CameraRouterMessage, AckRouterMessage],
+        Union[
+            DeviceRouterMessage,
+            CameraRouterMessage,
+            AckRouterMessage,
+            BatchRouterMessage,
+            ResumeRouterMessage,
+        ],
         Field(discriminator="target"),
     ]
 
 
 class ServerMessage(BaseModel):
     payload: str
-    last_try: datetime = Field(default_factory=get_start_time)
+    lane: int = Field(default=1)
+    created: float = Field(default_factory=time.monotonic)
+    next_try: float = Field(default=0.0)
     tries: int = Field(default=0)
+    sent_at: float = Field(default=0.0)
+    seq: int = Field(default=0)
@@ -0,0 +1,328 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Iterator, Optional
+from uuid import UUID
+
+from pydantic import BaseModel
+from pydantic_core import from_json
+
+from logconfig import RateLimitedLogger
+from metrics import ACK_ROUND_TRIP, OUTBOX_DROPS, OUTBOX_RETRIES, OUTBOX_TO_SEND
+from router.lanes import DEFAULT_LANES, Lane, LaneKind, classify
+from router.message import RouterMessageType, ServerMessage
+from router.store import OutboxStore
+
+logger = logging.getLogger(__name__)
+
+_drop_log = RateLimitedLogger(logger)
+
+_shed = OUTBOX_DROPS.labels("shed")
+_rejected = OUTBOX_DROPS.labels("rejected")
+_expired = OUTBOX_DROPS.labels("expired")
+
+
+class RetryPolicy(BaseModel):
+    interval: float = 5.0
+    max_tries: int = 50
+    backoff: float = 1.0
+    max_interval: float = 60.0
+
+    def delay(self, tries: int) -> float:
+        """
+        Return how long to wait for an ack after the given number of tries.
+        """
+        delay = self.interval * self.backoff ** max(tries - 1, 0)
+        return min(delay, self.max_interval)
+
+
+class _LaneQueue:
+    __slots__ = ("config", "messages", "schedule", "dropped")
+
+    def __init__(self, config: Lane):
+        self.config = config
+        self.messages: OrderedDict[UUID, ServerMessage] = OrderedDict()
+        self.schedule: list[tuple[float, int, UUID]] = []
+        self.dropped = 0
+
+
+class Outbox:
+    """
+    Upstream messages waiting for an ack from the server.
+
+    Messages are split into priority lanes. Each lane keeps its messages in
+    arrival order and schedules them on a heap ordered by the time their
+    next try is due. Acks only remove the message from the dicts; the
+    matching heap entry is discarded lazily when it reaches the top, so both
+    operations stay O(log n) at worst. Due messages are taken from the lanes
+    by weighted round robin, and a full lane sheds its oldest message (or
+    rejects the new one).
+
+    When a store is given every message is journaled to it and the messages
+    left unacked by a previous run are scheduled again.
+
+    Every message gets the next sequence number when it is first sent and
+    keeps it on retries, so a retry goes out after messages with higher
+    numbers. The server therefore acks only contiguous prefixes: the
+    highest number up to which it received every message. ack_through then
+    never acks a message the server did not get, and a resumed session
+    only resends what came after the prefix.
+    """
+
+    def __init__(
+        self,
+        policy: Optional[RetryPolicy] = None,
+        store: Optional[OutboxStore] = None,
+        lanes: Optional[list[Lane]] = None,
+        high_water: float = 0.8,
+    ):
+        self.policy = policy or RetryPolicy()
+        self.store = store
+        self.high_water = high_water
+        self.messages: dict[UUID, ServerMessage] = {}
+        self.lanes = [_LaneQueue(lane) for lane in lanes or DEFAULT_LANES]
+        self._counter = itertools.count()
+        self._seq = itertools.count(1)
+        self._sent: deque[tuple[int, UUID]] = deque()
+        self._wakeup = asyncio.Event()
+        if store is not None:
+            self._restore()
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __contains__(self, message_id: UUID) -> bool:
+        return message_id in self.messages
+
+    def put(self, message_id: UUID, message: ServerMessage) -> bool:
+        lane = self.lanes[message.lane]
+        if len(lane.messages) >= lane.config.maxsize:
+            lane.dropped += 1
+            if not lane.config.shed_oldest:
+                _rejected.inc()
+                return False
+            _shed.inc()
+            self._remove(next(iter(lane.messages)))
+        if self.store is not None:
+            self.store.append(message_id, message.payload)
+        self._schedule_now(message_id, message)
+        return True
+
+    def ack(self, message_id: UUID) -> bool:
+        message = self._remove(message_id)
+        if message is None:
+            return False
+        if message.sent_at:
+            ACK_ROUND_TRIP.observe(time.monotonic() - message.sent_at)
+        return True
+
+    def ack_through(self, seq: int) -> int:
+        """
+        Ack every message sent with a sequence number up to seq, which the
+        server only reports once it received all of them.
+        """
+        acked = 0
+        sent = self._sent
+        while sent and sent[0][0] <= seq:
+            message_seq, message_id = sent.popleft()
+            message = self.messages.get(message_id)
+            if message is not None and message.seq == message_seq:
+                self.ack(message_id)
+                acked += 1
+        return acked
+
+    def retry_now(self) -> int:
+        """
+        Make every message that was already sent due again, for a resumed
+        session that reported which ones the server is missing.
+        """
+        now = time.monotonic()
+        count = 0
+        for lane in self.lanes:
+            for message_id, message in lane.messages.items():
+                if message.tries and message.next_try > now:
+                    message.next_try = now
+                    self._push(lane, now, message_id)
+                    count += 1
+        if count:
+            self._wakeup.set()
+        return count
+
+    def oldest_age(self) -> float:
+        oldest = min(
+            (
+                next(iter(lane.messages.values())).created
+                for lane in self.lanes
+                if lane.messages
+            ),
+            default=None,
+        )
+        return 0.0 if oldest is None else time.monotonic() - oldest
+
+    def is_congested(self) -> bool:
+        """
+        True while a lane that does not carry telemetry is above high water.
+        """
+        return any(
+            len(lane.messages) >= lane.config.maxsize * self.high_water
+            for kind, lane in enumerate(self.lanes)
+            if kind != LaneKind.TELEMETRY
+        )
+
+    def lane_stats(self) -> list[dict]:
+        now = time.monotonic()
+        stats = []
+        for lane in self.lanes:
+            oldest = next(iter(lane.messages.values()), None)
+            stats.append(
+                {
+                    "lane": lane.config.name,
+                    "depth": len(lane.messages),
+                    "oldest_age": now - oldest.created if oldest else 0.0,
+                    "dropped": lane.dropped,
+                }
+            )
+        return stats
+
+    def pop_due(self) -> Iterator[tuple[UUID, ServerMessage]]:
+        """
+        Yield messages whose next try is due and schedule their following try.
+
+        Every round takes up to weight messages from each lane. The clock is
+        read again each round, so a message put while the caller is sending
+        a backlog is due in the next round instead of after the backlog. A
+        message is still yielded at most once per pass. Messages that
+        already used all their tries are dropped instead.
+        """
+        started = time.monotonic()
+        progressed = True
+        while progressed:
+            progressed = False
+            now = time.monotonic()
+            for lane in self.lanes:
+                for _ in range(lane.config.weight):
+                    item = self._pop_lane(lane, now, started)
+                    if item is None:
+                        break
+                    progressed = True
+                    yield item
+
+    async def wait_due(self) -> None:
+        """
+        Sleep until the earliest scheduled message is due or a new one arrives.
+        """
+        while True:
+            timeout = self._next_delay()
+            if timeout is not None and timeout <= 0:
+                return
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _pop_lane(
+        self, lane: _LaneQueue, now: float, started: float
+    ) -> Optional[tuple[UUID, ServerMessage]]:
+        schedule = lane.schedule
+        while schedule and schedule[0][0] <= now:
+            due, _, message_id = schedule[0]
+            message = lane.messages.get(message_id)
+            if message is None or message.next_try != due:
+                heapq.heappop(schedule)
+                continue
+            if message.tries and message.sent_at >= started:
+                # Retry due again within this pass, leave it for the next.
+                return None
+            heapq.heappop(schedule)
+            if message.tries >= self.policy.max_tries:
+                _drop_log.error(
+                    "Message %s failed after %d tries. Dropping.",
+                    message_id,
+                    message.tries,
+                )
+                _expired.inc()
+                self._remove(message_id)
+                continue
+            message.tries += 1
+            if message.tries == 1:
+                OUTBOX_TO_SEND.observe(now - message.created)
+                self._sequence(message_id, message)
+            else:
+                OUTBOX_RETRIES.inc()
+            message.sent_at = now
+            message.next_try = now + self.policy.delay(message.tries)
+            self._push(lane, message.next_try, message_id)
+            return message_id, message
+        return None
+
+    def _sequence(self, message_id: UUID, message: ServerMessage) -> None:
+        message.seq = next(self._seq)
+        self._sent.append((message.seq, message_id))
+        if len(self._sent) > 2 * len(self.messages) + 1024:
+            # The server acks by id only, drop the entries of acked messages.
+            self._sent = deque(
+                (seq, message_id)
+                for seq, message_id in self._sent
+                if message_id in self.messages and self.messages[message_id].seq == seq
+            )
+
+    def _remove(self, message_id: UUID) -> Optional[ServerMessage]:
+        message = self.messages.pop(message_id, None)
+        if message is None:
+            return None
+        del self.lanes[message.lane].messages[message_id]
+        if self.store is not None:
+            self.store.remove(message_id)
+        return message
+
+    def _next_delay(self) -> Optional[float]:
+        earliest = None
+        for lane in self.lanes:
+            while lane.schedule:
+                due, _, message_id = lane.schedule[0]
+                message = lane.messages.get(message_id)
+                if message is not None and message.next_try == due:
+                    earliest = due if earliest is None else min(earliest, due)
+                    break
+                heapq.heappop(lane.schedule)
+        return None if earliest is None else earliest - time.monotonic()
+
+    def _restore(self) -> None:
+        for message_id, payload in self.store.load():
+            message = ServerMessage(payload=payload)
+            envelope = from_json(payload)
+            data = envelope.get("payload")
+            if envelope.get("target") == RouterMessageType.CAMERA:
+                message.lane = LaneKind.TELEMETRY
+            elif isinstance(data, dict):
+                message.lane = classify(data)
+            self._schedule_now(message_id, message)
+        if self.messages:
+            logger.info(f"Restored {len(self.messages)} unacked messages")
+
+    def _schedule_now(self, message_id: UUID, message: ServerMessage) -> None:
+        lane = self.lanes[message.lane]
+        message.next_try = time.monotonic()
+        self.messages[message_id] = message
+        lane.messages[message_id] = message
+        self._push(lane, message.next_try, message_id)
+        self._wakeup.set()
+
+    def _push(self, lane: _LaneQueue, due: float, message_id: UUID) -> None:
+        heapq.heappush(lane.schedule, (due, next(self._counter), message_id))
+        if len(lane.schedule) > 2 * len(lane.messages) + 1024:
+            self._compact(lane)
+
+    @staticmethod
+    def _compact(lane: _LaneQueue) -> None:
+        lane.schedule = [
+            entry
+            for entry in lane.schedule
+            if entry[2] in lane.messages
+            and lane.messages[entry[2]].next_try == entry[0]
+        ]
+        heapq.heapify(lane.schedule)
@@ -0,0 +1,73 @@
+import time
+from typing import Optional
+
+from device_message.enums import MessageCommand, MessageDirection
+from device_message.frame import DeviceFrame
+from router.codec import to_text
+
+
+class PresenceRegistry:
+    """
+    Presence of every device the hub has heard from.
+
+    Any frame from a device marks it as seen, DEVICE_DISCONNECT (including
+    the one a device registers as its MQTT last will) marks it offline until
+    it talks again. A device counts as connected if it is not offline and
+    was seen since the last GET_CONNECTED_DEVICES broadcast, so devices that
+    vanished without a last will drop out after the next refresh.
+    """
+
+    def __init__(self, stale_after: float = 300.0):
+        self.stale_after = stale_after
+        self.last_seen: dict[str, float] = {}
+        self.offline: set[str] = set()
+        self.refreshed_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self.last_seen)
+
+    def observe(self, frame: DeviceFrame) -> None:
+        device_id = frame.device_id
+        if device_id == "camera":
+            return
+        self.last_seen[device_id] = time.monotonic()
+        if frame.command == MessageCommand.DEVICE_DISCONNECT:
+            self.offline.add(device_id)
+        else:
+            self.offline.discard(device_id)
+
+    def is_connected(self, device_id: str) -> bool:
+        seen = self.last_seen.get(device_id)
+        return (
+            seen is not None
+            and device_id not in self.offline
+            and self.refreshed_at is not None
+            and seen >= self.refreshed_at
+        )
+
+    def is_stale(self) -> bool:
+        return (
+            self.refreshed_at is None
+            or time.monotonic() - self.refreshed_at > self.stale_after
+        )
+
+    def mark_refreshed(self) -> None:
+        self.refreshed_at = time.monotonic()
+
+    def connected_devices(self) -> list[str]:
+        return [
+            device_id for device_id in self.last_seen if self.is_connected(device_id)
+        ]
+
+    def answer(self, query: DeviceFrame) -> list[DeviceFrame]:
+        """
+        Build the replies the connected devices would send to the query.
+        """
+        frames = []
+        for device_id in self.connected_devices():
+            data = dict(query.data)
+            data["device_id"] = device_id
+            data["direction"] = MessageDirection.RESULT.value
+            data["payload"] = {}
+            frames.append(DeviceFrame(to_text(data, None), data))
+        return frames
@@ -1,107 +1,441 @@
 import asyncio
-from datetime import datetime, timedelta
 import logging
-from uuid import UUID
+from typing import Optional
+from uuid import UUID, uuid4
 
 import websockets
 from pydantic import ValidationError
 from websockets import InvalidStatus
-from websockets.exceptions import ConnectionClosedError
+from backoff import Backoff
 from camera.manager import CameraManager
-from device_message.device_message import DeviceMessage
+from capture import Capture, Channel
+from logconfig import RateLimitedLogger
+from metrics import MESSAGES_RECEIVED, MESSAGES_SENT, REGISTRY, VALIDATION_FAILURES
 from device_message.enums import MessageCommand
+from device_message.frame import DeviceFrame
+from router.coalescer import Coalescer
+from router.dedup import DedupCache
+from router.codec import JSON, Codec, parse_subprotocol, subprotocol, to_text
 from router.message import (
+    AckRouterMessage,
+    BATCH_ENVELOPE,
+    DEVICE_ENVELOPE,
+    SEQUENCED_ENVELOPE,
+    ResumeRouterMessage,
     ServerMessage,
     DeviceRouterMessage,
     RouterMessagePacket,
     CameraRouterMessage,
-    AckRouterMessage,
+    raw_payload,
 )
+from router.lanes import Lane, LaneKind, classify
+from router.outbox import Outbox, RetryPolicy
+from router.presence import PresenceRegistry
+from router.rules import RuleEngine
+from router.state_cache import StateCache
+from router.store import OutboxStore
 from webapp.webapp import Webapp
 from router.message import RouterMessage, RouterMessageType
 
 logger = logging.getLogger(__name__)
 
+_received_log = RateLimitedLogger(logger)
+_sent_log = RateLimitedLogger(logger)
+_error_log = RateLimitedLogger(logger)
+
+_received = MESSAGES_RECEIVED.labels("server")
+_sent = MESSAGES_SENT.labels("server")
+_invalid = VALIDATION_FAILURES.labels("server")
+
+# Server sequence numbers remembered past a gap in what was received.
+MAX_SEQ_GAP = 4096
+
 
 class Router:
-    def __init__(self, uri: str, camera_manager: CameraManager, webapp: Webapp):
+    def __init__(
+        self,
+        uri: str,
+        camera_manager: CameraManager,
+        webapp: Webapp,
+        retry_policy: Optional[RetryPolicy] = None,
+        store: Optional[OutboxStore] = None,
+        strict: bool = False,
+        batch_size: int = 100,
+        batch_linger: float = 0.005,
+        codec: Codec = JSON,
+        compression: Optional[str] = "deflate",
+        presence: Optional[PresenceRegistry] = None,
+        coalesce_window: float = 0.0,
+        coalesce_stats: bool = False,
+        lanes: Optional[list[Lane]] = None,
+        dedup_size: int = 10000,
+        dedup_ttl: float = 600.0,
+        capture: Optional[Capture] = None,
+        state_cache: Optional[StateCache] = None,
+        resume: bool = True,
+        resume_timeout: float = 10.0,
+        backoff: Optional[Backoff] = None,
+    ):
         self.uri = uri
+        self.strict = strict
+        self.batch_size = batch_size
+        self.batch_linger = batch_linger
+        self.preferred_codec = codec
+        self.compression = compression
+        self.codec: Codec = JSON
+        self.resume = resume
+        self.resume_timeout = resume_timeout
+        self.backoff = backoff or Backoff(base=0.5, cap=30)
+        # Sequence spaces of this hub and of the server, see ResumeRouterMessage.
+        self.session = uuid4().hex
+        self.server_session: Optional[str] = None
+        # Highest server sequence number received with every one before it,
+        # and the numbers received past the first gap.
+        self.server_seq = 0
+        self._server_seqs: set[int] = set()
+        self.sequenced = False
+        self._resumed = False
         self.send_to_device = None
-        self.message_storage: dict[UUID, ServerMessage] = {}
+        self.outbox = Outbox(retry_policy, store, lanes)
+        self.presence = presence or PresenceRegistry()
+        self.rules = RuleEngine()
+        self.state_cache = state_cache
+        self.inbound_seen = DedupCache(dedup_size, dedup_ttl)
+        self.device_seen = DedupCache(dedup_size, dedup_ttl)
+        self._duplicate_acks: list[str] = []
+        self.coalescer = Coalescer(
+            self._enqueue, window=coalesce_window, stats=coalesce_stats
+        )
+        self.capture = capture
         self.camera_manager = camera_manager
         self.webapp = webapp
+        REGISTRY.gauge(
+            "hub_outbox_messages", "Messages waiting for an ack", self.outbox.__len__
+        )
+        REGISTRY.gauge(
+            "hub_outbox_oldest_age_seconds",
+            "Age of the oldest unacked message",
+            self.outbox.oldest_age,
+        )
+        REGISTRY.gauge(
+            "hub_outbox_lane_messages",
+            "Messages waiting for an ack per lane",
+            lambda: [((s["lane"],), s["depth"]) for s in self.outbox.lane_stats()],
+            ["lane"],
+        )
+        REGISTRY.gauge(
+            "hub_outbox_lane_oldest_age_seconds",
+            "Age of the oldest unacked message per lane",
+            lambda: [((s["lane"],), s["oldest_age"]) for s in self.outbox.lane_stats()],
+            ["lane"],
+        )
+        REGISTRY.counter_func(
+            "hub_outbox_lane_dropped_total",
+            "Messages shed or rejected by a full lane",
+            lambda: [((s["lane"],), s["dropped"]) for s in self.outbox.lane_stats()],
+            ["lane"],
+        )
+        REGISTRY.counter_func(
+            "hub_duplicates_dropped_total",
+            "Duplicate frames dropped from the server and from devices",
+            lambda: self.inbound_seen.duplicates + self.device_seen.duplicates,
+        )
+        if state_cache is not None:
+            REGISTRY.gauge(
+                "hub_state_cache_peripherals",
+                "Peripherals with cached state or settings",
+                state_cache.__len__,
+            )
+            REGISTRY.counter_func(
+                "hub_state_cache_hits_total",
+                "Server reads answered from the state cache",
+                lambda: state_cache.hits,
+            )
+            REGISTRY.counter_func(
+                "hub_state_reports_suppressed_total",
+                "Unchanged device reports not forwarded to the server",
+                lambda: state_cache.suppressed,
+            )
 
     async def start(self):
+        subprotocols = self._subprotocols() or None
         while True:
             try:
-                async with websockets.connect(self.uri) as websocket:
-                    logger.info("Connected to server")
-                    receive_from_server = asyncio.create_task(
-                        self._receive_from_server(websocket)
+                async with websockets.connect(
+                    self.uri, subprotocols=subprotocols, compression=self.compression
+                ) as websocket:
+                    logger.info(
+                        f"Connected to server (subprotocol: {websocket.subprotocol})"
                     )
-                    send_to_server = asyncio.create_task(
-                        self._send_to_server(websocket)
+                    self.codec, _, self.sequenced = parse_subprotocol(
+                        websocket.subprotocol
                     )
-                    await asyncio.gather(receive_from_server, send_to_server)
-            except (ConnectionClosedError, ConnectionRefusedError) as e:
-                logger.warning("Connection to server closed or refused, retrying...")
-                await asyncio.sleep(5)
-                continue
+                    if self.sequenced:
+                        await self._resume_session(websocket)
+                    await self._run_session(websocket)
+                reason = "closed by the server"
             except InvalidStatus as e:
-                logger.warning(f"WebSocket connection failed with invalid status: {e}")
-                await asyncio.sleep(5)
-                continue
+                reason = f"rejected with invalid status: {e}"
+            except (
+                websockets.ConnectionClosed,
+                websockets.InvalidHandshake,
+                OSError,
+            ) as e:
+                reason = f"lost: {e!r}"
+            delay = self.backoff.next_delay()
+            logger.warning(
+                f"Connection to server {reason}. Retrying in {delay:.1f} seconds..."
+            )
+            await asyncio.sleep(delay)
+
+    async def _run_session(self, websocket: websockets.ClientConnection):
+        """
+        Run the receive and send loops until either of them ends, so a
+        connection closed while the sender is idle is noticed right away.
+        """
+        tasks = [
+            asyncio.create_task(self._receive_from_server(websocket)),
+            asyncio.create_task(self._send_to_server(websocket)),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for task in done:
+            task.result()
+
+    async def _resume_session(self, websocket: websockets.ClientConnection):
+        """
+        Tell the server the last sequence number received from it and wait for
+        its answer, which acks everything it already has from this hub. The
+        rest of the unacked messages is then sent at once instead of waiting
+        for each retry timer.
+        """
+        hello = ResumeRouterMessage(
+            session=self.session, peer=self.server_session, seq=self.server_seq
+        )
+        await self._send(websocket, hello.model_dump_json())
+        self._resumed = False
+        try:
+            message = await asyncio.wait_for(websocket.recv(), self.resume_timeout)
+        except asyncio.TimeoutError:
+            message = None
+        if message is not None:
+            await self._handle(websocket, message)
+        if not self._resumed:
+            logger.warning("Server did not resume the session, resending everything")
+            self.outbox.retry_now()
+
+    def _on_resume(self, envelope: dict):
+        self._resumed = True
+        session = envelope["session"]
+        if session != self.server_session:
+            self.server_session = session
+            self.server_seq = 0
+            self._server_seqs.clear()
+        seq = envelope.get("seq", 0) if envelope.get("peer") == self.session else 0
+        acked = self.outbox.ack_through(seq)
+        resent = self.outbox.retry_now()
+        logger.info(
+            f"Resumed session at {seq}: {acked} messages acked, {resent} resent"
+        )
 
     async def _receive_from_server(self, websocket: websockets.ClientConnection):
         async for message in websocket:
-            try:
-                logger.info(f"Received message: {message}")
-                message = RouterMessagePacket.model_validate_json(message).root
-                if isinstance(message, DeviceRouterMessage):
-                    if message.payload.command == MessageCommand.UPDATE_FIRMWARE:
-                        asyncio.create_task(
-                            self.webapp.download_if_needed(message.payload)
-                        )
-                    else:
-                        self.send_to_device(message.payload)
-                elif isinstance(message, CameraRouterMessage):
-                    asyncio.create_task(self.camera_manager.on_message(message))
-                elif isinstance(message, AckRouterMessage):
-                    if message.message_id in self.message_storage:
-                        del self.message_storage[message.message_id]
-            except ValidationError as e:
-                logger.error(f"Invalid message format: {e}", exc_info=True)
-            except Exception as e:
-                logger.error(f"Error processing incoming message: {e}", exc_info=True)
-            except KeyError as e:
-                logger.error(f"Missing required field in message: {e}", exc_info=True)
+            await self._handle(websocket, message)
+
+    async def _handle(self, websocket: websockets.ClientConnection, message):
+        _received.inc()
+        if self.capture is not None:
+            self.capture.record(Channel.WS_IN, message)
+        try:
+            _received_log.info("Received message: %s", message)
+            self._dispatch(message)
+            # A server that accepts the handshake and then drops the
+            # connection keeps backing off until it sends a valid frame.
+            self.backoff.reset()
+            if self._duplicate_acks:
+                await self._ack_duplicates(websocket)
+        except ValidationError as e:
+            _invalid.inc()
+            _error_log.error("Invalid message format: %s", e, exc_info=True)
+        except Exception as e:
+            _error_log.error("Error processing incoming message: %s", e, exc_info=True)
+
+    def _dispatch(self, raw: str | bytes):
+        envelope, text = self.codec.decode(raw)
+        if self.strict:
+            RouterMessagePacket.model_validate(envelope)
+        if envelope["target"] == RouterMessageType.BATCH:
+            for message in envelope["messages"]:
+                self._route(message)
+        else:
+            self._route(envelope, text)
+
+    def _route(self, envelope: dict, raw: Optional[str] = None):
+        target = envelope["target"]
+        if target == RouterMessageType.RESUME:
+            self._on_resume(envelope)
+            return
+        message_id = None
+        if target != RouterMessageType.ACK:
+            seq = envelope.get("seq")
+            if seq is not None and seq > self.server_seq:
+                self._received_seq(seq)
+            # Replayed after a reconnect: ack it again but do not act twice.
+            message_id = envelope.get("message_id")
+            if message_id and self.inbound_seen.contains(message_id):
+                _received_log.info("Dropping duplicate message %s", message_id)
+                self._duplicate_acks.append(message_id)
+                return
+        if target == RouterMessageType.DEVICE:
+            data = envelope["payload"]
+            if not isinstance(data, dict):
+                raise ValueError("Device message must be a JSON object")
+            text = raw_payload(raw, envelope) if raw else to_text(data, None)
+            self._route_to_device(DeviceFrame(text, data))
+        elif target == RouterMessageType.CAMERA:
+            message = CameraRouterMessage.model_validate(envelope)
+            asyncio.create_task(self.camera_manager.on_message(message))
+        elif target == RouterMessageType.ACK:
+            if envelope.get("seq") is not None:
+                self.outbox.ack_through(envelope["seq"])
+            if "message_id" in envelope:
+                self.outbox.ack(UUID(envelope["message_id"]))
+            for acked in envelope.get("message_ids") or ():
+                self.outbox.ack(UUID(acked))
+        if message_id:
+            # Only once handled, so a message that failed is acted on when
+            # it is replayed.
+            self.inbound_seen.add(message_id)
+
+    def _received_seq(self, seq: int):
+        seqs = self._server_seqs
+        seqs.add(seq)
+        while self.server_seq + 1 in seqs:
+            self.server_seq += 1
+            seqs.discard(self.server_seq)
+        if len(seqs) > MAX_SEQ_GAP:
+            # Forgetting a number only gets the message resent, and the
+            # dedup cache drops it again.
+            seqs.discard(max(seqs))
+
+    async def _ack_duplicates(self, websocket: websockets.ClientConnection):
+        message_ids, self._duplicate_acks = self._duplicate_acks, []
+        ack = AckRouterMessage(message_ids=message_ids)
+        await self._send(websocket, ack.model_dump_json())
+
+    def _route_to_device(self, frame: DeviceFrame):
+        if self.state_cache is not None:
+            reply = None
+            if frame.device_id not in self.presence.offline:
+                reply = self.state_cache.answer(frame)
+            if reply is not None:
+                self._enqueue(reply)
+                return
+            self.state_cache.invalidate(frame)
+        if frame.command == MessageCommand.UPDATE_FIRMWARE:
+            asyncio.create_task(self.webapp.download_if_needed(frame.validate()))
+        elif frame.command == MessageCommand.GET_CONNECTED_DEVICES:
+            if self.presence.is_stale():
+                self.presence.mark_refreshed()
+                self.send_to_device(frame)
+                return
+            for reply in self.presence.answer(frame):
+                self._enqueue(reply)
+        else:
+            if frame.command == MessageCommand.UPDATE_RULE:
+                self.rules.update(frame)
+            self.send_to_device(frame)
 
     async def _send_to_server(self, websocket: websockets.ClientConnection):
+        if parse_subprotocol(websocket.subprotocol)[1]:
+            await self._send_batches(websocket)
+            return
         while True:
-            for message_id in list(self.message_storage.keys()):
-                message = self.message_storage.get(message_id)
-                if not message:
-                    continue
-                if datetime.now() - message.last_try > timedelta(seconds=5):
-                    message.tries += 1
-                    message.last_try = datetime.now()
-
-                    print(f"To server: {message}")
-                    await websocket.send(message.payload)
-                    await asyncio.sleep(0.01)
-
-                if message.tries > 50:
-                    logger.error(
-                        f"Message {message.payload} failed after 50 tries. Dropping."
-                    )
-                    del self.message_storage[message_id]
-            await asyncio.sleep(0.1)
+            await self.outbox.wait_due()
+            for message_id, message in self.outbox.pop_due():
+                _sent_log.debug("To server: %s", message.payload)
+                await self._send(websocket, self._framed(message))
+                _sent.inc()
 
-    def send_to_server(self, message: DeviceMessage):
-        rm = DeviceRouterMessage(payload=message)
-        self.message_storage[rm.message_id] = ServerMessage(
-            payload=rm.model_dump_json()
+    async def _send_batches(self, websocket: websockets.ClientConnection):
+        while True:
+            await self.outbox.wait_due()
+            # Give a burst of events a moment to gather into the same frame.
+            await asyncio.sleep(self.batch_linger)
+            batch = []
+            for message_id, message in self.outbox.pop_due():
+                batch.append(self._framed(message))
+                if len(batch) >= self.batch_size:
+                    await self._send_batch(websocket, batch)
+                    batch = []
+            if batch:
+                await self._send_batch(websocket, batch)
+
+    async def _send_batch(self, websocket: websockets.ClientConnection, batch):
+        await self._send(websocket, BATCH_ENVELOPE % ",".join(batch))
+        _sent.inc(len(batch))
+
+    def _framed(self, message: ServerMessage) -> str:
+        if self.sequenced:
+            return SEQUENCED_ENVELOPE % (message.seq, message.payload[1:])
+        return message.payload
+
+    async def _send(self, websocket: websockets.ClientConnection, text: str):
+        data = self.codec.encode(text)
+        if self.capture is not None:
+            self.capture.record(Channel.WS_OUT, data)
+        await websocket.send(data)
+
+    def _subprotocols(self) -> list[str]:
+        """
+        Subprotocols to offer, best first: session resume before plain
+        connections, the preferred codec before JSON and batched frames before
+        single ones.
+        """
+        offers = []
+        for resume in (True, False) if self.resume else (False,):
+            for codec in dict.fromkeys([self.preferred_codec, JSON]):
+                for batch in (True, False) if self.batch_size > 1 else (False,):
+                    name = subprotocol(codec, batch, resume)
+                    if name:
+                        offers.append(name)
+        return offers
+
+    def send_to_server(self, frame: DeviceFrame):
+        message_id = frame.message_id
+        if message_id and self.device_seen.seen((frame.device_id, message_id)):
+            # QoS 1 redelivery of a frame that is already on its way up.
+            return
+        self.presence.observe(frame)
+        for action in self.rules.match(frame):
+            self._route_to_device(action)
+        if self.state_cache is not None and not self.state_cache.observe(frame):
+            return
+        self.coalescer.submit(frame)
+
+    def _enqueue(self, frame: DeviceFrame):
+        if self.strict:
+            rm = DeviceRouterMessage(payload=frame.validate())
+            message_id, payload = rm.message_id, rm.model_dump_json()
+        else:
+            message_id = uuid4()
+            payload = DEVICE_ENVELOPE % (message_id, frame.raw)
+        lane = classify(frame.data)
+        if not self.outbox.put(message_id, ServerMessage(payload=payload, lane=lane)):
+            logger.warning(f"Outbox lane {lane.name} is full, rejected {message_id}")
+
+    def send_camera_message(self, message: CameraRouterMessage):
+        payload = ServerMessage(
+            payload=message.model_dump_json(), lane=LaneKind.TELEMETRY
         )
+        self.outbox.put(message.message_id, payload)
+
+    def is_congested(self) -> bool:
+        return self.outbox.is_congested()
 
     def bind_broker(self, broker):
         self.send_to_device = broker.send_to_device
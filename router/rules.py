@@ -0,0 +1,112 @@
+import logging
+from typing import Any, Optional
+from uuid import uuid4
+
+from pydantic import BaseModel, Field, ValidationError
+
+from device_message.enums import MessageDirection, MessageType, Scope
+from device_message.frame import DeviceFrame
+from router.codec import to_text
+
+logger = logging.getLogger(__name__)
+
+RuleKey = tuple[str, Optional[int], str]
+
+
+class RuleTrigger(BaseModel):
+    device_id: str
+    peripheral_id: Optional[int] = None
+    command: str
+
+
+class RuleAction(BaseModel):
+    device_id: str
+    peripheral_id: int
+    command: str
+    payload: Any = Field(default_factory=dict)
+
+
+class Rule(BaseModel):
+    id: Optional[str] = None
+    trigger: RuleTrigger
+    actions: list[RuleAction]
+
+
+class RuleEngine:
+    """
+    Runs the rules sent with UPDATE_RULE on the hub.
+
+    The payload of an UPDATE_RULE frame is expected to be
+    {"rules": [{"id": ..., "trigger": {...}, "actions": [{...}]}]} and
+    replaces every rule previously received for the same device. Rules are
+    compiled into an index keyed on (device_id, peripheral_id, command) of
+    the trigger, so matching an event is a single dict lookup. A trigger
+    without peripheral_id matches events from any peripheral.
+    """
+
+    def __init__(self):
+        self._index: dict[RuleKey, list[tuple[str, dict]]] = {}
+        self._owners: dict[str, set[RuleKey]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(keys) for keys in self._owners.values())
+
+    def update(self, frame: DeviceFrame) -> None:
+        payload = frame.payload
+        if not isinstance(payload, dict) or "rules" not in payload:
+            return
+        owner = frame.device_id
+        self.remove(owner)
+        keys = set()
+        for entry in payload["rules"]:
+            try:
+                rule = Rule.model_validate(entry)
+            except ValidationError as e:
+                logger.warning(f"Skipping invalid rule for {owner}: {e}")
+                continue
+            trigger = rule.trigger
+            key = (trigger.device_id, trigger.peripheral_id, trigger.command)
+            self._index.setdefault(key, []).extend(
+                (owner, self._compile(action)) for action in rule.actions
+            )
+            keys.add(key)
+        self._owners[owner] = keys
+        logger.info(f"Loaded rules for {len(keys)} triggers from {owner}")
+
+    def remove(self, owner: str) -> None:
+        for key in self._owners.pop(owner, ()):
+            actions = [entry for entry in self._index[key] if entry[0] != owner]
+            if actions:
+                self._index[key] = actions
+            else:
+                del self._index[key]
+
+    def match(self, frame: DeviceFrame) -> list[DeviceFrame]:
+        """
+        Frames for every action triggered by the event.
+        """
+        if not self._index:
+            return []
+        actions = self._index.get((frame.device_id, frame.peripheral_id, frame.command))
+        wildcard = self._index.get((frame.device_id, None, frame.command))
+        if not actions and not wildcard:
+            return []
+        frames = []
+        for _, template in (actions or []) + (wildcard or []):
+            data = dict(template)
+            data["message_id"] = uuid4().hex
+            frames.append(DeviceFrame(to_text(data, None), data))
+        return frames
+
+    @staticmethod
+    def _compile(action: RuleAction) -> dict:
+        return {
+            "direction": MessageDirection.INTENT.value,
+            "command": action.command,
+            "type": MessageType.ACTION.value,
+            "scope": Scope.PERIPHERAL.value,
+            "device_id": action.device_id,
+            "peripheral_id": action.peripheral_id,
+            "message_id": "",
+            "payload": action.payload,
+        }
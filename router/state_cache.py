@@ -0,0 +1,241 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Optional
+
+from device_message.enums import MessageCommand, MessageDirection
+from device_message.frame import DeviceFrame
+from router.codec import to_text
+from threads import run_in_thread_to_completion
+
+logger = logging.getLogger(__name__)
+
+# Device reports kept per peripheral, by the field they are cached under.
+REPORT_FIELDS = {
+    MessageCommand.ON_UPDATE_STATE: "state",
+    MessageCommand.ON_STATUS_REPORT: "status",
+}
+# Results that carry the peripheral's settings.
+SETTINGS_COMMANDS = frozenset(
+    {MessageCommand.GET_SETTINGS, MessageCommand.SET_SETTINGS}
+)
+# Server reads and the cached field that answers them.
+READ_FIELDS = {
+    MessageCommand.GET_STATE: "state",
+    MessageCommand.GET_SETTINGS: "settings",
+}
+# Device commands after which nothing cached for the device can be trusted.
+RESET_COMMANDS = frozenset(
+    {
+        MessageCommand.DEVICE_CONNECT,
+        MessageCommand.RESTART,
+        MessageCommand.UPDATE_FIRMWARE,
+        MessageCommand.UPDATE_PERIPHERAL,
+    }
+)
+# Commands whose payload the cache needs to see.
+CACHED_COMMANDS = frozenset(REPORT_FIELDS) | SETTINGS_COMMANDS
+
+PeripheralKey = tuple[str, Optional[int]]
+
+
+class _Field:
+    __slots__ = ("value", "at", "forwarded")
+
+    def __init__(self, value: Any, at: float, forwarded: float):
+        self.value = value
+        self.at = at
+        self.forwarded = forwarded
+
+
+class _Entry:
+    __slots__ = ("version", "fields")
+
+    def __init__(self, version: int = 0):
+        self.version = version
+        self.fields: dict[str, _Field] = {}
+
+
+class StateCache:
+    """
+    Last known state, status and settings of every peripheral.
+
+    Fields are filled from ON_UPDATE_STATE and ON_STATUS_REPORT events and
+    from GET_SETTINGS and SET_SETTINGS results, and every change bumps the
+    peripheral's version. GET_STATE and GET_SETTINGS from the server are
+    answered from fields confirmed by the device less than max_age seconds
+    ago. A report with the same value as the last one forwarded is
+    suppressed unless refresh_interval seconds have passed since. Commands
+    sent to a peripheral mark its fields stale until the device reports
+    again.
+
+    With a path the cache is written to a JSON snapshot every
+    snapshot_interval seconds while it changes and loaded at startup.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_age: float = 300.0,
+        refresh_interval: float = 900.0,
+        snapshot_interval: float = 30.0,
+    ):
+        self.path = path
+        self.max_age = max_age
+        self.refresh_interval = refresh_interval
+        self.snapshot_interval = snapshot_interval
+        self.hits = 0
+        self.suppressed = 0
+        self._entries: dict[PeripheralKey, _Entry] = {}
+        self._dirty = False
+        if path is not None:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def observe(self, frame: DeviceFrame) -> bool:
+        """
+        Record a frame from a device. Returns False for a report the server
+        already has.
+        """
+        command = frame.command
+        if command in RESET_COMMANDS:
+            self._reset(frame.device_id)
+            return True
+        field = REPORT_FIELDS.get(command)
+        if field is None:
+            if (
+                command in SETTINGS_COMMANDS
+                and frame.data.get("direction") == MessageDirection.RESULT.value
+            ):
+                self._store(frame, "settings", time.time())
+            return True
+        now = time.time()
+        key = (frame.device_id, frame.peripheral_id)
+        entry = self._entries.get(key)
+        cached = entry.fields.get(field) if entry is not None else None
+        if (
+            cached is not None
+            and cached.value == frame.payload
+            and now - cached.forwarded < self.refresh_interval
+        ):
+            cached.at = now
+            self._dirty = True
+            self.suppressed += 1
+            return False
+        self._store(frame, field, now).forwarded = now
+        return True
+
+    def answer(self, query: DeviceFrame) -> Optional[DeviceFrame]:
+        """
+        Reply to a read from the server, or None if it must go to the device.
+        """
+        field = READ_FIELDS.get(query.command)
+        entry = self._entries.get((query.device_id, query.peripheral_id))
+        if field is None or entry is None:
+            return None
+        cached = entry.fields.get(field)
+        if cached is None or time.time() - cached.at >= self.max_age:
+            return None
+        self.hits += 1
+        data = dict(query.data)
+        data["direction"] = MessageDirection.RESULT.value
+        data["payload"] = cached.value
+        data["version"] = entry.version
+        return DeviceFrame(to_text(data, None), data)
+
+    def invalidate(self, frame: DeviceFrame) -> None:
+        """
+        Mark what a command sent to a device may change as stale.
+        """
+        command = frame.command
+        if command in READ_FIELDS:
+            return
+        if command in RESET_COMMANDS:
+            self._reset(frame.device_id)
+            return
+        entry = self._entries.get((frame.device_id, frame.peripheral_id))
+        if entry is None:
+            return
+        names = list(REPORT_FIELDS.values())
+        if command == MessageCommand.SET_SETTINGS:
+            names.append("settings")
+        for name in names:
+            cached = entry.fields.get(name)
+            if cached is not None:
+                cached.at = cached.forwarded = 0.0
+
+    async def run(self) -> None:
+        if self.path is None:
+            return
+        try:
+            while True:
+                await asyncio.sleep(self.snapshot_interval)
+                if self._dirty:
+                    await run_in_thread_to_completion(self._save, self._snapshot())
+        finally:
+            if self._dirty:
+                self._save(self._snapshot())
+
+    def _store(self, frame: DeviceFrame, field: str, now: float) -> _Field:
+        key = (frame.device_id, frame.peripheral_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        cached = entry.fields.get(field)
+        if cached is None:
+            cached = entry.fields[field] = _Field(frame.payload, now, 0.0)
+            entry.version += 1
+        else:
+            if cached.value != frame.payload:
+                cached.value = frame.payload
+                entry.version += 1
+            cached.at = now
+        self._dirty = True
+        return cached
+
+    def _reset(self, device_id: str) -> None:
+        for key in [key for key in self._entries if key[0] == device_id]:
+            del self._entries[key]
+            self._dirty = True
+
+    def _snapshot(self) -> list:
+        self._dirty = False
+        return [
+            [
+                device_id,
+                peripheral_id,
+                entry.version,
+                {
+                    name: [field.value, field.at, field.forwarded]
+                    for name, field in entry.fields.items()
+                },
+            ]
+            for (device_id, peripheral_id), entry in self._entries.items()
+        ]
+
+    def _save(self, snapshot: list) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
+
+    def _load(self) -> None:
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+            for device_id, peripheral_id, version, fields in snapshot:
+                entry = self._entries[(device_id, peripheral_id)] = _Entry(version)
+                for name, (value, at, forwarded) in fields.items():
+                    entry.fields[name] = _Field(value, at, forwarded)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            return
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable state cache {self.path}: {e}")
+            self._entries.clear()
+            return
+        logger.info(f"Loaded state of {len(self._entries)} peripherals")
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterator, Optional, Union
+from uuid import UUID
+
+from threads import run_in_thread_to_completion
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxStore:
+    """
+    Write-ahead journal for the outbox backed by SQLite in WAL mode.
+
+    Appends and acks are buffered in memory and written by a single
+    background task in one transaction per commit interval, so the cost of
+    an fsync is shared by every message of the batch. A message acked before
+    its batch is written never reaches the disk. A batch that fails to write
+    is put back in front of the pending writes and tried again with the
+    next one. Acked rows are reclaimed by periodic WAL checkpoints and
+    incremental vacuum.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        commit_interval: float = 0.05,
+        batch_size: int = 1000,
+        compact_interval: float = 60.0,
+        synchronous: str = "NORMAL",
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.commit_interval = commit_interval
+        self.batch_size = batch_size
+        self.compact_interval = compact_interval
+        self._pending_puts: dict[UUID, str] = {}
+        self._pending_acks: set[UUID] = set()
+        # Batch the last flush failed to write, set by the writer thread.
+        self._failed: Optional[tuple[dict[UUID, str], set[UUID]]] = None
+        self._batch_full = asyncio.Event()
+        self._last_compact = time.monotonic()
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY, "
+            "message_id BLOB UNIQUE NOT NULL, "
+            "payload TEXT NOT NULL)"
+        )
+
+    def __len__(self) -> int:
+        return len(self._pending_puts) + len(self._pending_acks)
+
+    def load(self) -> Iterator[tuple[UUID, str]]:
+        for message_id, payload in self._conn.execute(
+            "SELECT message_id, payload FROM outbox ORDER BY id"
+        ):
+            yield UUID(bytes=message_id), payload
+
+    def append(self, message_id: UUID, payload: str) -> None:
+        self._pending_puts[message_id] = payload
+        if len(self) >= self.batch_size:
+            self._batch_full.set()
+
+    def remove(self, message_id: UUID) -> None:
+        if self._pending_puts.pop(message_id, None) is None:
+            self._pending_acks.add(message_id)
+            if len(self) >= self.batch_size:
+                self._batch_full.set()
+
+    async def run(self) -> None:
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(
+                        self._batch_full.wait(), self.commit_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                self._batch_full.clear()
+                await run_in_thread_to_completion(self._flush, *self._take())
+                self._requeue()
+        finally:
+            self._requeue()
+            self._flush(*self._take())
+            self._conn.close()
+
+    def _take(self) -> tuple[dict[UUID, str], set[UUID]]:
+        puts, acks = self._pending_puts, self._pending_acks
+        self._pending_puts, self._pending_acks = {}, set()
+        return puts, acks
+
+    def _requeue(self) -> None:
+        if self._failed is None:
+            return
+        puts, acks = self._failed
+        self._failed = None
+        # A message acked since is in both and gets inserted, then deleted.
+        puts.update(self._pending_puts)
+        self._pending_puts = puts
+        self._pending_acks |= acks
+
+    def _flush(self, puts: dict[UUID, str], acks: set[UUID]) -> None:
+        if puts or acks:
+            try:
+                with self._conn:
+                    self._conn.execute("BEGIN")
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO outbox (message_id, payload) "
+                        "VALUES (?, ?)",
+                        ((key.bytes, payload) for key, payload in puts.items()),
+                    )
+                    self._conn.executemany(
+                        "DELETE FROM outbox WHERE message_id = ?",
+                        ((key.bytes,) for key in acks),
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Failed to write outbox journal: {e}", exc_info=True)
+                self._failed = (puts, acks)
+        if time.monotonic() - self._last_compact > self.compact_interval:
+            self._last_compact = time.monotonic()
+            self._compact()
+
+    def _compact(self) -> None:
+        try:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.execute("PRAGMA incremental_vacuum")
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to compact outbox journal: {e}")
@@ -0,0 +1,76 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+
+from router.lanes import LaneKind
+from router.message import RouterMessageType, ServerMessage
+from router.outbox import Outbox
+from router.router import Router
+
+
+@pytest.fixture
+def make_outbox():
+    """
+    Build an Outbox inside a running loop, which its wakeup event needs.
+    """
+
+    def make(**kwargs) -> Outbox:
+        async def create():
+            return Outbox(**kwargs)
+
+        return asyncio.run(create())
+
+    return make
+
+
+@pytest.fixture
+def put():
+    """
+    Put an empty message on a lane of an outbox and return its id.
+    """
+
+    def put(outbox: Outbox, lane: LaneKind, payload: str = "{}"):
+        message_id = uuid4()
+        assert outbox.put(message_id, ServerMessage(payload=payload, lane=lane))
+        return message_id
+
+    return put
+
+
+@pytest.fixture
+def router() -> Router:
+    """
+    Router without a connection. Frames it sends to devices are kept in
+    router.sent.
+    """
+
+    async def create():
+        return Router("ws://localhost:1", None, None)
+
+    router = asyncio.run(create())
+    router.sent = []
+    router.send_to_device = router.sent.append
+    return router
+
+
+@pytest.fixture
+def server_message():
+    """
+    Device message from the server as a decoded envelope.
+    """
+
+    def message(seq: int = 0, command: str = "restart") -> dict:
+        envelope = {"target": RouterMessageType.DEVICE, "message_id": uuid4().hex}
+        if seq:
+            envelope["seq"] = seq
+        envelope["payload"] = {
+            "direction": 1,
+            "command": command,
+            "type": 0,
+            "device_id": "02:00:00:00:00:01",
+            "message_id": uuid4().hex,
+        }
+        return envelope
+
+    return message
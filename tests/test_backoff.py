@@ -0,0 +1,19 @@
+from backoff import Backoff
+
+
+def test_delays_are_jittered_in_the_upper_half_of_each_step():
+    backoff = Backoff(base=1, cap=8)
+    for _ in range(20):
+        steps = [backoff.next_delay() for _ in range(6)]
+        for delay, step in zip(steps, [1, 2, 4, 8, 8, 8]):
+            assert step / 2 <= delay <= step
+        backoff.reset()
+    assert len({Backoff(base=1).next_delay() for _ in range(20)}) > 1
+
+
+def test_reset_starts_over_from_the_base():
+    backoff = Backoff(base=1, cap=60)
+    for _ in range(10):
+        backoff.next_delay()
+    backoff.reset()
+    assert backoff.next_delay() <= 1
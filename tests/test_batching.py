@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+from router.codec import JSON, subprotocol
+from router.lanes import LaneKind
+from router.message import RouterMessageType
+
+
+class WebSocket:
+    def __init__(self, batch: bool):
+        self.subprotocol = subprotocol(JSON, batch)
+        self.frames = []
+
+    async def send(self, data):
+        self.frames.append(json.loads(data))
+
+
+def sending(router, websocket, scenario):
+    async def run():
+        task = asyncio.create_task(router._send_to_server(websocket))
+        try:
+            await scenario()
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    return websocket.frames
+
+
+def test_due_messages_are_sent_in_batches_of_batch_size(router, put):
+    router.batch_size = 3
+    for n in range(7):
+        put(router.outbox, LaneKind.TELEMETRY, json.dumps({"n": n}))
+    frames = sending(router, WebSocket(batch=True), lambda: asyncio.sleep(0.05))
+    assert [frame["target"] for frame in frames] == [RouterMessageType.BATCH] * 3
+    assert [[m["n"] for m in frame["messages"]] for frame in frames] == [
+        [0, 1, 2],
+        [3, 4, 5],
+        [6],
+    ]
+
+
+def test_a_burst_within_the_linger_shares_a_frame(router, put):
+    router.batch_linger = 0.05
+    websocket = WebSocket(batch=True)
+
+    async def scenario():
+        put(router.outbox, LaneKind.TELEMETRY, '{"n":0}')
+        await asyncio.sleep(0.01)
+        assert websocket.frames == []
+        put(router.outbox, LaneKind.TELEMETRY, '{"n":1}')
+        await asyncio.sleep(0.1)
+
+    [frame] = sending(router, websocket, scenario)
+    assert frame["messages"] == [{"n": 0}, {"n": 1}]
+
+
+def test_messages_go_one_per_frame_without_batching(router, put):
+    for n in range(3):
+        put(router.outbox, LaneKind.TELEMETRY, json.dumps({"n": n}))
+    frames = sending(router, WebSocket(batch=False), lambda: asyncio.sleep(0.05))
+    assert frames == [{"n": 0}, {"n": 1}, {"n": 2}]
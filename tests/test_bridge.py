@@ -0,0 +1,94 @@
+import asyncio
+import threading
+
+from bridge import FrameBridge
+
+
+def put_from_thread(bridge: FrameBridge, frames) -> list:
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.extend(bridge.put(frame) for frame in frames)
+    )
+    thread.start()
+    thread.join()
+    return results
+
+
+def test_full_bridge_drops_and_counts():
+    handled = []
+
+    async def scenario():
+        bridge = FrameBridge(handled.append, maxsize=3)
+        bridge.bind_loop(asyncio.get_running_loop())
+        results = put_from_thread(bridge, range(5))
+        assert results == [True, True, True, False, False]
+        assert (bridge.depth, bridge.received, bridge.dropped) == (3, 3, 2)
+        await asyncio.sleep(0)
+        return bridge
+
+    bridge = asyncio.run(scenario())
+    assert handled == [0, 1, 2]
+    assert bridge.depth == 0
+
+
+def test_frames_are_drained_on_the_loop_in_batches():
+    handled = []
+
+    async def scenario():
+        loop_thread = threading.get_ident()
+        bridge = FrameBridge(
+            lambda frame: handled.append((frame, threading.get_ident())),
+            batch_size=2,
+        )
+        bridge.bind_loop(asyncio.get_running_loop())
+        put_from_thread(bridge, range(5))
+        assert handled == []
+        depths = []
+        for _ in range(3):
+            await asyncio.sleep(0)
+            depths.append(bridge.depth)
+        assert depths == [3, 1, 0]
+        return loop_thread
+
+    loop_thread = asyncio.run(scenario())
+    assert handled == [(frame, loop_thread) for frame in range(5)]
+
+
+def test_handler_errors_do_not_stop_the_drain():
+    handled = []
+
+    def handler(frame):
+        if frame == 1:
+            raise ValueError("bad frame")
+        handled.append(frame)
+
+    async def scenario():
+        bridge = FrameBridge(handler)
+        bridge.bind_loop(asyncio.get_running_loop())
+        put_from_thread(bridge, range(3))
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert handled == [0, 2]
+
+
+def test_paused_bridge_retries_until_resumed():
+    handled = []
+    paused = [True]
+
+    async def scenario():
+        bridge = FrameBridge(handled.append, maxsize=2, pause_interval=0.01)
+        bridge.is_paused = lambda: paused[0]
+        bridge.bind_loop(asyncio.get_running_loop())
+        put_from_thread(bridge, range(3))
+        await asyncio.sleep(0.05)
+        # The producer is pushed back by the full buffer meanwhile.
+        assert handled == []
+        assert bridge.dropped == 1
+        paused[0] = False
+        await asyncio.sleep(0.05)
+        put_from_thread(bridge, [3])
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert handled == [0, 1, 3]
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import time
+
+from camera.manager import CameraManager
+from camera.stream import CameraStream
+
+SLEEP = ["sleep", "31.4159"]
+
+
+def running_sleeps() -> list[int]:
+    pids = []
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                if f.read().split(b"\0")[:-1] == [arg.encode() for arg in SLEEP]:
+                    pids.append(int(pid))
+        except OSError:
+            pass
+    return pids
+
+
+def test_cancel_during_spawn_kills_the_process():
+    async def scenario(yields: int):
+        stream = CameraStream(1, "rtsp://camera", "rtsp://relay")
+        stream.command = lambda: SLEEP
+        task = asyncio.create_task(stream._spawn())
+        for _ in range(yields):
+            await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return task.cancelled()
+
+    for yields in range(8):
+        if not asyncio.run(scenario(yields)):
+            break
+        assert running_sleeps() == []
+
+
+def idle_stream(manager: CameraManager, camera_id: int) -> CameraStream:
+    stream = CameraStream(camera_id, "rtsp://camera", "rtsp://relay")
+    stream.idle_since = time.monotonic()
+    manager.opened_stream[camera_id] = stream
+    return stream
+
+
+def test_forced_reap_skips_cameras_being_started_or_stopped():
+    async def scenario():
+        manager = CameraManager(idle_timeout=60)
+        idle_stream(manager, 1)
+        idle_stream(manager, 2)
+        watched = idle_stream(manager, 3)
+        watched.idle_since = None
+        async with manager.locks.setdefault(2, asyncio.Lock()):
+            await manager.reap()
+            assert sorted(manager.opened_stream) == [1, 2, 3]
+            await manager.reap(force=True)
+        return sorted(manager.opened_stream)
+
+    assert asyncio.run(scenario()) == [2, 3]
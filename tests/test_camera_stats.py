@@ -0,0 +1,43 @@
+from camera.stats import StreamStats, parse_progress
+
+
+def block(frame: int, speed: str, bitrate: str = "2048.0kbits/s") -> dict:
+    return {
+        "frame": str(frame),
+        "fps": "25.00",
+        "bitrate": bitrate,
+        "drop_frames": "0",
+        "speed": speed,
+        "progress": "continue",
+    }
+
+
+def test_progress_fields_are_parsed():
+    sample = parse_progress(block(250, "1.01x"))
+    assert sample.frame == 250
+    assert sample.fps == 25.0
+    assert sample.bitrate == 2048.0
+    assert sample.speed == 1.01
+
+
+def test_unavailable_values_are_none():
+    sample = parse_progress(block(0, "N/A", bitrate="N/A"))
+    assert sample.speed is None
+    assert sample.bitrate is None
+    assert parse_progress({"progress": "continue"}).frame == 0
+
+
+def test_unavailable_speeds_are_left_out_of_the_average():
+    stats = StreamStats(size=8)
+    for frame in range(4):
+        stats.add(parse_progress(block(frame, "N/A")))
+    assert not stats.is_below_realtime()
+    for frame in range(4, 6):
+        stats.add(parse_progress(block(frame, "1.0x")))
+    assert not stats.is_below_realtime()
+    stats.add(parse_progress(block(6, "0.5x")))
+    assert stats.is_below_realtime()
+    summary = stats.summary()
+    assert summary.speed == 0.5
+    stats.add(parse_progress(block(7, "N/A")))
+    assert stats.summary().speed is None
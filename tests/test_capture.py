@@ -0,0 +1,43 @@
+import pytest
+
+from capture import Capture, Channel, read_capture
+
+
+def test_records_round_trip(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    capture = Capture(path)
+    capture.record(Channel.MQTT_IN, b"\x81\xa1a\x01", "hub/msgpack")
+    capture.record(Channel.WS_OUT, '{"target":1}')
+    capture.flush()
+    # Reopening appends after the records already there.
+    capture._file.close()
+    capture = Capture(path)
+    capture.record(Channel.WS_IN, "")
+    capture.flush()
+    capture._file.close()
+    records = list(read_capture(path))
+    assert [(r.channel, r.topic, r.payload) for r in records] == [
+        (Channel.MQTT_IN, "hub/msgpack", b"\x81\xa1a\x01"),
+        (Channel.WS_OUT, "", b'{"target":1}'),
+        (Channel.WS_IN, "", b""),
+    ]
+    assert records[0].at <= records[1].at <= records[2].at
+
+
+def test_truncated_record_ends_the_capture(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    capture = Capture(path)
+    capture.record(Channel.MQTT_OUT, "first", "device/a/")
+    capture.record(Channel.MQTT_OUT, "second", "device/a/")
+    capture.flush()
+    capture._file.close()
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 3)
+    assert [r.payload for r in read_capture(path)] == [b"first"]
+
+
+def test_other_files_are_refused(tmp_path):
+    path = tmp_path / "capture.bin"
+    path.write_bytes(b"not a capture")
+    with pytest.raises(ValueError):
+        list(read_capture(str(path)))
@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+from device_message.enums import MessageDirection
+from device_message.frame import DeviceFrame
+from router.coalescer import Coalescer
+
+
+def measurement(value: float, peripheral_id: int = 1) -> DeviceFrame:
+    data = {
+        "direction": MessageDirection.INTENT.value,
+        "command": "on_measure_temperature",
+        "type": 1,
+        "device_id": "02:00:00:00:00:01",
+        "peripheral_id": peripheral_id,
+        "payload": {"value": value},
+    }
+    return DeviceFrame(json.dumps(data), data)
+
+
+def test_window_forwards_first_and_last_with_stats():
+    forwarded = []
+
+    async def scenario():
+        coalescer = Coalescer(forwarded.append, window=0.02, stats=True)
+        for value in (20.0, 21.0, 23.0, 22.0):
+            coalescer.submit(measurement(value))
+        coalescer.submit(measurement(30.0, peripheral_id=2))
+        await asyncio.sleep(0.03)
+        return coalescer
+
+    coalescer = asyncio.run(scenario())
+    values = [frame.payload["value"] for frame in forwarded]
+    assert values == [20.0, 30.0, 22.0]
+    assert forwarded[2].payload["stats"] == {
+        "min": 21.0,
+        "max": 23.0,
+        "avg": 22.0,
+        "count": 3,
+    }
+    assert json.loads(forwarded[2].raw)["payload"]["stats"]["count"] == 3
+    assert coalescer.coalesced == 2
+
+
+def test_other_commands_and_results_pass_through():
+    forwarded = []
+    coalescer = Coalescer(forwarded.append, window=60)
+    result = measurement(1.0)
+    result.data["direction"] = MessageDirection.RESULT.value
+    click = DeviceFrame("{}", {"command": "on_click", "device_id": "d"})
+    for frame in (result, result, click, click):
+        coalescer.submit(frame)
+    assert forwarded == [result, result, click, click]
@@ -0,0 +1,79 @@
+import json
+from uuid import uuid4
+
+import msgpack
+import pytest
+
+from router.codec import (
+    JSON,
+    MSGPACK,
+    Codec,
+    parse_subprotocol,
+    subprotocol,
+)
+from router.message import RouterMessageType
+
+
+def device_message() -> dict:
+    return {
+        "target": RouterMessageType.DEVICE,
+        "message_id": str(uuid4()),
+        "payload": {
+            "direction": 0,
+            "command": "get_state",
+            "type": 0,
+            "device_id": "02:00:00:00:00:01",
+            "peripheral_id": 1,
+        },
+    }
+
+
+def test_codec_is_abstract():
+    with pytest.raises(TypeError):
+        Codec()
+
+    class Partial(Codec):
+        def encode(self, text):
+            return text
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_json_keeps_the_text():
+    text = json.dumps(device_message())
+    assert JSON.encode(text) is text
+    assert JSON.decode(text.encode()) == (json.loads(text), text)
+
+
+def test_msgpack_round_trip_compacts_enums_and_ids():
+    message = device_message()
+    ack = {"target": RouterMessageType.ACK, "message_ids": [str(uuid4())], "seq": 3}
+    batch = {"target": RouterMessageType.BATCH, "messages": [message, ack]}
+    data = MSGPACK.encode(json.dumps(batch))
+    compact = msgpack.unpackb(data, raw=False)
+    assert isinstance(compact["messages"][0]["message_id"], bytes)
+    assert isinstance(compact["messages"][0]["payload"]["command"], int)
+    decoded, text = MSGPACK.decode(data)
+    assert text is None
+    assert decoded == json.loads(json.dumps(batch))
+    assert len(data) < len(json.dumps(batch))
+
+
+def test_msgpack_accepts_json_text():
+    text = json.dumps(device_message())
+    assert MSGPACK.decode(text) == (json.loads(text), text)
+
+
+def test_unknown_command_index_is_kept():
+    data = msgpack.packb({"device_id": "d", "command": 10_000})
+    assert MSGPACK.decode(data)[0]["command"] == 10_000
+
+
+def test_subprotocol_names():
+    assert subprotocol(JSON, False) is None
+    name = subprotocol(MSGPACK, True, resume=True)
+    assert name == "smart-home.msgpack.batch.resume.v1"
+    assert parse_subprotocol(name) == (MSGPACK, True, True)
+    assert parse_subprotocol(subprotocol(JSON, True)) == (JSON, True, False)
+    assert parse_subprotocol(None) == (JSON, False, False)
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from device_message.frame import DeviceFrame
+from router.dedup import DedupCache
+
+
+def test_repeats_are_seen_until_they_expire():
+    cache = DedupCache(ttl=60)
+    assert not cache.seen("a")
+    assert cache.seen("a")
+    assert cache.duplicates == 1
+    cache._seen["a"] -= 60
+    assert not cache.seen("a")
+
+
+def test_oldest_key_is_evicted_when_full():
+    cache = DedupCache(maxsize=2)
+    for key in "abc":
+        cache.seen(key)
+    assert len(cache) == 2
+    assert not cache.seen("a")
+    assert cache.seen("c")
+
+
+def click(message_id: str) -> DeviceFrame:
+    data = {
+        "direction": 1,
+        "command": "on_click",
+        "type": 1,
+        "device_id": "02:00:00:00:00:01",
+        "peripheral_id": 1,
+        "message_id": message_id,
+    }
+    return DeviceFrame(json.dumps(data), data)
+
+
+def test_redelivered_device_frames_are_queued_once(router):
+    router.send_to_server(click("m1"))
+    router.send_to_server(click("m1"))
+    router.send_to_server(click("m2"))
+    assert len(router.outbox) == 2
+
+
+def test_replayed_server_messages_are_acked_but_not_acted_on(router, server_message):
+    message = server_message()
+    raw = json.dumps(message)
+    router._dispatch(raw)
+    router._dispatch(raw)
+    assert len(router.sent) == 1
+    assert router._duplicate_acks == [message["message_id"]]
+
+
+def test_server_messages_that_failed_are_handled_when_replayed(router, server_message):
+    message = server_message()
+    raw = json.dumps(message)
+    send = router.send_to_device
+
+    def fail(frame):
+        raise ConnectionError("broker down")
+
+    router.send_to_device = fail
+    with pytest.raises(ConnectionError):
+        router._dispatch(raw)
+    router.send_to_device = send
+    router._dispatch(raw)
+    assert len(router.sent) == 1
+    assert router._duplicate_acks == []
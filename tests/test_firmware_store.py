@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+from webapp import firmware_store
+from webapp.firmware_store import FirmwareStore
+
+
+def write_part(store: FirmwareStore, name: str, data: bytes) -> str:
+    path = store.tmp_path(name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+def add(store: FirmwareStore, name: str, data: bytes) -> str:
+    digest = write_part(store, name, data)
+    return store.add(name, digest, store.store_blob(store.tmp_path(name), digest))
+
+
+def test_same_binary_is_stored_once(tmp_path):
+    store = FirmwareStore(str(tmp_path), budget=1024)
+    first = add(store, "esp32_1.bin", b"a" * 100)
+    second = add(store, "esp32c3_1.bin", b"a" * 100)
+    assert first == second
+    assert store.size == 100
+    assert os.listdir(store.blob_dir) == [os.path.basename(first)]
+
+
+def test_evicts_least_recently_used_but_not_protected(tmp_path):
+    protected = {"esp32_1.bin"}
+    store = FirmwareStore(str(tmp_path), budget=250, protected=lambda: protected)
+    add(store, "esp32_1.bin", b"a" * 100)
+    add(store, "esp32_2.bin", b"b" * 100)
+    store.path("esp32_2.bin")
+    add(store, "esp32_3.bin", b"c" * 100)
+    assert set(store.entries) == {"esp32_1.bin", "esp32_3.bin"}
+    assert store.size == 200
+
+
+def test_index_survives_restart_without_rehashing(tmp_path):
+    store = FirmwareStore(str(tmp_path), budget=1024)
+    path = add(store, "esp32_1.bin", b"a" * 100)
+    open(os.path.join(store.blob_dir, "orphan"), "wb").close()
+    reopened = FirmwareStore(str(tmp_path), budget=1024)
+    assert reopened.path("esp32_1.bin") == path
+    assert os.listdir(reopened.blob_dir) == [os.path.basename(path)]
+
+
+def test_imports_legacy_files(tmp_path):
+    with open(tmp_path / "esp32_1.bin", "wb") as f:
+        f.write(b"legacy")
+    store = FirmwareStore(str(tmp_path), budget=1024)
+    assert not (tmp_path / "esp32_1.bin").exists()
+    with open(store.path("esp32_1.bin"), "rb") as f:
+        assert f.read() == b"legacy"
+
+
+def test_recency_survives_restart(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(firmware_store.time, "time", lambda: now[0])
+    store = FirmwareStore(str(tmp_path), budget=250)
+    add(store, "esp32_1.bin", b"a" * 100)
+    now[0] += 1
+    add(store, "esp32_2.bin", b"b" * 100)
+    now[0] += 100
+    store.path("esp32_1.bin")
+    reopened = FirmwareStore(str(tmp_path), budget=250)
+    add(reopened, "esp32_3.bin", b"c" * 100)
+    assert set(reopened.entries) == {"esp32_1.bin", "esp32_3.bin"}
+
+
+def test_corrupt_index_is_rebuilt_from_the_blobs(tmp_path):
+    store = FirmwareStore(str(tmp_path), budget=1024)
+    path = add(store, "esp32_1.bin", b"a" * 100)
+    add(store, "esp32c3_1.bin", b"a" * 100)
+    damaged = add(store, "esp32_2.bin", b"b" * 100)
+    with open(damaged, "wb") as f:
+        f.write(b"x" * 100)
+    with open(store.index_path, "w") as f:
+        f.write('{"esp32_1.bin": {"dig')
+    reopened = FirmwareStore(str(tmp_path), budget=1024)
+    assert set(reopened.entries) == {"esp32_1.bin", "esp32c3_1.bin"}
+    assert reopened.path("esp32c3_1.bin") == path
+    assert os.listdir(reopened.blob_dir) == [os.path.basename(path)]
+    assert sorted(os.listdir(reopened.name_dir)) == ["esp32_1.bin", "esp32c3_1.bin"]
+
+
+def test_invalid_index_entries_are_skipped(tmp_path):
+    store = FirmwareStore(str(tmp_path), budget=1024)
+    path = add(store, "esp32_1.bin", b"a" * 100)
+    with open(store.index_path) as f:
+        index = json.load(f)
+    index["esp32_2.bin"] = {"digest": "abc", "size": "big"}
+    with open(store.index_path, "w") as f:
+        json.dump(index, f)
+    reopened = FirmwareStore(str(tmp_path), budget=1024)
+    assert set(reopened.entries) == {"esp32_1.bin"}
+    assert reopened.path("esp32_1.bin") == path
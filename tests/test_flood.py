@@ -0,0 +1,47 @@
+import asyncio
+
+from device_message.frame import DeviceFrame
+from mqtt import Mqtt
+from router.flood import FloodGuard
+from router.lanes import LaneKind
+
+
+def frame(device_id: str, command: str = "on_click") -> DeviceFrame:
+    data = {"direction": 1, "command": command, "type": 2, "device_id": device_id}
+    return DeviceFrame("{}", data)
+
+
+def test_flood_is_reported_once_and_ends_on_a_timer():
+    reports = []
+
+    async def scenario():
+        guard = FloodGuard({LaneKind.STATE: (0.001, 2)}, quiet=0.05)
+        guard.report = reports.append
+        admitted = [guard.admit(frame("flooder")) for _ in range(10)]
+        assert admitted == [True, True] + [False] * 8
+        assert guard.admit(frame("neighbour"))
+        await asyncio.sleep(0.03)
+        assert not guard.admit(frame("flooder"))
+        await asyncio.sleep(0.03)
+        # The last drop pushed the end back.
+        assert len(reports) == 1
+        await asyncio.sleep(0.05)
+        return guard
+
+    guard = asyncio.run(scenario())
+    states = [(r.device_id, r.payload["state"], r.payload["dropped"]) for r in reports]
+    assert states == [("flooder", "start", 0), ("flooder", "end", 9)]
+    assert reports[0].command == "device_flood"
+    assert guard.dropped == 9
+
+
+def test_unlimited_classes_pass():
+    guard = FloodGuard({LaneKind.TELEMETRY: (0.001, 1)})
+    assert all(guard.admit(frame("device")) for _ in range(5))
+
+
+def test_reports_skip_the_device_pipeline(router):
+    guard = FloodGuard()
+    mqtt = Mqtt("broker", 1883, flood_guard=guard)
+    mqtt.bind_router(router)
+    assert guard.report == router._enqueue
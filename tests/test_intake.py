@@ -0,0 +1,155 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import msgpack
+
+from benchmarks.mqtt_standin import Broker, DeviceClient
+from capture import Capture, Channel, read_capture
+from device_message.frame import DeviceFrame
+from intake import IntakeConfig, IntakeUplink, IntakeWorkers
+from metrics import MESSAGES_RECEIVED, MQTT_TO_OUTBOX, VALIDATION_FAILURES
+from router.codec import MSGPACK
+from router.flood import FloodGuard
+from router.lanes import LaneKind
+
+
+class Writer:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data: bytes):
+        self.data += data
+
+
+def frame(command: str, **fields) -> DeviceFrame:
+    data = {
+        "direction": 1,
+        "command": command,
+        "type": 2,
+        "scope": 2,
+        "device_id": "02:00:00:00:00:01",
+        "peripheral_id": 1,
+        "message_id": "m1",
+        "payload": {"value": 1},
+        **fields,
+    }
+    return DeviceFrame(json.dumps(data), data)
+
+
+def make_pool(**kwargs):
+    config = IntakeConfig(socket_path="intake.sock", mqtt_url="broker", mqtt_port=1)
+    pool = IntakeWorkers(1, config)
+    pool.received_frames = []
+    pool.send_to_server = pool.received_frames.append
+    for name, value in kwargs.items():
+        setattr(pool, name, value)
+    return pool, config
+
+
+def channel(pool, config, frames, codecs=None):
+    writer = Writer()
+    uplink = IntakeUplink(writer, codecs or {}, config)
+    for item in frames:
+        uplink.send_to_server(item)
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(writer.data)
+    for record in unpacker:
+        pool._receive(record)
+    return pool.received_frames
+
+
+def test_frames_cross_the_channel():
+    pool, config = make_pool()
+    sent = [frame("on_click"), frame("on_update_state", payload={"on": True})]
+    codecs = {"02:00:00:00:00:01": MSGPACK}
+    received = channel(pool, config, sent, codecs)
+    assert [item.raw for item in received] == [item.raw for item in sent]
+    # Only the routing fields of frames the hub does not read...
+    assert "payload" not in received[0].data
+    assert received[0].command == "on_click"
+    # ...but the whole state report for the state cache.
+    assert received[1].data == sent[1].data
+    assert pool.device_codecs["02:00:00:00:00:01"] is MSGPACK
+
+
+def test_flood_guard_applies_over_all_workers():
+    guard = FloodGuard({LaneKind.STATE: (0.001, 2)})
+    pool, config = make_pool(flood_guard=guard)
+
+    async def flood():
+        return channel(pool, config, [frame("on_click") for _ in range(5)])
+
+    received = asyncio.run(flood())
+    assert len(received) == 2
+    assert guard.dropped == 3
+
+
+def test_worker_stats_reach_the_metrics():
+    pool, _ = make_pool()
+    received = MESSAGES_RECEIVED.labels("mqtt").value
+    invalid = VALIDATION_FAILURES.labels("mqtt").value
+    observed = MQTT_TO_OUTBOX.count, MQTT_TO_OUTBOX.counts[0]
+    empty = [0] * len(MQTT_TO_OUTBOX.counts)
+    reported = {"invalid": 0, "failed": 0, "latency": None}
+    first = {"invalid": 2, "failed": 1, "latency": [[1, *empty[1:]], 0.001, 1]}
+    pool._add_stats(first, reported)
+    second = {"invalid": 3, "failed": 1, "latency": [[3, *empty[1:]], 0.003, 3]}
+    pool._add_stats(second, reported)
+    assert MESSAGES_RECEIVED.labels("mqtt").value == received + 4
+    assert VALIDATION_FAILURES.labels("mqtt").value == invalid + 3
+    assert pool.failed == 1
+    assert MQTT_TO_OUTBOX.count == observed[0] + 3
+    assert MQTT_TO_OUTBOX.counts[0] == observed[1] + 3
+
+
+async def wait_for(predicate, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.05)
+
+
+def test_workers_capture_and_time_frames(tmp_path):
+    capture = Capture(str(tmp_path / "capture.bin"))
+    payload = frame("on_click").raw.encode()
+    observed = MQTT_TO_OUTBOX.count
+    received = []
+
+    async def scenario():
+        broker = Broker()
+        await broker.start()
+        config = IntakeConfig(
+            socket_path=str(tmp_path / "intake.sock"),
+            mqtt_url=broker.host,
+            mqtt_port=broker.port,
+            stats_interval=0.05,
+            capture=True,
+        )
+        pool = IntakeWorkers(1, config)
+        pool.bind(
+            SimpleNamespace(send_to_server=received.append, is_congested=lambda: False),
+            SimpleNamespace(device_codecs={}, flood_guard=None, capture=capture),
+        )
+        task = asyncio.create_task(pool.run())
+        device = DeviceClient("02:00:00:00:00:01", lambda payload: None)
+        await device.connect(broker.host, broker.port)
+        try:
+            await wait_for(lambda: broker.subscribers("hub") >= 1)
+            device.publish(payload)
+            await wait_for(lambda: MQTT_TO_OUTBOX.count > observed)
+        finally:
+            await device.close()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await broker.stop()
+
+    asyncio.run(scenario())
+    capture.flush()
+    capture._file.close()
+    assert [item.raw for item in received] == [payload.decode()]
+    records = list(read_capture(capture.path))
+    assert [(r.channel, r.topic, r.payload) for r in records] == [
+        (Channel.MQTT_IN, "hub", payload)
+    ]
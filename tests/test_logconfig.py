@@ -0,0 +1,40 @@
+import logging
+
+import pytest
+
+from logconfig import RateLimitedLogger, set_levels
+
+
+def test_records_over_the_burst_are_counted_into_the_next_one(caplog):
+    limited = RateLimitedLogger(logging.getLogger("test.limited"), rate=1, burst=2)
+    with caplog.at_level(logging.INFO, "test.limited"):
+        for n in range(5):
+            limited.info("frame %d", n)
+        assert caplog.messages == ["frame 0", "frame 1"]
+        limited.updated -= 1
+        limited.info("frame %d", 5)
+    assert caplog.messages[-1] == "frame 5 (3 similar messages suppressed)"
+    assert limited.suppressed == 0
+
+
+def test_disabled_levels_take_no_tokens(caplog):
+    limited = RateLimitedLogger(logging.getLogger("test.disabled"), rate=1, burst=1)
+
+    class Unformattable:
+        def __str__(self):
+            raise AssertionError("formatted a record that is not emitted")
+
+    with caplog.at_level(logging.INFO, "test.disabled"):
+        limited.debug("frame %s", Unformattable())
+        limited.info("frame %d", 1)
+    assert caplog.messages == ["frame 1"]
+    assert limited.suppressed == 0
+
+
+def test_unknown_level_changes_no_logger():
+    first, second = logging.getLogger("test.first"), logging.getLogger("test.second")
+    with pytest.raises(ValueError):
+        set_levels({"test.first": "DEBUG", "test.second": "LOUD"})
+    assert first.level == second.level == logging.NOTSET
+    set_levels({"test.first": "DEBUG", "test.second": "ERROR"})
+    assert (first.level, second.level) == (logging.DEBUG, logging.ERROR)
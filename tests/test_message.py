@@ -0,0 +1,29 @@
+import json
+
+from router.message import raw_payload, scan_object
+
+
+def test_raw_payload_keeps_the_exact_text():
+    raw = '{"target":1,"message_id":"a","payload":{"b": 1.50, "a":[1, 2]}}'
+    assert raw_payload(raw, json.loads(raw)) == '{"b": 1.50, "a":[1, 2]}'
+
+
+def test_raw_payload_with_payload_not_last():
+    raw = '{"payload": {"x": "}"}, "meta": {"payload": 1}, "target": 1}'
+    assert raw_payload(raw, json.loads(raw)) == '{"x": "}"}'
+
+
+def test_scan_object_positions():
+    raw = '{"a": [1, {"b": "]"}], "c": "d"}'
+    scanned = scan_object(raw)
+    value, start, end = scanned["a"]
+    assert value == [1, {"b": "]"}]
+    assert raw[start:end] == '[1, {"b": "]"}]'
+    assert scanned["c"][0] == "d"
+
+
+def test_server_frames_reach_the_device_as_sent(router, server_message):
+    message = server_message()
+    router._dispatch(json.dumps(message, separators=(",", ":")))
+    [frame] = router.sent
+    assert frame.raw == json.dumps(message["payload"], separators=(",", ":"))
@@ -0,0 +1,35 @@
+from metrics import Registry
+
+
+def test_render_counters_gauges_and_histograms():
+    registry = Registry()
+    sent = registry.counter("sent_total", "Sent", ["destination"])
+    sent.labels("server").inc(3)
+    registry.gauge("depth", "Depth", lambda: 7)
+    registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1)).observe(0.5)
+    text = registry.render()
+    assert 'sent_total{destination="server"} 3' in text
+    assert "# TYPE depth gauge\ndepth 7" in text
+    assert 'latency_seconds_bucket{le="0.1"} 0' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 1' in text
+
+
+def test_callback_counter_with_labels():
+    registry = Registry()
+    drops = {"control": 0, "telemetry": 4}
+    registry.counter_func(
+        "dropped_total",
+        "Dropped",
+        lambda: [((k,), v) for k, v in drops.items()],
+        ["lane"],
+    )
+    text = registry.render()
+    assert "# TYPE dropped_total counter" in text
+    assert 'dropped_total{lane="telemetry"} 4' in text
+
+
+def test_gauge_registered_again_replaces_the_old_one():
+    registry = Registry()
+    registry.gauge("depth", "Depth", lambda: 1)
+    registry.gauge("depth", "Depth", lambda: 2)
+    assert "depth 2" in registry.render()
@@ -0,0 +1,103 @@
+import asyncio
+import socket
+import threading
+
+from paho.mqtt.client import DisconnectFlags
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.reasoncodes import ReasonCode
+
+from mqtt import Mqtt
+
+
+def make_mqtt(sock) -> Mqtt:
+    mqtt = Mqtt("localhost", 1, use_asyncio=True)
+    mqtt.loop = asyncio.get_running_loop()
+    mqtt.client.socket = lambda: sock
+    return mqtt
+
+
+def test_socket_callbacks_run_on_the_loop():
+    a, b = socket.socketpair()
+
+    async def scenario():
+        mqtt = make_mqtt(a)
+        loop = mqtt.loop
+        calls = []
+        for name in ("add_reader", "add_writer", "remove_reader", "remove_writer"):
+            method = getattr(loop, name)
+
+            def record(*args, method=method, name=name):
+                calls.append((name, threading.get_ident()))
+                return method(*args)
+
+            setattr(loop, name, record)
+        mqtt.client.loop_read = mqtt.client.loop_write = lambda: None
+        # paho calls them from the thread that connects.
+        await asyncio.to_thread(mqtt._on_socket_open, mqtt.client, None, a)
+        await asyncio.to_thread(mqtt._on_socket_register_write, mqtt.client, None, a)
+        await asyncio.sleep(0)
+        assert [name for name, _ in calls] == ["add_reader", "add_writer"]
+        # paho closes the socket right after these return, so the loop must
+        # have dropped it by then.
+        await asyncio.to_thread(mqtt._on_socket_unregister_write, mqtt.client, None, a)
+        assert calls[-1][0] == "remove_writer"
+        await asyncio.to_thread(mqtt._on_socket_close, mqtt.client, None, a)
+        assert not loop.remove_reader(a)
+        assert {ident for _, ident in calls} == {threading.get_ident()}
+        mqtt._misc_task.cancel()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        a.close()
+        b.close()
+
+
+def test_socket_closed_on_the_loop_is_dropped_at_once():
+    a, b = socket.socketpair()
+
+    async def scenario():
+        mqtt = make_mqtt(a)
+        mqtt.loop.add_reader(a, lambda: None)
+        mqtt.loop.add_writer(a, lambda: None)
+        mqtt._on_socket_unregister_write(mqtt.client, None, a)
+        mqtt._on_socket_close(mqtt.client, None, a)
+        assert not mqtt.loop.remove_reader(a)
+        assert not mqtt.loop.remove_writer(a)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        b.close()
+
+
+def test_connect_failure_schedules_a_reconnect_with_backoff():
+    async def scenario():
+        mqtt = make_mqtt(None)
+        scheduled = []
+        mqtt._schedule_reconnect = scheduled.append
+        mqtt.on_connect_fail(mqtt.client, None)
+        mqtt.on_connect_fail(mqtt.client, None)
+        assert scheduled == []
+        await asyncio.sleep(0)
+        return scheduled
+
+    first, second = asyncio.run(scenario())
+    assert 0.5 <= first <= 1
+    assert 1 <= second <= 2
+
+
+def test_only_unexpected_disconnects_reconnect():
+    async def scenario():
+        mqtt = make_mqtt(None)
+        scheduled = []
+        mqtt._schedule_reconnect = scheduled.append
+        local = DisconnectFlags(is_disconnect_packet_from_server=False)
+        normal = ReasonCode(PacketTypes.DISCONNECT, identifier=0)
+        mqtt.on_disconnect(mqtt.client, None, local, normal, None)
+        assert scheduled == []
+        lost = ReasonCode(PacketTypes.DISCONNECT, identifier=128)
+        mqtt.on_disconnect(mqtt.client, None, local, lost, None)
+        assert len(scheduled) == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,68 @@
+from uuid import uuid4
+
+from router.lanes import Lane, LaneKind
+from router.message import ServerMessage
+from router.outbox import RetryPolicy
+
+
+def test_lanes_are_served_by_weight(make_outbox, put):
+    outbox = make_outbox()
+    telemetry = [put(outbox, LaneKind.TELEMETRY) for _ in range(20)]
+    control = [put(outbox, LaneKind.CONTROL) for _ in range(20)]
+    first_round = [message_id for message_id, _ in outbox.pop_due()][:9]
+    assert first_round == control[:8] + telemetry[:1]
+
+
+def test_control_put_during_a_backlog_is_not_starved(make_outbox, put):
+    outbox = make_outbox()
+    for _ in range(500):
+        put(outbox, LaneKind.TELEMETRY)
+    sent = 0
+    control = None
+    for message_id, _ in outbox.pop_due():
+        sent += 1
+        if control is None:
+            control = put(outbox, LaneKind.CONTROL)
+        elif message_id == control:
+            break
+    else:
+        raise AssertionError("control message was not sent in the same pass")
+    assert sent <= 3
+
+
+def test_full_lane_sheds_oldest_or_rejects(make_outbox, put):
+    lanes = [
+        Lane(name="control", weight=1, maxsize=2, shed_oldest=False),
+        Lane(name="state", weight=1, maxsize=2),
+        Lane(name="telemetry", weight=1, maxsize=2),
+    ]
+    outbox = make_outbox(lanes=lanes)
+    oldest = put(outbox, LaneKind.STATE)
+    put(outbox, LaneKind.STATE)
+    put(outbox, LaneKind.STATE)
+    assert oldest not in outbox
+    put(outbox, LaneKind.CONTROL)
+    put(outbox, LaneKind.CONTROL)
+    assert not outbox.put(uuid4(), ServerMessage(payload="{}", lane=LaneKind.CONTROL))
+    stats = {s["lane"]: s for s in outbox.lane_stats()}
+    assert stats["state"]["dropped"] == 1 and stats["control"]["dropped"] == 1
+
+
+def test_ack_removes_and_expired_messages_are_dropped(make_outbox, put):
+    outbox = make_outbox(policy=RetryPolicy(interval=0, max_tries=2))
+    acked = put(outbox, LaneKind.STATE)
+    kept = put(outbox, LaneKind.STATE)
+    assert outbox.ack(acked)
+    assert not outbox.ack(acked)
+    tries = [message_id for message_id, _ in outbox.pop_due()]
+    tries += [message_id for message_id, _ in outbox.pop_due()]
+    assert tries == [kept, kept]
+    assert list(outbox.pop_due()) == []
+    assert kept not in outbox
+
+
+def test_message_is_yielded_once_per_pass(make_outbox, put):
+    outbox = make_outbox(policy=RetryPolicy(interval=0, max_tries=3))
+    message_id = put(outbox, LaneKind.STATE)
+    assert [item for item, _ in outbox.pop_due()] == [message_id]
+    assert [item for item, _ in outbox.pop_due()] == [message_id]
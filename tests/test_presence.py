@@ -0,0 +1,62 @@
+import json
+
+from device_message.frame import DeviceFrame
+from router.presence import PresenceRegistry
+
+SWITCH = "02:00:00:00:00:01"
+LAMP = "02:00:00:00:00:02"
+
+
+def frame(device_id: str, command: str, direction: int = 1) -> DeviceFrame:
+    data = {
+        "direction": direction,
+        "command": command,
+        "type": 0,
+        "device_id": device_id,
+        "message_id": "m1",
+    }
+    return DeviceFrame(json.dumps(data), data)
+
+
+def test_disconnect_marks_offline_until_the_device_talks_again():
+    presence = PresenceRegistry()
+    presence.mark_refreshed()
+    presence.observe(frame(SWITCH, "on_click"))
+    presence.observe(frame("camera", "on_click"))
+    assert presence.connected_devices() == [SWITCH]
+    presence.observe(frame(SWITCH, "device_disconnect"))
+    assert not presence.is_connected(SWITCH)
+    assert SWITCH in presence.offline
+    presence.observe(frame(SWITCH, "on_click"))
+    assert presence.is_connected(SWITCH)
+    assert len(presence) == 1
+
+
+def test_devices_not_seen_since_the_refresh_drop_out():
+    presence = PresenceRegistry(stale_after=60)
+    assert presence.is_stale()
+    presence.observe(frame(SWITCH, "on_click"))
+    presence.observe(frame(LAMP, "on_click"))
+    presence.mark_refreshed()
+    assert not presence.is_stale()
+    presence.observe(frame(LAMP, "get_connected_devices", direction=2))
+    assert presence.connected_devices() == [LAMP]
+    presence.refreshed_at -= 61
+    assert presence.is_stale()
+
+
+def test_router_answers_the_device_list_until_it_is_stale(router):
+    query = frame("", "get_connected_devices")
+    router._route_to_device(query)
+    assert router.sent == [query]
+    router.send_to_server(frame(LAMP, "get_connected_devices", direction=2))
+    for _ in router.outbox.pop_due():
+        pass
+    router._route_to_device(query)
+    assert router.sent == [query]
+    [(_, reply)] = router.outbox.pop_due()
+    reply = json.loads(reply.payload)["payload"]
+    assert (reply["device_id"], reply["direction"]) == (LAMP, 2)
+    router.presence.refreshed_at -= router.presence.stale_after + 1
+    router._route_to_device(query)
+    assert router.sent == [query, query]
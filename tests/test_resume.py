@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+from router.lanes import LaneKind
+from router.outbox import RetryPolicy
+
+
+def test_server_seq_is_the_contiguous_prefix(router, server_message):
+    for seq, expected in [(1, 1), (3, 1), (4, 1), (2, 4), (5, 5)]:
+        router._route(server_message(seq))
+        assert router.server_seq == expected
+    assert len(router.sent) == 5
+
+
+def test_new_server_session_starts_over(router, server_message):
+    router._route(server_message(1))
+    router._route(server_message(3))
+    router._on_resume({"session": "other", "peer": router.session, "seq": 0})
+    router._route(server_message(1))
+    router._route(server_message(2))
+    assert router.server_seq == 2
+
+
+def test_retries_keep_their_seq_and_resume_acks_only_the_prefix(make_outbox, put):
+    outbox = make_outbox(policy=RetryPolicy(interval=60, max_tries=5))
+    ids = [put(outbox, LaneKind.STATE) for _ in range(3)]
+    first = {message_id: message.seq for message_id, message in outbox.pop_due()}
+    assert list(first.values()) == [1, 2, 3]
+    assert outbox.retry_now() == 3
+    retried = {message_id: message.seq for message_id, message in outbox.pop_due()}
+    assert retried == first
+    # The server got 1 and 3 but not 2, so it resumes at 1.
+    assert outbox.ack_through(1) == 1
+    assert ids[0] not in outbox
+    assert outbox.retry_now() == 2
+    resent = [message_id for message_id, _ in outbox.pop_due()]
+    assert resent == ids[1:]
+    assert outbox.ack_through(3) == 2
+    assert len(outbox) == 0
+
+
+def test_backoff_resets_on_the_first_valid_frame(router, server_message):
+    router.backoff.next_delay()
+    router.backoff.next_delay()
+
+    async def handle(message):
+        await router._handle(None, message)
+
+    asyncio.run(handle("not json"))
+    assert router.backoff.attempt == 2
+    asyncio.run(handle(json.dumps(server_message(1))))
+    assert router.backoff.attempt == 0
@@ -0,0 +1,77 @@
+import json
+
+from device_message.frame import DeviceFrame
+from router.rules import RuleEngine
+from router.state_cache import StateCache
+
+SWITCH = "02:00:00:00:00:01"
+LAMP = "02:00:00:00:00:02"
+
+
+def frame(device_id: str, command: str, peripheral_id=None, payload=None):
+    data = {"device_id": device_id, "command": command}
+    if peripheral_id is not None:
+        data["peripheral_id"] = peripheral_id
+    if payload is not None:
+        data["payload"] = payload
+    return DeviceFrame(json.dumps(data), data)
+
+
+def rules(*entries) -> DeviceFrame:
+    return frame(SWITCH, "update_rule", payload={"rules": list(entries)})
+
+
+def toggle_lamp(trigger: dict) -> dict:
+    action = {"device_id": LAMP, "peripheral_id": 3, "command": "toggle"}
+    return {"id": "r1", "trigger": trigger, "actions": [action]}
+
+
+def test_matching_event_triggers_the_actions():
+    engine = RuleEngine()
+    engine.update(
+        rules(
+            toggle_lamp(
+                {"device_id": SWITCH, "peripheral_id": 1, "command": "on_click"}
+            )
+        )
+    )
+    assert engine.match(frame(SWITCH, "on_click", 2)) == []
+    [action] = engine.match(frame(SWITCH, "on_click", 1))
+    assert (action.device_id, action.peripheral_id, action.command) == (
+        LAMP,
+        3,
+        "toggle",
+    )
+    assert json.loads(action.raw) == action.data
+    assert action.message_id
+
+
+def test_wildcard_peripheral_and_replacement():
+    engine = RuleEngine()
+    engine.update(rules(toggle_lamp({"device_id": SWITCH, "command": "on_click"})))
+    assert len(engine.match(frame(SWITCH, "on_click", 7))) == 1
+    engine.update(rules({"trigger": {"device_id": SWITCH}, "actions": []}))
+    assert len(engine) == 0
+    assert engine.match(frame(SWITCH, "on_click", 7)) == []
+
+
+def test_router_runs_rules_before_the_event_goes_up(router):
+    router.rules.update(
+        rules(toggle_lamp({"device_id": SWITCH, "command": "on_click"}))
+    )
+    router.send_to_server(frame(SWITCH, "on_click", 1))
+    assert [action.device_id for action in router.sent] == [LAMP]
+    assert len(router.outbox) == 1
+
+
+def test_rule_actions_mark_the_cached_state_stale(router):
+    router.state_cache = StateCache()
+    router.rules.update(
+        rules(toggle_lamp({"device_id": SWITCH, "command": "on_click"}))
+    )
+    router.send_to_server(frame(LAMP, "on_update_state", 3, {"on": False}))
+    read = frame(LAMP, "get_state", 3)
+    assert router.state_cache.answer(read) is not None
+    router.send_to_server(frame(SWITCH, "on_click", 1))
+    assert [action.command for action in router.sent] == ["toggle"]
+    assert router.state_cache.answer(read) is None
@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+from device_message.enums import MessageCommand, MessageDirection
+from device_message.frame import DeviceFrame
+from router.state_cache import StateCache
+
+DEVICE = "02:00:00:00:00:01"
+
+
+def frame(command: MessageCommand, direction: MessageDirection, payload=None):
+    data = {
+        "direction": direction.value,
+        "command": command.value,
+        "type": 0,
+        "device_id": DEVICE,
+        "peripheral_id": 1,
+        "message_id": "m1",
+    }
+    if payload is not None:
+        data["payload"] = payload
+    return DeviceFrame(json.dumps(data), data)
+
+
+def report(payload):
+    return frame(MessageCommand.ON_UPDATE_STATE, MessageDirection.INTENT, payload)
+
+
+def read():
+    return frame(MessageCommand.GET_STATE, MessageDirection.INTENT)
+
+
+def test_unchanged_reports_are_suppressed_until_refresh():
+    cache = StateCache(refresh_interval=60)
+    assert cache.observe(report({"on": True}))
+    assert not cache.observe(report({"on": True}))
+    assert cache.observe(report({"on": False}))
+    cache._entries[(DEVICE, 1)].fields["state"].forwarded -= 60
+    assert cache.observe(report({"on": False}))
+    assert cache.suppressed == 1
+
+
+def test_reads_are_answered_until_a_command_or_max_age():
+    cache = StateCache(max_age=60)
+    assert cache.answer(read()) is None
+    cache.observe(report({"on": True}))
+    reply = cache.answer(read())
+    assert reply.payload == {"on": True}
+    assert reply.data["direction"] == MessageDirection.RESULT.value
+    assert reply.data["version"] == 1
+    cache.invalidate(frame(MessageCommand.TOGGLE, MessageDirection.INTENT))
+    assert cache.answer(read()) is None
+    cache.observe(report({"on": True}))
+    assert cache.answer(read()) is not None
+    cache._entries[(DEVICE, 1)].fields["state"].at -= 60
+    assert cache.answer(read()) is None
+
+
+def test_restart_forgets_the_device():
+    cache = StateCache()
+    cache.observe(report({"on": True}))
+    cache.observe(frame(MessageCommand.RESTART, MessageDirection.INTENT))
+    assert len(cache) == 0
+
+
+def test_snapshot_survives_a_restart(tmp_path):
+    path = str(tmp_path / "state.json")
+
+    async def scenario():
+        cache = StateCache(path, snapshot_interval=60)
+        cache.observe(report({"on": True}))
+        task = asyncio.create_task(cache.run())
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(scenario())
+    cache = StateCache(path)
+    assert cache.answer(read()).payload == {"on": True}
@@ -0,0 +1,76 @@
+import asyncio
+import time
+from uuid import uuid4
+
+from router.store import OutboxStore
+
+CREATE = (
+    "CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY, "
+    "message_id BLOB UNIQUE NOT NULL, payload TEXT NOT NULL)"
+)
+
+
+def stored(path) -> dict:
+    store = OutboxStore(path)
+    try:
+        return dict(store.load())
+    finally:
+        store._conn.close()
+
+
+def test_failed_flush_is_retried(tmp_path):
+    path = tmp_path / "outbox.db"
+    kept, acked, later = uuid4(), uuid4(), uuid4()
+    results = []
+
+    async def scenario():
+        store = OutboxStore(path, commit_interval=0.01)
+        store._conn.execute("DROP TABLE outbox")
+        flush = store._flush
+
+        def flaky(puts, acks):
+            flush(puts, acks)
+            if not results:
+                store._conn.execute(CREATE)
+            results.append(store._failed is None)
+
+        store._flush = flaky
+        store.append(kept, "kept")
+        store.append(acked, "acked")
+        task = asyncio.create_task(store.run())
+        while not results:
+            await asyncio.sleep(0.01)
+        store.remove(acked)
+        store.append(later, "later")
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert results[0] is False
+    assert stored(path) == {kept: "kept", later: "later"}
+
+
+def test_batch_failing_during_cancel_is_written_at_shutdown(tmp_path):
+    path = tmp_path / "outbox.db"
+    message_id = uuid4()
+
+    async def scenario():
+        store = OutboxStore(path, commit_interval=0.01)
+        store._conn.execute("DROP TABLE outbox")
+        flush = store._flush
+
+        def slow(puts, acks):
+            time.sleep(0.1)
+            flush(puts, acks)
+            store._conn.execute(CREATE)
+
+        store._flush = slow
+        store.append(message_id, "payload")
+        task = asyncio.create_task(store.run())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert stored(path) == {message_id: "payload"}
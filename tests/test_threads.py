@@ -0,0 +1,31 @@
+import asyncio
+import threading
+import time
+
+from threads import run_in_thread_to_completion
+
+
+def test_cancel_waits_for_the_thread():
+    active = threading.Lock()
+    calls = []
+
+    def write(name: str):
+        if not active.acquire(blocking=False):
+            calls.append("overlap")
+        time.sleep(0.05)
+        calls.append(name)
+        active.release()
+        return name
+
+    async def scenario():
+        assert await run_in_thread_to_completion(write, "first") == "first"
+        task = asyncio.create_task(run_in_thread_to_completion(write, "second"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # What a writer does in its finally after the cancel.
+        write("final")
+        return task.cancelled()
+
+    assert asyncio.run(scenario())
+    assert calls == ["first", "second", "final"]
@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import logging
+import os
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from device_message.device_message import DeviceMessage
+from device_message.frame import DeviceFrame
+from webapp.rollout import RolloutScheduler
+from webapp.webapp import Webapp
+
+FIRMWARE = b"firmware" * 1000
+
+
+@pytest.fixture
+def webapp(tmp_path, monkeypatch) -> Webapp:
+    monkeypatch.chdir(tmp_path)
+    webapp = Webapp(SimpleNamespace(send_to_device=None))
+    webapp.notified = []
+    webapp.rollout.notify = webapp.notified.append
+    return webapp
+
+
+def update(device_id: str, url: str, sha256: str = None) -> DeviceMessage:
+    payload = {"to_device": "esp32", "version": "1.0", "url": url}
+    if sha256:
+        payload["sha256"] = sha256
+    return DeviceMessage(
+        direction=1,
+        command="update_firmware",
+        type=2,
+        scope=2,
+        device_id=device_id,
+        peripheral_id=0,
+        message_id="m1",
+        payload=payload,
+    )
+
+
+async def firmware_server() -> TestServer:
+    async def serve(request):
+        server.fetches += 1
+        # Long enough for the other requests to find the download running.
+        await asyncio.sleep(0.05)
+        return web.Response(body=FIRMWARE)
+
+    app = web.Application()
+    app.router.add_get("/firmware.bin", serve)
+    server = TestServer(app)
+    server.fetches = 0
+    await server.start_server()
+    return server
+
+
+def test_concurrent_requests_for_a_build_download_it_once(webapp):
+    async def scenario():
+        server = await firmware_server()
+        url = str(server.make_url("/firmware.bin"))
+        sha256 = hashlib.sha256(FIRMWARE).hexdigest()
+        try:
+            await asyncio.gather(
+                *(
+                    webapp.download_if_needed(
+                        update(f"02:00:00:00:00:0{n}", url, sha256)
+                    )
+                    for n in range(1, 4)
+                )
+            )
+        finally:
+            await webapp.session.close()
+            await server.close()
+        return server.fetches
+
+    assert asyncio.run(scenario()) == 1
+    assert len(webapp.notified) == 3
+    with open(webapp.firmware.path("esp32_1.0.bin"), "rb") as f:
+        assert f.read() == FIRMWARE
+
+
+def test_download_with_the_wrong_checksum_is_discarded(webapp):
+    async def scenario():
+        server = await firmware_server()
+        url = str(server.make_url("/firmware.bin"))
+        try:
+            message = update("02:00:00:00:00:01", url, "00" * 32)
+            await webapp.download_if_needed(message)
+            await webapp.download_if_needed(message)
+        finally:
+            await webapp.session.close()
+            await server.close()
+        return server.fetches
+
+    # Nothing is kept, so the next request downloads again.
+    assert asyncio.run(scenario()) == 2
+    assert webapp.notified == []
+    assert webapp.firmware.path("esp32_1.0.bin") is None
+    assert os.listdir(webapp.firmware.tmp_dir) == []
+    assert os.listdir(webapp.firmware.blob_dir) == []
+
+
+def frame(device_id: str) -> DeviceFrame:
+    return DeviceFrame.from_message(update(device_id, "http://hub/ota"))
+
+
+def test_rollout_paces_devices_over_the_slots():
+    notified = []
+
+    async def scenario():
+        rollout = RolloutScheduler(notify=notified.append, max_active=2)
+        for n in range(1, 5):
+            rollout.submit(frame(f"02:00:00:00:00:0{n}"))
+        assert [f.device_id for f in notified] == [
+            "02:00:00:00:00:01",
+            "02:00:00:00:00:02",
+        ]
+        rollout.slot_timeout = 0.01
+        rollout.release("02:00:00:00:00:01")
+        assert notified[-1].device_id == "02:00:00:00:00:03"
+        rollout.release("02:00:00:00:00:02")
+        await asyncio.sleep(0.05)
+        return rollout
+
+    rollout = asyncio.run(scenario())
+    # The slots of devices that never fetched the file time out.
+    assert len(notified) == 4
+    assert rollout.active == {}
+    assert list(rollout.firmware_names()) == []
+
+
+def test_slot_is_released_when_a_resumed_download_reaches_the_end(webapp):
+    device_id = "02:00:00:00:00:01"
+    stored = webapp.firmware.tmp_path("esp32_1.0.bin")
+    with open(stored, "wb") as f:
+        f.write(FIRMWARE)
+    digest = hashlib.sha256(FIRMWARE).hexdigest()
+    webapp.firmware.add(
+        "esp32_1.0.bin", digest, webapp.firmware.store_blob(stored, digest)
+    )
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/ota", webapp.serve_firmware)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        webapp.rollout.submit(frame(device_id))
+        url = f"/ota?name=esp32_1.0.bin&device={device_id}"
+
+        async def fetch(**kwargs) -> tuple[int, bytes]:
+            resp = await client.get(url, **kwargs)
+            body = await resp.read()
+            # The slot is released once the handler has sent the body.
+            await asyncio.sleep(0.05)
+            return resp.status, body
+
+        try:
+            assert await fetch(headers={"Range": "bytes=0-99"}) == (206, FIRMWARE[:100])
+            assert webapp.rollout.is_active(device_id)
+            assert await fetch(headers={"Range": "bytes=100-"}) == (206, FIRMWARE[100:])
+            assert not webapp.rollout.is_active(device_id)
+            webapp.rollout.submit(frame(device_id))
+            assert await fetch() == (200, FIRMWARE)
+            assert not webapp.rollout.is_active(device_id)
+        finally:
+            await client.close()
+
+    asyncio.run(scenario())
+
+
+def log_levels_client(webapp: Webapp) -> TestClient:
+    app = web.Application()
+    app.router.add_get("/log-levels", webapp.get_log_levels)
+    app.router.add_post("/log-levels", webapp.set_log_levels)
+    return TestClient(TestServer(app))
+
+
+def test_log_levels_need_the_admin_token(webapp):
+    webapp.admin_token = "secret"
+    logger = logging.getLogger("test.webapp")
+
+    async def scenario():
+        client = log_levels_client(webapp)
+        await client.start_server()
+        auth = {"Authorization": "Bearer secret"}
+        try:
+            resp = await client.post("/log-levels", json={"test.webapp": "DEBUG"})
+            assert resp.status == 401
+            resp = await client.get("/log-levels")
+            assert resp.status == 401
+            resp = await client.post(
+                "/log-levels",
+                json={"test.webapp": "DEBUG", "mqtt": "LOUD"},
+                headers=auth,
+            )
+            assert resp.status == 400
+            assert logger.level == logging.NOTSET
+            resp = await client.post(
+                "/log-levels", json={"test.webapp": "debug"}, headers=auth
+            )
+            assert resp.status == 200
+            assert (await resp.json())["test.webapp"] == "DEBUG"
+        finally:
+            await client.close()
+
+    asyncio.run(scenario())
+    assert logger.level == logging.DEBUG
+
+
+def test_log_levels_are_read_only_without_a_token(webapp):
+    async def scenario():
+        client = log_levels_client(webapp)
+        await client.start_server()
+        try:
+            resp = await client.post("/log-levels", json={"test.webapp": "DEBUG"})
+            assert resp.status == 403
+            resp = await client.get("/log-levels")
+            assert resp.status == 200
+        finally:
+            await client.close()
+
+    asyncio.run(scenario())
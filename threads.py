@@ -0,0 +1,21 @@
+import asyncio
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+
+async def run_in_thread_to_completion(fn: Callable[..., T], *args) -> T:
+    """
+    Run fn in a worker thread like asyncio.to_thread, but when the caller is
+    cancelled wait for fn to return before raising CancelledError.
+
+    A cancelled to_thread leaves the thread running, so a writer that does
+    its final write on cancel would otherwise use its file or connection
+    from two threads at once.
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(fn, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
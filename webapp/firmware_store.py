@@ -0,0 +1,247 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Callable, Iterable, Optional
+
+from pydantic import BaseModel, ValidationError
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# Seconds an access may move last_used before the index is written again.
+RECENCY_RESOLUTION = 60.0
+
+
+def firmware_name(payload: dict) -> Optional[str]:
+    device_chip = payload.get("to_device")
+    version = payload.get("version")
+    if not device_chip or not version:
+        return None
+    return f"{device_chip}_{version}.bin"
+
+
+class FirmwareEntry(BaseModel):
+    digest: str
+    size: int
+    mtime_ns: int
+    last_used: float = 0.0
+
+
+class FirmwareStore:
+    """
+    Content addressed storage for firmware files.
+
+    Every binary is kept once under blobs/<sha256>, and index.json maps the
+    firmware names ({chip}_{version}.bin) onto their digest. The index also
+    records size and mtime of each blob, so at startup it is checked with a
+    stat per blob instead of hashing every file again, and when each name
+    was last used, to the minute. When the blobs exceed budget bytes the
+    least recently used names are dropped, except the ones reported by
+    protected(), and a blob is deleted with its last name.
+
+    Each name also has a file under names/ holding its digest. If the index
+    is lost or corrupt it is rebuilt from these and the blobs, which are
+    hashed once to check they still match their digest.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        budget: int,
+        protected: Callable[[], Iterable[str]] = lambda: (),
+    ):
+        self.root = root
+        self.budget = budget
+        self.protected = protected
+        self.blob_dir = os.path.join(root, "blobs")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.name_dir = os.path.join(root, "names")
+        self.index_path = os.path.join(root, "index.json")
+        self.entries: dict[str, FirmwareEntry] = {}
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        os.makedirs(self.name_dir, exist_ok=True)
+        self._load()
+
+    @property
+    def size(self) -> int:
+        sizes = {entry.digest: entry.size for entry in self.entries.values()}
+        return sum(sizes.values())
+
+    def path(self, name: str) -> Optional[str]:
+        """
+        Path of the blob stored for name, marking it as recently used.
+        """
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        now = time.time()
+        if now - entry.last_used > RECENCY_RESOLUTION:
+            entry.last_used = now
+            self._save()
+        return self._blob_path(entry.digest)
+
+    def tmp_path(self, name: str) -> str:
+        return os.path.join(self.tmp_dir, f"{name}.part")
+
+    def store_blob(self, tmp_path: str, digest: str) -> os.stat_result:
+        """
+        Move a downloaded file to the blob of its digest. If the same binary
+        is already stored the download is discarded. Blocking, and safe to
+        run in a worker thread as it does not touch the index.
+        """
+        blob_path = self._blob_path(digest)
+        if os.path.exists(blob_path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, blob_path)
+        return os.stat(blob_path)
+
+    def add(self, name: str, digest: str, stat: os.stat_result) -> str:
+        """
+        Record a blob written by store_blob under name and evict what no
+        longer fits the budget. Must run on the event loop, which owns the
+        index and the rollout state behind protected().
+        """
+        self.entries[name] = FirmwareEntry(
+            digest=digest,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            last_used=time.time(),
+        )
+        self._write_name(name, digest)
+        self._evict(keep=name)
+        self._save()
+        return self._blob_path(digest)
+
+    def _evict(self, keep: str) -> None:
+        total = self.size
+        if total <= self.budget:
+            return
+        protected = set(self.protected())
+        protected.add(keep)
+        for name, entry in sorted(
+            self.entries.items(), key=lambda item: item[1].last_used
+        ):
+            if total <= self.budget:
+                break
+            if name in protected:
+                continue
+            del self.entries[name]
+            os.remove(self._name_path(name))
+            if not any(e.digest == entry.digest for e in self.entries.values()):
+                os.remove(self._blob_path(entry.digest))
+                total -= entry.size
+            logger.info(f"Evicted firmware {name}")
+        if total > self.budget:
+            logger.warning(
+                f"Firmware store uses {total} bytes over a budget of {self.budget}"
+            )
+
+    def _load(self) -> None:
+        try:
+            with open(self.index_path) as f:
+                raw = json.load(f)
+            if not isinstance(raw, dict):
+                raise ValueError("index is not an object")
+        except FileNotFoundError:
+            raw = self._rebuild()
+        except ValueError as e:
+            logger.error(f"Rebuilding corrupt firmware index: {e}")
+            raw = self._rebuild()
+        for name, data in raw.items():
+            try:
+                entry = FirmwareEntry.model_validate(data)
+            except ValidationError as e:
+                logger.error(f"Ignoring firmware index entry {name}: {e}")
+                continue
+            try:
+                stat = os.stat(self._blob_path(entry.digest))
+            except FileNotFoundError:
+                continue
+            if stat.st_size == entry.size and stat.st_mtime_ns == entry.mtime_ns:
+                self.entries[name] = entry
+        self._import_legacy()
+        names = set(os.listdir(self.name_dir))
+        for name in names - self.entries.keys():
+            os.remove(self._name_path(name))
+        for name in self.entries.keys() - names:
+            self._write_name(name, self.entries[name].digest)
+        digests = {entry.digest for entry in self.entries.values()}
+        for blob in os.listdir(self.blob_dir):
+            if blob not in digests:
+                os.remove(os.path.join(self.blob_dir, blob))
+        for part in os.listdir(self.tmp_dir):
+            os.remove(os.path.join(self.tmp_dir, part))
+        self._save()
+        logger.info(
+            f"Firmware store holds {len(self.entries)} files, {self.size} bytes"
+        )
+
+    def _rebuild(self) -> dict:
+        """
+        Index entries for the names whose blob still matches its digest.
+        """
+        raw = {}
+        matches: dict[str, bool] = {}
+        for name in os.listdir(self.name_dir):
+            try:
+                with open(self._name_path(name)) as f:
+                    digest = f.read()
+                blob_path = self._blob_path(digest)
+                if digest not in matches:
+                    matches[digest] = _hash(blob_path) == digest
+                stat = os.stat(blob_path)
+            except OSError:
+                continue
+            if matches[digest]:
+                raw[name] = {
+                    "digest": digest,
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                }
+        if raw:
+            logger.warning(f"Recovered {len(raw)} firmware files from the blobs")
+        return raw
+
+    def _import_legacy(self) -> None:
+        """
+        Move files stored by name directly in root into the store. Only these
+        are hashed, once.
+        """
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.endswith(".bin") or not os.path.isfile(path):
+                continue
+            digest = _hash(path)
+            self.add(name, digest, self.store_blob(path, digest))
+
+    def _save(self) -> None:
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {name: entry.model_dump() for name, entry in self.entries.items()}, f
+            )
+        os.replace(tmp_path, self.index_path)
+
+    def _write_name(self, name: str, digest: str) -> None:
+        tmp_path = os.path.join(self.tmp_dir, f"{name}.name")
+        with open(tmp_path, "w") as f:
+            f.write(digest)
+        os.replace(tmp_path, self._name_path(name))
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest)
+
+    def _name_path(self, name: str) -> str:
+        return os.path.join(self.name_dir, name)
+
+
+def _hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Callable, Iterator
+
+from device_message.frame import DeviceFrame
+from webapp.firmware_store import firmware_name
+
+logger = logging.getLogger(__name__)
+
+
+class RolloutScheduler:
+    """
+    Limits how many devices download firmware from the hub at the same time.
+
+    Update commands are queued per device and sent only when a download
+    slot is free. A slot is released when the device has fetched the end of
+    the file or when slot_timeout expires, whichever comes first. Queuing a
+    device again replaces its pending command.
+    """
+
+    def __init__(
+        self,
+        notify: Callable[[DeviceFrame], None],
+        max_active: int = 4,
+        slot_timeout: float = 300.0,
+    ):
+        self.notify = notify
+        self.max_active = max_active
+        self.slot_timeout = slot_timeout
+        self.waiting: OrderedDict[str, DeviceFrame] = OrderedDict()
+        self.active: dict[str, tuple[asyncio.TimerHandle, DeviceFrame]] = {}
+
+    def submit(self, frame: DeviceFrame) -> None:
+        device_id = frame.device_id
+        self.waiting.pop(device_id, None)
+        self.waiting[device_id] = frame
+        self._fill()
+
+    def release(self, device_id: str) -> None:
+        slot = self.active.pop(device_id, None)
+        if slot is None:
+            return
+        slot[0].cancel()
+        self._fill()
+
+    def is_active(self, device_id: str) -> bool:
+        return device_id in self.active
+
+    def firmware_names(self) -> Iterator[str]:
+        """
+        Names of the firmware files queued or being downloaded.
+        """
+        for _, frame in self.active.values():
+            yield firmware_name(frame.payload)
+        for frame in self.waiting.values():
+            yield firmware_name(frame.payload)
+
+    def _expire(self, device_id: str) -> None:
+        if self.active.pop(device_id, None) is not None:
+            logger.warning(f"Firmware download slot of {device_id} timed out")
+            self._fill()
+
+    def _fill(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self.waiting and len(self.active) < self.max_active:
+            device_id, frame = self.waiting.popitem(last=False)
+            old = self.active.pop(device_id, None)
+            if old is not None:
+                old[0].cancel()
+            handle = loop.call_later(self.slot_timeout, self._expire, device_id)
+            self.active[device_id] = (handle, frame)
+            logger.info(
+                f"Starting firmware rollout for {device_id}, {len(self.waiting)} waiting"
+            )
+            self.notify(frame)
@@ -1,10 +1,29 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+from typing import Optional
+
 import aiohttp
 from aiohttp import web
 import os
 import socket
+import time
 
 from device_message.device_message import DeviceMessage
+from device_message.frame import DeviceFrame
+from logconfig import get_levels, set_levels
+from metrics import FIRMWARE_BYTES, REGISTRY
 from mqtt import Mqtt
+from webapp.firmware_store import FirmwareStore, firmware_name
+from webapp.rollout import RolloutScheduler
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+_downloaded = FIRMWARE_BYTES.labels("downloaded")
+_served = FIRMWARE_BYTES.labels("served")
 
 
 def get_local_ip() -> str:
@@ -19,16 +38,50 @@ def get_local_ip() -> str:
     return ip
 
 
+class _TimedFileResponse(web.FileResponse):
+    """
+    FileResponse that reports how long sending the body took.
+    """
+
+    def __init__(self, path, on_sent, **kwargs):
+        super().__init__(path, **kwargs)
+        self._on_sent = on_sent
+
+    async def prepare(self, request):
+        start = time.monotonic()
+        writer = await super().prepare(request)
+        self._on_sent(self, time.monotonic() - start)
+        return writer
+
+
 class Webapp:
-    def __init__(self, mqtt: Mqtt):
+    def __init__(
+        self,
+        mqtt: Mqtt,
+        max_active_downloads: int = 4,
+        firmware_budget: int = 64 * 1024 * 1024,
+        admin_token: Optional[str] = None,
+    ):
         self.FIRMWARE_DIR = os.path.join(os.getcwd(), "firmware")
         os.makedirs(self.FIRMWARE_DIR, exist_ok=True)
         self.address = None
+        self.admin_token = admin_token
         self.mqtt = mqtt
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._downloads: dict[str, asyncio.Task] = {}
+        self.rollout = RolloutScheduler(
+            self.mqtt.send_to_device, max_active=max_active_downloads
+        )
+        self.firmware = FirmwareStore(
+            self.FIRMWARE_DIR, firmware_budget, protected=self.rollout.firmware_names
+        )
 
     async def start(self, port=8452):
         app = web.Application()
         app.router.add_get("/ota", self.serve_firmware)
+        app.router.add_get("/metrics", self.serve_metrics)
+        app.router.add_get("/log-levels", self.get_log_levels)
+        app.router.add_post("/log-levels", self.set_log_levels)
         runner = web.AppRunner(app)
         await runner.setup()
         local_ip = get_local_ip()
@@ -37,34 +90,144 @@ class Webapp:
         await site.start()
 
     async def download_if_needed(self, message: DeviceMessage) -> None:
-        device_chip = message.payload.get("to_device")
-        version = message.payload.get("version")
+        filename = firmware_name(message.payload)
         url = message.payload.get("url")
-        if not device_chip or not version or not url:
+        if not filename or not url:
             return
 
-        filename = f"{device_chip}_{version}.bin"
-        filepath = os.path.join(self.FIRMWARE_DIR, filename)
-        if not os.path.exists(filepath):
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        data = await resp.read()
-                        with open(filepath, "wb") as f:
-                            f.write(data)
-                    else:
-                        raise web.HTTPNotFound(text="Firmware not available")
-        message.payload["url"] = f"{self.address}?name={filename}"
-        self.mqtt.send_to_device(message)
+        if self.firmware.path(filename) is None:
+            # Every device updated to the same build waits on one download.
+            task = self._downloads.get(filename)
+            if task is None:
+                task = asyncio.create_task(
+                    self._download(url, filename, message.payload.get("sha256"))
+                )
+                self._downloads[filename] = task
+                task.add_done_callback(lambda _: self._downloads.pop(filename, None))
+            try:
+                await asyncio.shield(task)
+            except Exception as e:
+                logger.error(f"Failed to download firmware {filename}: {e}")
+                return
+        message.payload["url"] = (
+            f"{self.address}?name={filename}&device={message.device_id}"
+        )
+        self.rollout.submit(DeviceFrame.from_message(message))
+
+    async def _download(self, url: str, filename: str, sha256: Optional[str]):
+        """
+        Stream the firmware into a temporary file and move it into the store
+        only once it is complete and matches the expected checksum.
+        """
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=4),
+                timeout=aiohttp.ClientTimeout(total=600),
+            )
+        tmp_path = self.firmware.tmp_path(filename)
+        digest = hashlib.sha256()
+        try:
+            async with self.session.get(url) as resp:
+                if resp.status != 200:
+                    raise web.HTTPNotFound(text="Firmware not available")
+                f = await asyncio.to_thread(open, tmp_path, "wb")
+                try:
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        digest.update(chunk)
+                        _downloaded.inc(len(chunk))
+                        await asyncio.to_thread(f.write, chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+            if sha256 and digest.hexdigest() != sha256.lower():
+                raise ValueError(f"Checksum mismatch for {url}")
+            stat = await asyncio.to_thread(
+                self.firmware.store_blob, tmp_path, digest.hexdigest()
+            )
+            self.firmware.add(filename, digest.hexdigest(), stat)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
     async def serve_firmware(self, request):
+        """
+        Serve a firmware file. FileResponse answers Range, If-Range and ETag
+        requests and sends the body with sendfile, so interrupted downloads
+        resume where they stopped.
+        """
         name = request.query.get("name")
-        if not name:
+        if not name or os.path.basename(name) != name:
             raise web.HTTPBadRequest()
-        return web.FileResponse(
-            os.path.join(self.FIRMWARE_DIR, name),
+        filepath = self.firmware.path(name)
+        if filepath is None:
+            raise web.HTTPNotFound()
+        device_id = request.query.get("device")
+
+        def on_sent(response: web.FileResponse, elapsed: float):
+            sent = response.content_length or 0
+            _served.inc(sent)
+            logger.info(
+                f"Served {sent} bytes of {name} to {device_id or request.remote} "
+                f"in {elapsed:.2f}s ({sent / max(elapsed, 1e-6) / 1024:.1f} KiB/s)"
+            )
+            if device_id and self._reached_end(response):
+                self.rollout.release(device_id)
+
+        return _TimedFileResponse(
+            filepath,
+            on_sent,
             headers={
                 "Content-Type": "application/octet-stream",
                 "Content-Disposition": f'attachment; filename="firmware.bin"',
             },
         )
+
+    async def serve_metrics(self, request):
+        self._authorize(request)
+        return web.Response(
+            text=REGISTRY.render(), content_type="text/plain", charset="utf-8"
+        )
+
+    async def get_log_levels(self, request):
+        self._authorize(request)
+        return web.json_response(get_levels())
+
+    async def set_log_levels(self, request):
+        """
+        Change log levels at runtime, e.g. {"router": "DEBUG", "mqtt": "INFO"}.
+        Either every level is applied or none.
+        """
+        self._authorize(request, write=True)
+        try:
+            levels = await request.json()
+            set_levels({name: str(level).upper() for name, level in levels.items()})
+        except (ValueError, AttributeError, TypeError) as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return web.json_response(get_levels())
+
+    def _authorize(self, request: web.Request, write: bool = False) -> None:
+        """
+        Admin routes need the admin token as a bearer token. Without a token
+        configured only the read only ones are served.
+        """
+        if self.admin_token is None:
+            if write:
+                raise web.HTTPForbidden(text="Set ADMIN_TOKEN to enable this route")
+            return
+        expected = f"Bearer {self.admin_token}".encode()
+        given = request.headers.get("Authorization", "").encode()
+        if not hmac.compare_digest(given, expected):
+            raise web.HTTPUnauthorized(headers={"WWW-Authenticate": "Bearer"})
+
+    @staticmethod
+    def _reached_end(response: web.StreamResponse) -> bool:
+        if response.status in (200, 304):
+            return True
+        if response.status != 206:
+            return False
+        content_range = response.headers.get("Content-Range", "")
+        try:
+            span, size = content_range.removeprefix("bytes ").split("/")
+            return int(span.split("-")[1]) + 1 == int(size)
+        except (ValueError, IndexError):
+            return False